@@ -0,0 +1,28 @@
+"""
+Gunicorn configuration for serving the ASGI application with Uvicorn workers.
+
+    gunicorn -c config/gunicorn.conf.py config.asgi:application
+
+Every setting can be overridden through the environment, e.g. WEB_CONCURRENCY.
+"""
+
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+worker_class = 'uvicorn.workers.UvicornWorker'
+
+# Async workers overlap many requests each, so one per core is enough
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then to keep memory growth from image decoding in check
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = 200
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,11 +42,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'photos.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'photos.middleware.ProfileMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -55,7 +58,7 @@ ROOT_URLCONF = 'config.urls'
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        'DIRS': [BASE_DIR / 'templates'],
+        'DIRS': [BASE_DIR / 'config' / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
@@ -73,13 +76,91 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
+# SQLite is the default for development. Set DATABASE_ENGINE=postgresql and
+# the POSTGRES_* variables to run against PostgreSQL.
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'sqlite')
+
+if DATABASE_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'photos'),
+            'USER': os.environ.get('POSTGRES_USER', 'photos'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            # Keep connections open across requests and verify them before
+            # reuse, so a restarted server doesn't surface as request errors.
+            'CONN_MAX_AGE': int(os.environ.get('CONN_MAX_AGE', 600)),
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+        }
+    }
+
+# Set DATABASE_PROFILE=performance to let list pages keep reading while a sync
+# is writing: WAL journaling, relaxed fsyncs, memory-mapped reads and a larger
+# page cache, applied to every new SQLite connection.
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'default')
+
+SQLITE_PERFORMANCE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # negative values are KiB
+    'busy_timeout': 5000,  # milliseconds
+    'temp_store': 'MEMORY',
+}
+
+if DATABASE_ENGINE != 'postgresql' and DATABASE_PROFILE == 'performance':
+    DATABASES['default']['OPTIONS'] = {
+        'init_command': ';'.join(
+            f'PRAGMA {name}={value}' for name, value in SQLITE_PERFORMANCE_PRAGMAS.items()
+        ),
+        # Take the write lock up front so writers queue on busy_timeout
+        # instead of failing when upgrading a read transaction.
+        'transaction_mode': 'IMMEDIATE',
+    }
+
+
+# Cache
+# Local memory by default. Set CACHE_BACKEND to 'file' or 'redis' (any
+# Redis-compatible server) to share the cache between workers.
+
+CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'photos'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', str(BASE_DIR / 'django_cache')),
+    'redis': ('django.core.cache.backends.redis.RedisCache', 'redis://localhost:6379/1'),
+}
+CACHE_BACKEND, CACHE_LOCATION = CACHE_BACKENDS[os.environ.get('CACHE_BACKEND', 'locmem')]
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.environ.get('CACHE_LOCATION', CACHE_LOCATION),
+        'TIMEOUT': 300,
     }
 }
 
+# Photo list result ids and sidebar fragments are cached per filter set and
+# library generation for this many seconds, keeping up to PHOTO_LIST_CACHE_IDS
+# ids (100 pages) per filter set.
+PHOTO_LIST_CACHE_TIMEOUT = 300
+PHOTO_LIST_CACHE_IDS = 5000
+
+# Largest page the photo list API returns
+PHOTO_API_MAX_ROWS = 500
+
+# Sprite sheets pack up to this many square tiles of at most SPRITE_MAX_TILE
+# pixels into one image
+SPRITE_MAX_TILES = 100
+SPRITE_MAX_TILE = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -117,6 +198,151 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+
+# Thumbnail cache
+# Rendered thumbnails are stored here, keyed by size and photo uuid.
+
+THUMBNAIL_CACHE_DIR = BASE_DIR / 'thumbnail_cache'
+
+# Sizes the thumbnail view renders; each one is cached separately per photo
+THUMBNAIL_SIZES = [150, 300, 600]
+
+# Renders of the same thumbnail are coalesced, and at most this many images
+# are decoded at once per process. Left unset, it is derived from the CPU
+# count and the memory available for THUMBNAIL_DECODE_MEMORY per render.
+THUMBNAIL_RENDER_CONCURRENCY = int(os.environ.get('THUMBNAIL_RENDER_CONCURRENCY', 0)) or None
+THUMBNAIL_DECODE_MEMORY = 256 * 1024 * 1024
+
+# Larger images are refused instead of decoded (about 30000 x 6000)
+THUMBNAIL_MAX_PIXELS = 180_000_000
+
+
+# Media serving
+# Async media views run blocking file reads and image decoding on a thread
+# pool of this size and stream originals in chunks of MEDIA_CHUNK_SIZE bytes.
+
+MEDIA_IO_THREADS = int(os.environ.get('MEDIA_IO_THREADS', min(32, (os.cpu_count() or 1) + 4)))
+MEDIA_CHUNK_SIZE = 256 * 1024
+
+
+# Filesystem import
+# `sync_photos_command --source filesystem` hashes new and changed files and
+# reads their EXIF in this many processes. Left unset, one per CPU.
+
+FILESYSTEM_IMPORT_WORKERS = int(os.environ.get('FILESYSTEM_IMPORT_WORKERS', 0)) or None
+
+
+# Events
+# Photos sorted by date are split into events where more than EVENT_GAP_HOURS
+# pass between two of them, or where two located photos in a row are more
+# than EVENT_DISTANCE_KM apart. Sync regroups the events around what changed.
+
+EVENT_GAP_HOURS = 6
+EVENT_DISTANCE_KM = 50
+
+
+# Job queue
+# Management commands queued from the jobs page, or after a sync, run in
+# `run_jobs` workers. JOB_COMMANDS lists the commands that may be queued and
+# how many of each may run at once across all workers. After a sync that
+# changed photos, JOBS_AFTER_SYNC are queued for those photos only. A running
+# job whose worker has not reported for JOB_STALE_AFTER seconds is queued
+# again, up to JOB_MAX_ATTEMPTS times.
+
+JOB_COMMANDS = {
+    'sync_photos_command': 1,
+    'warm_thumbnails': 2,
+    'compute_photo_hashes': 1,
+    'embed_photos': 1,
+    'cluster_faces': 1,
+    'cluster_events': 1,
+    'build_snapshot': 1,
+    'optimize_database': 1,
+}
+JOBS_AFTER_SYNC = [
+    command for command in
+    os.environ.get('JOBS_AFTER_SYNC', 'warm_thumbnails,compute_photo_hashes').split(',')
+    if command
+]
+JOB_STALE_AFTER = 300
+JOB_MAX_ATTEMPTS = 3
+JOB_POLL_INTERVAL = 2
+
+
+# Semantic search
+# Image and text embeddings come from the same CLIP model and are stored in
+# Qdrant, keyed by Photo primary key.
+
+QDRANT_HOST = os.environ.get('QDRANT_HOST', 'localhost')
+QDRANT_PORT = int(os.environ.get('QDRANT_PORT', 6333))
+QDRANT_TIMEOUT = 5
+QDRANT_COLLECTION = 'photos'
+EMBEDDING_MODEL = os.environ.get('EMBEDDING_MODEL', 'clip-ViT-B-32')
+SEMANTIC_SEARCH_LIMIT = 500
+
+# After a failed semantic search (no model, Qdrant unreachable), queries fall
+# back to text search for this many seconds before Qdrant is tried again
+SEMANTIC_RETRY_AFTER = 30
+
+
+# Face clustering
+# Faces are cropped from a cached rendition of this size and grouped when the
+# cosine similarity to a cluster centroid reaches the threshold.
+
+FACE_SOURCE_SIZE = 1024
+FACE_CLUSTER_THRESHOLD = 0.85
+
+
+# Bitmap index
+# When enabled, list pages filtered only by flags and tags are answered from
+# a per-process numpy index that is rebuilt after each sync, or after
+# PHOTO_BITMAP_INDEX_TTL seconds to pick up edits made outside of sync.
+
+PHOTO_BITMAP_INDEX = os.environ.get('PHOTO_BITMAP_INDEX', '') == '1'
+PHOTO_BITMAP_INDEX_TTL = 60
+
+
+# Library state
+# Sync increments a generation number stored here. With PHOTO_SNAPSHOT
+# enabled it also writes a columnar snapshot of the library that web workers
+# memory-map for statistics and facet counts.
+
+LIBRARY_STATE_DIR = Path(os.environ.get('LIBRARY_STATE_DIR', BASE_DIR / 'library_state'))
+PHOTO_SNAPSHOT = os.environ.get('PHOTO_SNAPSHOT', '') == '1'
+
+
+# Ranking
+# Without a snapshot, the score matrix used by the ranking API is read from
+# the database and kept per process until the next sync or this many seconds.
+
+RANKING_CACHE_TTL = 300
+RANKING_MAX_RESULTS = 500
+
+# Metrics
+# Each web worker process writes its request metrics to METRICS_DIR at most
+# every METRICS_FLUSH_INTERVAL seconds, and /metrics/ adds up every worker's
+# file. The endpoint is open to staff and to the METRICS_ALLOWED_IPS, e.g.
+# the Prometheus server's address.
+
+METRICS_DIR = LIBRARY_STATE_DIR / 'metrics'
+METRICS_FLUSH_INTERVAL = 5
+METRICS_ALLOWED_IPS = [ip for ip in os.environ.get('METRICS_ALLOWED_IPS', '').split(',') if ip]
+
+
+# Profiling
+# With PROFILING=1, requests carrying an X-Profile header are profiled when
+# the user is staff or the header holds PROFILE_TOKEN. Reports of those and
+# of `sync_photos_command --profile` runs go to PROFILE_DIR, which keeps the
+# newest PROFILE_KEEP. Disabled, the middleware removes itself.
+
+PROFILING_ENABLED = os.environ.get('PROFILING', '') == '1'
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_DIR = Path(os.environ.get('PROFILE_DIR', BASE_DIR / 'profiles'))
+PROFILE_KEEP = 50
+PROFILE_TOP_QUERIES = 20
+PROFILE_TOP_FUNCTIONS = 40
+
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -0,0 +1,55 @@
+import os
+import zipfile
+
+from django.conf import settings
+
+from .media import StreamSink
+
+
+class ZipArchive:
+    """ZIP archive produced a piece at a time, for streaming responses.
+
+    Files are stored rather than compressed, since photos and videos are
+    already compressed, and are read in chunks as they are written. The
+    output is never seeked, so sizes and checksums follow each file in a
+    data descriptor, and ZIP64 records are used for files or archives past
+    4 GiB.
+    """
+
+    def __init__(self, chunk_size=None):
+        self.chunk_size = chunk_size or settings.MEDIA_CHUNK_SIZE
+        self._sink = StreamSink()
+        self._zip = zipfile.ZipFile(self._sink, 'w', zipfile.ZIP_STORED, allowZip64=True)
+        self._names = set()
+
+    def _unique(self, name):
+        """name, or name with a counter when already in the archive"""
+        stem, ext = os.path.splitext(name)
+        candidate, n = name, 1
+        while candidate.lower() in self._names:
+            n += 1
+            candidate = f'{stem} ({n}){ext}'
+        self._names.add(candidate.lower())
+        return candidate
+
+    def add_file(self, path, name):
+        """Yield the archive bytes for the file at path, stored as name.
+
+        Yields nothing for files that cannot be read.
+        """
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            return
+        with f:
+            info = zipfile.ZipInfo.from_file(path, self._unique(name), strict_timestamps=False)
+            with self._zip.open(info, 'w') as entry:
+                while chunk := f.read(self.chunk_size):
+                    entry.write(chunk)
+                    yield self._sink.take()
+        yield self._sink.take()
+
+    def close(self):
+        """Return the closing bytes: the central directory"""
+        self._zip.close()
+        return self._sink.take()
@@ -0,0 +1,154 @@
+import threading
+import time
+
+from django.conf import settings
+
+from .flags import FLAG_BITS, LIST_FLAG_FILTERS, list_filter_flags
+from .generation import current_generation
+from .models import Photo, Album, Person, Keyword, Label
+
+
+FACETS = {
+    'album': Album,
+    'person': Person,
+    'keyword': Keyword,
+    'label': Label,
+}
+
+# Photo list parameters the index can answer on its own
+SUPPORTED_PARAMS = set(LIST_FLAG_FILTERS) | set(FACETS) | {'videos', 'photos', 'page'}
+
+
+class PhotoBitmapIndex:
+    """In-memory index answering flag and tag filters without the database.
+
+    Rows are stored in list order (-date), so the selected rows of a boolean
+    mask are already in result order. Tag membership is kept as CSR arrays:
+    the rows of tag_ids[i] are rows[offsets[i]:offsets[i + 1]].
+    """
+
+    def __init__(self, ids, flags, facets, generation=0):
+        self.ids = ids
+        self.flags = flags
+        self.facets = facets
+        self.generation = generation
+        self.built_at = time.monotonic()
+
+    @classmethod
+    def build(cls):
+        import numpy as np
+
+        generation = current_generation()
+        photos = np.array(
+            Photo.objects.order_by('-date').values_list('id', 'flags'), dtype=np.int64
+        ).reshape(-1, 2)
+        ids, flags = photos[:, 0], photos[:, 1]
+
+        row_of = np.full(int(ids.max()) + 1 if len(ids) else 1, -1, dtype=np.int64)
+        row_of[ids] = np.arange(len(ids))
+
+        facets = {}
+        for param, model in FACETS.items():
+            links = np.array(
+                model.photos.through.objects.values_list(f'{param}_id', 'photo_id'),
+                dtype=np.int64,
+            ).reshape(-1, 2)
+            order = np.argsort(links[:, 0], kind='stable')
+            tag_column = links[order, 0]
+            tag_ids, starts = np.unique(tag_column, return_index=True)
+            facets[param] = (
+                tag_ids,
+                np.append(starts, len(tag_column)),
+                row_of[links[order, 1]],
+            )
+
+        return cls(ids, flags, facets, generation)
+
+    def select(self, fields=(), **tags):
+        """Return the ids, in list order, of photos with every flag in fields
+        that belong to every given tag (e.g. album=3)"""
+        import numpy as np
+
+        mask = sum(FLAG_BITS[field] for field in fields)
+        selected = (self.flags & mask) == mask
+
+        for param, tag_id in tags.items():
+            tag_ids, offsets, rows = self.facets[param]
+            member = np.zeros(len(self.ids), dtype=bool)
+            index = np.searchsorted(tag_ids, tag_id)
+            if index < len(tag_ids) and tag_ids[index] == tag_id:
+                member[rows[offsets[index]:offsets[index + 1]]] = True
+            selected &= member
+
+        return self.ids[selected]
+
+
+class PhotoIdList:
+    """Sequence of photos backed by an ordered id array.
+
+    Paginators only take len() and slices, and each slice loads just the
+    photos it needs in one query. When ids only holds the first results,
+    count is the full length and slices past the ids come from remainder, a
+    queryset returning the same photos in the same order.
+    """
+
+    def __init__(self, ids, queryset=None, count=None, remainder=None):
+        self.ids = ids
+        self.queryset = Photo.objects.all() if queryset is None else queryset
+        self.total = len(ids) if count is None else count
+        self.remainder = remainder
+
+    def __len__(self):
+        return self.total
+
+    def count(self):
+        return self.total
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        if self.remainder is not None and (key.stop is None or key.stop > len(self.ids)):
+            return list(self.remainder[key])
+        ids = [int(pk) for pk in self.ids[key]]
+        photos = self.queryset.in_bulk(ids)
+        return [photos[pk] for pk in ids if pk in photos]
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def get_index():
+    """Return the process-wide index, rebuilding it after a sync or once it
+    is too old"""
+    global _index
+    index = _index
+    if (
+        index is None
+        or index.generation != current_generation()
+        or time.monotonic() - index.built_at > settings.PHOTO_BITMAP_INDEX_TTL
+    ):
+        with _lock:
+            if _index is index:
+                _index = PhotoBitmapIndex.build()
+            index = _index
+    return index
+
+
+def supports(params):
+    """Whether the index can answer a photo list request by itself"""
+    if not settings.PHOTO_BITMAP_INDEX:
+        return False
+    if params.get('sort', '-date') != '-date':
+        return False
+    keys = {key for key, value in params.items() if value} - {'sort'}
+    if not keys <= SUPPORTED_PARAMS:
+        return False
+    return all(params[param].isdigit() for param in FACETS if params.get(param))
+
+
+def select_photos(params, queryset=None):
+    """Answer a photo list request from the index"""
+    tags = {param: int(params[param]) for param in FACETS if params.get(param)}
+    ids = get_index().select(list_filter_flags(params), **tags)
+    return PhotoIdList(ids, queryset)
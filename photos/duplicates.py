@@ -0,0 +1,125 @@
+from .thumbnails import open_image
+
+
+HASH_BITS = 64
+_SIGN_BIT = 1 << (HASH_BITS - 1)
+_MASK = (1 << HASH_BITS) - 1
+
+# Largest Hamming distance cluster_hashes() is asked to search
+MAX_THRESHOLD = 16
+
+
+def dhash(image):
+    """Compute a 64-bit difference hash for a PIL image"""
+    from PIL import Image
+
+    small = image.convert('L').resize((9, 8), Image.Resampling.LANCZOS)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(8):
+        offset = row * 9
+        for col in range(8):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def dhash_file(path):
+    """Compute the difference hash of an image file"""
+    with open_image(path) as img:
+        img.draft('L', (64, 64))
+        return dhash(img)
+
+
+def to_signed(value):
+    """Map an unsigned 64-bit hash onto the signed range of a BigIntegerField"""
+    return value - (1 << HASH_BITS) if value & _SIGN_BIT else value
+
+
+def to_unsigned(value):
+    """Inverse of to_signed()"""
+    return value & _MASK
+
+
+def hamming(a, b):
+    return ((a ^ b) & _MASK).bit_count()
+
+
+class BKTree:
+    """Burkhard-Keller tree over 64-bit hashes using Hamming distance.
+
+    Identical hashes share a node, so exact duplicates cost nothing extra.
+    """
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, value, item):
+        if self.root is None:
+            self.root = (value, [item], {})
+            return
+        node = self.root
+        while True:
+            node_value, items, children = node
+            distance = hamming(value, node_value)
+            if distance == 0:
+                items.append(item)
+                return
+            child = children.get(distance)
+            if child is None:
+                children[distance] = (value, [item], {})
+                return
+            node = child
+
+    def search(self, value, radius):
+        """Return all items whose hash is within radius of value"""
+        return [item for items in self._search(value, radius) for item in items]
+
+    def _search(self, value, radius):
+        """Yield the item lists of every node within radius of value"""
+        if self.root is None:
+            return
+        stack = [self.root]
+        while stack:
+            node_value, items, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= radius:
+                yield items
+            low, high = distance - radius, distance + radius
+            for child_distance, child in children.items():
+                if low <= child_distance <= high:
+                    stack.append(child)
+
+
+def cluster_hashes(hashes, threshold=4):
+    """Group items whose hashes are within threshold bits of each other.
+
+    hashes is an iterable of (item, hash) pairs. Returns a list of clusters
+    (lists of items) with more than one member, largest first.
+    """
+    parent = {}
+
+    def find(item):
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    tree = BKTree()
+    for item, value in hashes:
+        value = to_unsigned(value)
+        parent[item] = item
+        # Items sharing a node are already in one cluster, so a single
+        # representative per node is enough.
+        for items in tree._search(value, threshold):
+            root_a, root_b = find(item), find(items[0])
+            if root_a != root_b:
+                parent[root_a] = root_b
+        tree.add(value, item)
+
+    groups = {}
+    for item in parent:
+        groups.setdefault(find(item), []).append(item)
+
+    clusters = [group for group in groups.values() if len(group) > 1]
+    clusters.sort(key=len, reverse=True)
+    return clusters
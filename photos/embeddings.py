@@ -0,0 +1,119 @@
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+
+class SemanticSearchUnavailable(Exception):
+    pass
+
+
+_unavailable_until = 0
+
+
+@lru_cache(maxsize=1)
+def get_model():
+    """Load the CLIP model once per process, on first use"""
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        raise ImproperlyConfigured(
+            'Semantic search requires the sentence-transformers package'
+        )
+    return SentenceTransformer(settings.EMBEDDING_MODEL, device='cpu')
+
+
+@lru_cache(maxsize=1)
+def get_client():
+    """Return a shared Qdrant client"""
+    from qdrant_client import QdrantClient
+    return QdrantClient(
+        host=settings.QDRANT_HOST,
+        port=settings.QDRANT_PORT,
+        timeout=settings.QDRANT_TIMEOUT,
+    )
+
+
+def encode_images(images):
+    """Embed a list of PIL images into L2-normalized float32 vectors"""
+    return get_model().encode(
+        images, convert_to_numpy=True, normalize_embeddings=True
+    ).astype('float32')
+
+
+@lru_cache(maxsize=256)
+def encode_text(text):
+    """Embed a text query into the same space as encode_images()"""
+    vector = get_model().encode(
+        [text], convert_to_numpy=True, normalize_embeddings=True
+    )[0]
+    return tuple(vector.astype('float32').tolist())
+
+
+def ensure_collection():
+    """Create the photo collection in Qdrant if it does not exist yet"""
+    from qdrant_client.models import Distance, VectorParams
+
+    client = get_client()
+    if not client.collection_exists(settings.QDRANT_COLLECTION):
+        client.create_collection(
+            settings.QDRANT_COLLECTION,
+            vectors_config=VectorParams(
+                size=get_model().get_sentence_embedding_dimension(),
+                distance=Distance.COSINE,
+            ),
+        )
+
+
+def existing_ids(ids):
+    """Return the subset of photo ids that already have an embedding"""
+    points = get_client().retrieve(
+        settings.QDRANT_COLLECTION, ids, with_payload=False, with_vectors=False
+    )
+    return {point.id for point in points}
+
+
+def upsert_photos(ids, uuids, vectors):
+    """Store image embeddings keyed by Photo primary key"""
+    from qdrant_client.models import PointStruct
+
+    get_client().upsert(
+        settings.QDRANT_COLLECTION,
+        points=[
+            PointStruct(id=pk, vector=vector.tolist(), payload={'uuid': uuid})
+            for pk, uuid, vector in zip(ids, uuids, vectors)
+        ],
+    )
+
+
+def available():
+    """Whether semantic search is worth trying, i.e. has not failed recently"""
+    return time.monotonic() >= _unavailable_until
+
+
+def search_photo_ids(text, limit=None):
+    """Return photo ids most similar to a text query, best match first.
+
+    Raises SemanticSearchUnavailable when the model or Qdrant cannot be
+    used, without trying again for SEMANTIC_RETRY_AFTER seconds.
+    """
+    global _unavailable_until
+    if not available():
+        raise SemanticSearchUnavailable('Semantic search failed recently')
+    try:
+        from qdrant_client.models import SearchParams
+
+        response = get_client().query_points(
+            settings.QDRANT_COLLECTION,
+            query=list(encode_text(text)),
+            limit=limit or settings.SEMANTIC_SEARCH_LIMIT,
+            search_params=SearchParams(hnsw_ef=128),
+            with_payload=False,
+        )
+    except Exception as e:
+        # Missing packages, an unreachable server and a missing collection
+        # all surface differently; the photo list treats them alike
+        _unavailable_until = time.monotonic() + settings.SEMANTIC_RETRY_AFTER
+        raise SemanticSearchUnavailable(str(e) or type(e).__name__) from e
+    return [point.id for point in response.points]
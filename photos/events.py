@@ -0,0 +1,186 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min, OuterRef, Subquery
+
+from .models import Event, Photo
+
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Above this many separate windows of changes, one window spanning all of
+# them is rebuilt instead
+MAX_WINDOWS = 100
+
+FIELDS = ('id', 'date', 'latitude', 'longitude', 'place_name', 'is_movie', 'score__overall')
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km between arrays of coordinates in degrees"""
+    import numpy as np
+
+    lat1, lon1, lat2, lon2 = (np.radians(values) for values in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def segment(timestamps, latitudes, longitudes, gap, distance):
+    """Return the index at which each event starts, for photos sorted by date.
+
+    A new event starts when a photo is more than gap seconds after the one
+    before it, or when both have a location and are more than distance km
+    apart. Missing coordinates are NaN. Photos taken at the same moment are
+    never split, so events never overlap in time.
+    """
+    import numpy as np
+
+    if not len(timestamps):
+        return np.empty(0, dtype=np.intp)
+    elapsed = np.diff(timestamps)
+    moved = haversine_km(latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:])
+    breaks = (elapsed > gap) | ((moved > distance) & (elapsed > 0))
+    return np.concatenate(([0], np.flatnonzero(breaks) + 1))
+
+
+def _columns(rows):
+    import numpy as np
+
+    timestamps = np.array([row[1].timestamp() for row in rows], dtype=np.float64)
+    latitudes, longitudes = (
+        np.array([np.nan if row[i] is None else float(row[i]) for row in rows], dtype=np.float64)
+        for i in (2, 3)
+    )
+    return timestamps, latitudes, longitudes
+
+
+def _separated(*rows):
+    """Whether two consecutive photos belong to different events"""
+    return len(segment(*_columns(rows), *_thresholds())) == 2
+
+
+def _thresholds():
+    return settings.EVENT_GAP_HOURS * 3600, settings.EVENT_DISTANCE_KM
+
+
+def _build_event(rows, latitudes, longitudes):
+    """An unsaved Event for the photos in rows"""
+    import numpy as np
+
+    # Cover: the best scored photo, preferring stills
+    scores = [
+        (row[6] if row[6] is not None else -1) - (2 if row[5] else 0)
+        for row in rows
+    ]
+    places = Counter(row[4] for row in rows if row[4])
+    located = ~np.isnan(latitudes)
+    videos = sum(1 for row in rows if row[5])
+    return Event(
+        start=rows[0][1],
+        end=rows[-1][1],
+        place_name=places.most_common(1)[0][0] if places else '',
+        latitude=float(latitudes[located].mean()) if located.any() else None,
+        longitude=float(longitudes[located].mean()) if located.any() else None,
+        cover_id=rows[int(np.argmax(scores))][0],
+        photo_count=len(rows) - videos,
+        video_count=videos,
+    )
+
+
+def _window(lo, hi):
+    """Grow lo..hi until no event overlaps its edges and the photos just
+    outside it are separated from the photos inside"""
+    gap = timedelta(hours=settings.EVENT_GAP_HOURS)
+    while True:
+        span = Event.objects.filter(end__gte=lo - gap, start__lte=hi + gap).aggregate(
+            start=Min('start'), end=Max('end'),
+        )
+        lo = min(lo, span['start'] or lo)
+        hi = max(hi, span['end'] or hi)
+
+        fields = ('id', 'date', 'latitude', 'longitude')
+        before = Photo.objects.filter(date__lt=lo).order_by('-date', '-id').values_list(*fields).first()
+        first = Photo.objects.filter(date__gte=lo).order_by('date', 'id').values_list(*fields).first()
+        last = Photo.objects.filter(date__lte=hi).order_by('-date', '-id').values_list(*fields).first()
+        after = Photo.objects.filter(date__gt=hi).order_by('date', 'id').values_list(*fields).first()
+
+        grown = False
+        if before and first and not _separated(before, first):
+            lo, grown = before[1], True
+        if after and last and not _separated(last, after):
+            hi, grown = after[1], True
+        if not grown:
+            return lo, hi
+
+
+def rebuild_events(lo=None, hi=None):
+    """Recompute the events of the photos dated lo..hi, or of every photo.
+
+    The window first grows to take in whole events and any neighbouring
+    photos that would join them, so the events outside it stay valid.
+    Returns the numbers of events removed and created.
+    """
+    if lo is None:
+        events = Event.objects.all()
+        photos = Photo.objects.filter(date__isnull=False)
+    else:
+        lo, hi = _window(lo, hi)
+        events = Event.objects.filter(start__gte=lo, end__lte=hi)
+        photos = Photo.objects.filter(date__range=(lo, hi))
+
+    rows = list(photos.order_by('date', 'id').values_list(*FIELDS))
+    timestamps, latitudes, longitudes = _columns(rows)
+    starts = segment(timestamps, latitudes, longitudes, *_thresholds())
+    bounds = list(starts) + [len(rows)]
+
+    with transaction.atomic():
+        removed, _ = events.delete()
+        created = Event.objects.bulk_create([
+            _build_event(rows[start:end], latitudes[start:end], longitudes[start:end])
+            for start, end in zip(bounds[:-1], bounds[1:])
+        ])
+        # Events are disjoint, so each photo belongs to the last one starting
+        # at or before its date
+        photos.update(event=Subquery(
+            Event.objects.filter(start__lte=OuterRef('date')).order_by('-start').values('pk')[:1]
+        ))
+    return removed, len(created)
+
+
+def update_events(photo_ids):
+    """Recompute the events around photos that were added or changed.
+
+    Both the photos' current dates and the events they were in are redone,
+    so a photo whose date moved leaves its old event too.
+    """
+    gap = timedelta(hours=settings.EVENT_GAP_HOURS)
+    photo_ids = list(photo_ids)
+    spans = []
+    for i in range(0, len(photo_ids), 500):
+        rows = Photo.objects.filter(id__in=photo_ids[i:i + 500]).values_list(
+            'date', 'event__start', 'event__end',
+        )
+        for date, start, end in rows:
+            if date:
+                spans.append((date, date))
+            if start:
+                spans.append((start, end))
+    if not spans:
+        return 0, 0
+
+    windows = []
+    for lo, hi in sorted(spans):
+        if windows and lo <= windows[-1][1] + gap:
+            windows[-1][1] = max(windows[-1][1], hi)
+        else:
+            windows.append([lo, hi])
+    if len(windows) > MAX_WINDOWS:
+        windows = [[windows[0][0], windows[-1][1]]]
+
+    removed = created = 0
+    for lo, hi in windows:
+        window_removed, window_created = rebuild_events(lo, hi)
+        removed += window_removed
+        created += window_created
+    return removed, created
@@ -0,0 +1,186 @@
+import csv
+import io
+import json
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from itertools import islice
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .media import StreamSink
+from .models import Photo, PhotoScore, Album, Person, Keyword, Label
+
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+PHOTO_FIELDS = Photo._meta.concrete_fields
+
+SCORE_FIELDS = [
+    field.name for field in PhotoScore._meta.get_fields()
+    if field.get_internal_type() == 'FloatField'
+]
+
+# List columns holding the names of each photo's tags
+TAGS = {
+    'albums': Album,
+    'persons': Person,
+    'keywords': Keyword,
+    'labels': Label,
+}
+
+# Separator of the tag names in a CSV cell
+CSV_LIST_SEPARATOR = '|'
+
+
+def columns():
+    return (
+        [field.attname for field in PHOTO_FIELDS]
+        + [f'score_{name}' for name in SCORE_FIELDS]
+        + list(TAGS)
+    )
+
+
+def export_chunks(queryset=None, chunk_size=2000):
+    """Yield lists of up to chunk_size photo records, as dicts keyed by
+    columns().
+
+    Photos and their scores are read with one streamed query. The tag names
+    of each chunk come from one query per tag model, so memory stays
+    bounded by the chunk size whatever the size of the library.
+    """
+    if queryset is None:
+        queryset = Photo.objects.order_by('id')
+    rows = queryset.values_list(
+        *[field.attname for field in PHOTO_FIELDS],
+        *[f'score__{name}' for name in SCORE_FIELDS],
+    ).iterator(chunk_size=chunk_size)
+    names = columns()
+
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        ids = [row[0] for row in chunk]
+
+        tags = {}
+        for column, model in TAGS.items():
+            tag = model._meta.model_name
+            tags[column] = defaultdict(list)
+            links = model.photos.through.objects.filter(photo_id__in=ids).values_list(
+                'photo_id', f'{tag}__name',
+            ).order_by('photo_id', f'{tag}__name')
+            for photo_id, name in links:
+                tags[column][photo_id].append(name)
+
+        yield [
+            dict(zip(names, [*row, *(tags[column].get(row[0], []) for column in TAGS)]))
+            for row in chunk
+        ]
+
+
+def _plain(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def ndjson_stream(chunks):
+    """Encode records as newline-delimited JSON, one bytes block per chunk"""
+    for chunk in chunks:
+        yield ''.join(json.dumps(record, default=_plain) + '\n' for record in chunk).encode()
+
+
+def csv_stream(chunks):
+    """Encode records as CSV with a header row, one bytes block per chunk.
+    Tag names are joined with CSV_LIST_SEPARATOR."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns())
+    for chunk in chunks:
+        for record in chunk:
+            writer.writerow([
+                CSV_LIST_SEPARATOR.join(value) if isinstance(value, list) else _plain(value)
+                for value in record.values()
+            ])
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImproperlyConfigured('Parquet export requires the pyarrow package')
+    return pyarrow, pyarrow.parquet
+
+
+def parquet_schema(pa):
+    types = {
+        'BooleanField': pa.bool_(),
+        'IntegerField': pa.int32(),
+        'BigIntegerField': pa.int64(),
+        'BigAutoField': pa.int64(),
+        'AutoField': pa.int64(),
+        'ForeignKey': pa.int64(),
+        'FloatField': pa.float64(),
+        'DecimalField': pa.float64(),
+        'DateTimeField': pa.timestamp('us', tz='UTC'),
+    }
+    return pa.schema(
+        [(field.attname, types.get(field.get_internal_type(), pa.string())) for field in PHOTO_FIELDS]
+        + [(f'score_{name}', pa.float64()) for name in SCORE_FIELDS]
+        + [(column, pa.list_(pa.string())) for column in TAGS]
+    )
+
+
+def parquet_stream(chunks, row_group_size=50000):
+    """Encode records as Parquet, writing a row group every row_group_size
+    records and yielding the bytes written each time"""
+    pa, pq = _pyarrow()
+    schema = parquet_schema(pa)
+    decimals = [
+        field.attname for field in PHOTO_FIELDS if field.get_internal_type() == 'DecimalField'
+    ]
+    sink = StreamSink()
+    pending = []
+
+    def row_group():
+        for record in pending:
+            for name in decimals:
+                if record[name] is not None:
+                    record[name] = float(record[name])
+        writer.write_table(pa.Table.from_pylist(pending, schema=schema))
+        pending.clear()
+        return sink.take()
+
+    with pq.ParquetWriter(sink, schema, compression='zstd') as writer:
+        for chunk in chunks:
+            pending.extend(chunk)
+            if len(pending) >= row_group_size:
+                yield row_group()
+        if pending:
+            yield row_group()
+    yield sink.take()
+
+
+def export_stream(format, chunks, row_group_size=50000):
+    """Encode the records of export_chunks() in format, as bytes blocks.
+
+    Raises ImproperlyConfigured right away, rather than once streaming has
+    started, when Parquet is asked for without pyarrow.
+    """
+    if format == 'parquet':
+        _pyarrow()
+        return parquet_stream(chunks, row_group_size)
+    if format == 'csv':
+        return csv_stream(chunks)
+    return ndjson_stream(chunks)
@@ -0,0 +1,84 @@
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Face, FaceCluster
+
+
+# Faces are cropped with some context around the detected box, which makes
+# the embeddings noticeably more stable.
+CROP_PADDING = 0.2
+
+
+def crop_face(image, face):
+    """Crop a face from a PIL image using its normalized geometry.
+
+    Photos stores face centers with the origin at the bottom-left corner, so
+    the y axis is flipped to PIL's top-left origin.
+    """
+    img_width, img_height = image.size
+    half_width = face.width * (1 + CROP_PADDING) / 2
+    half_height = face.height * (1 + CROP_PADDING) / 2
+    center_y = 1 - face.center_y
+
+    box = (
+        max(0, int((face.center_x - half_width) * img_width)),
+        max(0, int((center_y - half_height) * img_height)),
+        min(img_width, int((face.center_x + half_width) * img_width)),
+        min(img_height, int((center_y + half_height) * img_height)),
+    )
+    if box[2] <= box[0] or box[3] <= box[1]:
+        return None
+    return image.crop(box)
+
+
+def to_bytes(vector):
+    import numpy as np
+
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def from_bytes(data):
+    import numpy as np
+
+    return np.frombuffer(data, dtype=np.float32)
+
+
+def assign_clusters(vectors, centroids, sizes, threshold):
+    """Assign embeddings to the nearest centroid, creating clusters as needed.
+
+    centroids is a (k, d) array of unit vectors and sizes their member
+    counts. Existing centroids are updated as running means, so new faces
+    never trigger a full recluster. Returns (labels, centroids, sizes) where
+    labels index into the returned centroids.
+    """
+    import numpy as np
+
+    dim = vectors.shape[1] if len(vectors) else centroids.shape[1]
+    centroids = np.array(centroids, dtype=np.float32).reshape(-1, dim)
+    sizes = list(sizes)
+    labels = []
+
+    for vector in vectors:
+        if len(centroids):
+            similarities = centroids @ vector
+            best = int(np.argmax(similarities))
+        if len(centroids) and similarities[best] >= threshold:
+            size = sizes[best]
+            merged = centroids[best] * size + vector
+            centroids[best] = merged / np.linalg.norm(merged)
+            sizes[best] = size + 1
+            labels.append(best)
+        else:
+            centroids = np.vstack([centroids, vector[np.newaxis, :]])
+            sizes.append(1)
+            labels.append(len(sizes) - 1)
+
+    return labels, centroids, sizes
+
+
+def update_cluster_sizes():
+    """Set every cluster's size to its current number of unnamed faces"""
+    counts = Face.objects.filter(
+        cluster=OuterRef('pk'), person__isnull=True
+    ).values('cluster').annotate(count=Count('id')).values('count')
+    return FaceCluster.objects.update(size=Coalesce(Subquery(counts), 0))
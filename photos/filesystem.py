@@ -0,0 +1,338 @@
+import hashlib
+import math
+import os
+import uuid as uuid_lib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from itertools import chain, islice
+from stat import S_ISREG
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.db.models import F
+
+from .flags import FLAG_BITS
+from .models import Photo
+
+
+# Extension and uniform type identifier of the files imported
+IMAGE_TYPES = {
+    '.jpg': 'public.jpeg',
+    '.jpeg': 'public.jpeg',
+    '.png': 'public.png',
+    '.tif': 'public.tiff',
+    '.tiff': 'public.tiff',
+    '.webp': 'org.webmproject.webp',
+    '.gif': 'com.compuserve.gif',
+    '.bmp': 'com.microsoft.bmp',
+}
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Files handed to the process pool at a time, and per task within that
+WINDOW_SIZE = 2000
+POOL_CHUNK_SIZE = 16
+
+
+def walk(root):
+    """Yield (path, size, mtime_ns) for the image files under root.
+
+    Hidden files and directories are skipped and symlinked directories are
+    not followed.
+    """
+    stack = [root]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif os.path.splitext(entry.name)[1].lower() in IMAGE_TYPES and entry.is_file():
+                        stat = entry.stat()
+                        yield entry.path, stat.st_size, stat.st_mtime_ns
+                except OSError:
+                    continue
+
+
+def stat_files(paths):
+    """Yield (path, size, mtime_ns) for the paths that are image files"""
+    for path in paths:
+        if os.path.splitext(path)[1].lower() not in IMAGE_TYPES:
+            continue
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if S_ISREG(stat.st_mode):
+            yield path, stat.st_size, stat.st_mtime_ns
+
+
+def _modified(mtime_ns):
+    return EPOCH + timedelta(microseconds=mtime_ns // 1000)
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', 'replace')
+    return str(value).strip('\x00 ') if value else ''
+
+
+def _number(value):
+    if isinstance(value, tuple):
+        value = value[0] if value else None
+    try:
+        number = float(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    return None if math.isnan(number) or math.isinf(number) else number
+
+
+def _coordinate(dms, ref):
+    """Degrees from an EXIF (degrees, minutes, seconds) triple"""
+    try:
+        degrees, minutes, seconds = (_number(part) for part in dms)
+        value = degrees + minutes / 60 + seconds / 3600
+    except (TypeError, ValueError):
+        return None
+    return round(-value if _text(ref) in ('S', 'W') else value, 6)
+
+
+def _exif_date(value, offset):
+    """Return the EXIF date, aware when its offset is known, and the offset
+    in seconds"""
+    try:
+        date = datetime.strptime(_text(value), '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        return None, None
+    offset = _text(offset)
+    try:
+        hours, minutes = offset[1:].split(':')
+        seconds = (int(hours) * 3600 + int(minutes) * 60) * (-1 if offset[0] == '-' else 1)
+    except (IndexError, ValueError):
+        return date, None
+    return date.replace(tzinfo=timezone(timedelta(seconds=seconds))), seconds
+
+
+def _metadata(img):
+    from PIL.ExifTags import Base, GPS, IFD
+
+    exif = img.getexif()
+    details = exif.get_ifd(IFD.Exif)
+    gps = exif.get_ifd(IFD.GPSInfo)
+    taken, offset = _exif_date(
+        details.get(Base.DateTimeOriginal) or exif.get(Base.DateTime),
+        details.get(Base.OffsetTimeOriginal),
+    )
+    latitude = _coordinate(gps.get(GPS.GPSLatitude), gps.get(GPS.GPSLatitudeRef))
+    longitude = _coordinate(gps.get(GPS.GPSLongitude), gps.get(GPS.GPSLongitudeRef))
+    iso = _number(details.get(Base.ISOSpeedRatings))
+    return {
+        'width': img.width,
+        'height': img.height,
+        'orientation': int(exif.get(Base.Orientation) or 1),
+        'camera_make': _text(exif.get(Base.Make)),
+        'camera_model': _text(exif.get(Base.Model)),
+        'exif_datetime': taken,
+        'timezone_offset': offset,
+        'latitude': latitude if longitude is not None else None,
+        'longitude': longitude if latitude is not None else None,
+        'fstop': _number(details.get(Base.FNumber)),
+        'aperture': _number(details.get(Base.ApertureValue)),
+        'iso': int(iso) if iso is not None else None,
+        'focal_length': _number(details.get(Base.FocalLength)),
+        'exposure_time': _number(details.get(Base.ExposureTime)),
+    }
+
+
+def read_file(path):
+    """Hash a file and read its EXIF without decoding any pixels.
+
+    Runs in the import process pool, so it only returns plain data. The
+    uuid comes from the content hash, so a moved file keeps its photo and
+    copies of a file share one.
+    """
+    from PIL import Image
+
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+                digest.update(chunk)
+            f.seek(0)
+            with Image.open(f) as img:
+                metadata = _metadata(img)
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        return {'error': str(e) or type(e).__name__}
+    metadata['uuid'] = str(uuid_lib.UUID(bytes=digest.digest()[:16])).upper()
+    return metadata
+
+
+def photo_info(path, size, mtime_ns, metadata):
+    """Build an osxphotos PhotoInfo look-alike from read_file()'s result"""
+    modified = _modified(mtime_ns)
+    filename = os.path.basename(path)
+    return SimpleNamespace(
+        original_filename=filename,
+        filename=filename,
+        path=path,
+        path_edited='',
+        isphoto=True,
+        ismovie=False,
+        date=metadata['exif_datetime'] or modified,
+        date_modified=modified,
+        date_added=modified,
+        title='',
+        description='',
+        place=None,
+        uti=IMAGE_TYPES[os.path.splitext(filename)[1].lower()],
+        duration=None,
+        timezone_name='',
+        favorite=False,
+        hidden=False,
+        in_trash=False,
+        shared=False,
+        original_file_size=size,
+        albums=[],
+        persons=[],
+        keywords=[],
+        labels=[],
+        **metadata,
+    )
+
+
+class FilesystemSource:
+    """Photos found in directory trees, for hosts without a Photos library.
+
+    Files whose size and modification time match the Photo imported from
+    that path are skipped without being opened. The rest are hashed and
+    their EXIF read in a process pool, one window of files ahead of the
+    sync consuming them. A copy of a file already imported from another
+    path that still exists is skipped and listed in duplicates.
+    """
+
+    def __init__(self, roots, workers=None):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.workers = workers or settings.FILESYSTEM_IMPORT_WORKERS or os.cpu_count() or 1
+        self.unchanged = 0
+        self.failed = []
+        self.duplicates = []
+        self.missing = 0
+
+    def _index(self, paths=None):
+        """Size and modification time of the photos imported from the roots,
+        or from paths, by path"""
+        if paths is None:
+            querysets = [
+                Photo.objects.filter(path__startswith=os.path.join(root, ''))
+                for root in self.roots
+            ]
+        else:
+            querysets = [
+                Photo.objects.filter(path__in=paths[i:i + 500])
+                for i in range(0, len(paths), 500)
+            ]
+
+        index = {}
+        for queryset in querysets:
+            rows = queryset.filter(is_missing=False).values_list(
+                'path', 'original_file_size', 'date_modified',
+            )
+            for path, size, modified in rows.iterator(chunk_size=10000):
+                index[path] = (size, modified)
+        return index
+
+    def _changed(self, index, paths=None):
+        """Yield (path, size, mtime_ns, known) for new and changed files,
+        removing every file seen from index"""
+        if paths is None:
+            files = chain.from_iterable(walk(root) for root in self.roots)
+        else:
+            files = stat_files(paths)
+        for path, size, mtime_ns in files:
+            previous = index.pop(path, None)
+            if previous == (size, _modified(mtime_ns)):
+                self.unchanged += 1
+                continue
+            yield path, size, mtime_ns, previous is not None
+
+    def photos(self, paths=None):
+        """Yield PhotoInfo look-alikes for new and changed files under the
+        roots, or among paths only when given.
+
+        Once every file has been seen, photos whose file is gone or now has
+        other content are flagged as missing.
+        """
+        if paths is not None:
+            paths = sorted(paths)
+        index = self._index(paths)
+        changed = self._changed(index, paths)
+        replaced = []
+        # uuids of the last window, which sync may not have written yet when
+        # the missing files are flagged
+        recent = []
+        # Path each uuid was imported from in this run
+        seen = {}
+
+        def results(window, records):
+            records = list(records)
+            imported = self._paths([record['uuid'] for record in records if 'error' not in record])
+            recent.clear()
+            for (path, size, mtime_ns, known), metadata in zip(window, records):
+                if 'error' in metadata:
+                    self.failed.append((path, metadata['error']))
+                    continue
+                uuid = metadata['uuid']
+                if known:
+                    replaced.append((path, uuid))
+                # The first path keeps the photo; otherwise every sync would
+                # move it back and forth between the copies
+                original = seen.get(uuid) or imported.get(uuid)
+                if original and original != path and (uuid in seen or os.path.isfile(original)):
+                    self.duplicates.append((path, original))
+                    continue
+                seen[uuid] = path
+                recent.append(uuid)
+                yield photo_info(path, size, mtime_ns, metadata)
+
+        with ProcessPoolExecutor(self.workers) as pool:
+            pending = None
+            while True:
+                window = list(islice(changed, WINDOW_SIZE))
+                if not window:
+                    break
+                records = pool.map(
+                    read_file, [file[0] for file in window], chunksize=POOL_CHUNK_SIZE,
+                )
+                if pending:
+                    yield from results(*pending)
+                pending = (window, records)
+            if pending:
+                yield from results(*pending)
+
+        self.missing = self._mark_missing(list(index), replaced, recent)
+
+    def _paths(self, uuids):
+        """Path of the photos already imported with any of uuids, by uuid"""
+        paths = {}
+        for i in range(0, len(uuids), 500):
+            paths.update(Photo.objects.filter(uuid__in=uuids[i:i + 500]).values_list('uuid', 'path'))
+        return paths
+
+    def _mark_missing(self, vanished, replaced, moved):
+        missing = {'is_missing': True, 'flags': F('flags').bitor(FLAG_BITS['is_missing'])}
+        count = 0
+        for i in range(0, len(vanished), 500):
+            count += Photo.objects.filter(
+                path__in=vanished[i:i + 500],
+            ).exclude(uuid__in=moved).update(**missing)
+        for path, uuid in replaced:
+            count += Photo.objects.filter(path=path, is_missing=False).exclude(uuid=uuid).update(**missing)
+        return count
@@ -0,0 +1,151 @@
+import hashlib
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Q, Case, When
+
+from .bitmap import PhotoIdList
+from . import embeddings
+from .embeddings import SemanticSearchUnavailable, search_photo_ids
+from .flags import filter_flags, list_filter_flags
+from .generation import current_generation
+from .models import Photo, Album, Person, Keyword, Label
+
+
+VALID_SORTS = ['date', '-date', 'title', '-title', 'filename', '-filename',
+               '-score__overall', 'created_at', '-created_at']
+
+
+def text_search(query):
+    """Match photos whose text fields or tag names contain query"""
+    # Tag matches go through photo id subqueries rather than joins, so
+    # each name lookup can use its own index and no DISTINCT is needed
+    return (
+        Q(title__icontains=query) |
+        Q(description__icontains=query) |
+        Q(filename__icontains=query) |
+        Q(id__in=Keyword.photos.through.objects.filter(
+            keyword__name__icontains=query).values('photo_id')) |
+        Q(id__in=Label.photos.through.objects.filter(
+            label__name__icontains=query).values('photo_id')) |
+        Q(id__in=Person.photos.through.objects.filter(
+            person__name__icontains=query).values('photo_id')) |
+        Q(id__in=Album.photos.through.objects.filter(
+            album__name__icontains=query).values('photo_id'))
+    )
+
+
+def filter_photos(params, queryset=None):
+    """Apply the photo list filter and sort parameters to a Photo queryset"""
+    if queryset is None:
+        queryset = Photo.objects.all()
+
+    # Search functionality
+    search_query = params.get('search')
+    if search_query:
+        queryset = queryset.filter(text_search(search_query))
+
+    # Semantic search: restrict to the nearest neighbours of the query
+    # embedding, then apply the regular filters to that candidate set. When
+    # semantic search is unavailable the query is matched as text instead.
+    semantic_query = params.get('semantic')
+    candidate_ids = None
+    if semantic_query:
+        try:
+            candidate_ids = search_photo_ids(semantic_query)
+        except SemanticSearchUnavailable:
+            queryset = queryset.filter(text_search(semantic_query))
+        else:
+            queryset = queryset.filter(id__in=candidate_ids)
+
+    # Photo type filters, compiled into one predicate on the flags bitmask
+    queryset = filter_flags(queryset, list_filter_flags(params))
+
+    # Filter by album
+    album_id = params.get('album')
+    if album_id:
+        queryset = queryset.filter(albums__id=album_id)
+
+    # Filter by person
+    person_id = params.get('person')
+    if person_id:
+        queryset = queryset.filter(persons__id=person_id)
+
+    # Filter by keyword
+    keyword_id = params.get('keyword')
+    if keyword_id:
+        queryset = queryset.filter(keywords__id=keyword_id)
+
+    # Filter by label
+    label_id = params.get('label')
+    if label_id:
+        queryset = queryset.filter(labels__id=label_id)
+
+    # Filter by camera
+    camera_make = params.get('camera_make')
+    if camera_make:
+        queryset = queryset.filter(camera_make=camera_make)
+
+    camera_model = params.get('camera_model')
+    if camera_model:
+        queryset = queryset.filter(camera_model=camera_model)
+
+    # Filter by date range
+    date_from = params.get('date_from')
+    date_to = params.get('date_to')
+    if date_from:
+        queryset = queryset.filter(date__gte=date_from)
+    if date_to:
+        queryset = queryset.filter(date__lte=date_to)
+
+    # Filter by location
+    has_location = params.get('has_location')
+    if has_location:
+        queryset = queryset.exclude(latitude__isnull=True, longitude__isnull=True)
+
+    # Sort options; semantic results default to relevance order
+    if candidate_ids and 'sort' not in params:
+        return queryset.order_by(Case(
+            *[When(id=pk, then=rank) for rank, pk in enumerate(candidate_ids)]
+        ))
+
+    sort = params.get('sort', '-date')
+    if sort in VALID_SORTS:
+        if sort == '-score__overall':
+            # Unscored photos (videos, filesystem imports) sort last rather
+            # than dropping out; the scored prefix can still walk the
+            # PhotoScore index
+            queryset = queryset.order_by(F('score__overall').desc(nulls_last=True), 'id')
+        else:
+            queryset = queryset.order_by(sort)
+
+    return queryset
+
+
+def filter_key(params):
+    """Identify a filter set: the non-empty parameters except the page"""
+    items = sorted((key, value) for key, value in params.items() if value and key != 'page')
+    return hashlib.md5(urlencode(items).encode()).hexdigest()
+
+
+def cached_photo_ids(params, queryset=None):
+    """Like filter_photos(), but the ordered result ids and count are cached
+    per filter set and library generation, so further pages only load their
+    own rows. Only the first PHOTO_LIST_CACHE_IDS ids are kept; later pages
+    are queried as usual."""
+    key = f'photo_ids:{current_generation()}:{filter_key(params)}'
+    cached = cache.get(key)
+    if cached is None:
+        import numpy as np
+
+        limit = settings.PHOTO_LIST_CACHE_IDS
+        ids = np.array(filter_photos(params).values_list('id', flat=True)[:limit], dtype=np.int64)
+        count = len(ids) if len(ids) < limit else filter_photos(params).count()
+        cached = (ids, count)
+        # Text search stand-ins for semantic results are not worth keeping
+        if not params.get('semantic') or embeddings.available():
+            cache.set(key, cached, settings.PHOTO_LIST_CACHE_TIMEOUT)
+    ids, count = cached
+    remainder = filter_photos(params, queryset) if count > len(ids) else None
+    return PhotoIdList(ids, queryset, count, remainder)
@@ -0,0 +1,86 @@
+from django.db.models import F
+
+
+# Bit positions are stored in Photo.flags, so only ever append to this list
+FLAG_FIELDS = [
+    'is_photo',
+    'is_movie',
+    'is_cloud_photo',
+    'has_adjustments',
+    'is_missing',
+    'place_is_home',
+    'live_photo',
+    'is_burst',
+    'is_hdr',
+    'is_portrait',
+    'is_screenshot',
+    'is_slow_mo',
+    'is_selfie',
+    'is_panorama',
+    'has_raw',
+    'favorite',
+    'hidden',
+    'in_trash',
+    'shared',
+]
+
+FLAG_BITS = {field: 1 << position for position, field in enumerate(FLAG_FIELDS)}
+
+# Photo list checkbox parameters and the flag each one requires
+LIST_FLAG_FILTERS = {
+    'favorites': 'favorite',
+    'screenshots': 'is_screenshot',
+    'selfies': 'is_selfie',
+    'portraits': 'is_portrait',
+    'panoramas': 'is_panorama',
+    'live_photos': 'live_photo',
+    'bursts': 'is_burst',
+    'hdr': 'is_hdr',
+}
+
+# Flags with a partial date index, rarest first. The rarest requested flag is
+# kept as a plain boolean predicate so the database can drive from its index.
+INDEXED_FLAGS = [
+    'is_panorama',
+    'is_burst',
+    'is_screenshot',
+    'favorite',
+    'is_selfie',
+    'is_movie',
+    'is_portrait',
+    'is_hdr',
+    'live_photo',
+]
+
+
+def compute_flags(photo):
+    """Pack a photo's boolean flags into a single integer"""
+    return sum(bit for field, bit in FLAG_BITS.items() if getattr(photo, field))
+
+
+def list_filter_flags(params):
+    """Return the flag fields required by photo list parameters"""
+    fields = [field for param, field in LIST_FLAG_FILTERS.items() if params.get(param)]
+    if params.get('videos'):
+        fields.append('is_movie')
+    elif params.get('photos'):
+        fields.append('is_photo')
+    return fields
+
+
+def filter_flags(queryset, fields):
+    """Require every flag in fields with one bitwise predicate on Photo.flags"""
+    if not fields:
+        return queryset
+
+    anchor = next((field for field in INDEXED_FLAGS if field in fields), None)
+    if anchor:
+        queryset = queryset.filter(**{anchor: True})
+
+    remaining = [field for field in fields if field != anchor]
+    if remaining:
+        mask = sum(FLAG_BITS[field] for field in remaining)
+        queryset = queryset.alias(
+            required_flags=F('flags').bitand(mask)
+        ).filter(required_flags=mask)
+    return queryset
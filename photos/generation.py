@@ -0,0 +1,62 @@
+import fcntl
+import os
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+_cached = (None, 0)
+
+
+def _generation_file():
+    return os.path.join(str(settings.LIBRARY_STATE_DIR), 'generation')
+
+
+def current_generation():
+    """Return the library generation, which every sync increments.
+
+    The value lives in a small file shared by all processes; it is only
+    re-read when the file's mtime changes, so checking it is a stat() call.
+    """
+    global _cached
+    path = _generation_file()
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+    if _cached[0] != mtime:
+        with open(path) as f:
+            _cached = (mtime, int(f.read().strip() or 0))
+    return _cached[1]
+
+
+@contextmanager
+def next_generation():
+    """Yield the next library generation, which becomes current on exit.
+
+    The increment holds an exclusive lock shared by all processes, so two
+    concurrent syncs never get the same number, and anything published for
+    it inside the block (e.g. a snapshot) is written before it goes live.
+    """
+    os.makedirs(str(settings.LIBRARY_STATE_DIR), exist_ok=True)
+    with open(os.path.join(str(settings.LIBRARY_STATE_DIR), 'generation.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with open(_generation_file()) as f:
+                generation = int(f.read().strip() or 0) + 1
+        except FileNotFoundError:
+            generation = 1
+
+        yield generation
+
+        fd, tmp_path = tempfile.mkstemp(dir=str(settings.LIBRARY_STATE_DIR), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(str(generation))
+        os.replace(tmp_path, _generation_file())
+
+
+def bump_generation():
+    """Increment the library generation and return the new value"""
+    with next_generation() as generation:
+        return generation
@@ -0,0 +1,244 @@
+import io
+import os
+import re
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from .models import Job
+
+
+# Above this many photos, post-sync jobs cover the whole library instead of
+# listing uuids; the commands skip photos that are already done
+MAX_JOB_UUIDS = 10000
+
+# Queued jobs looked at per claim, so a command at its concurrency limit does
+# not hold up the others
+CLAIM_CANDIDATES = 20
+
+PROGRESS_PATTERN = re.compile(r'Progress: (\d+)(?:/(\d+))?')
+
+# Progress is written to the job row at most this often, in seconds
+PROGRESS_INTERVAL = 1.0
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def enqueue(command, priority=0, uuids=None, **options):
+    """Queue a management command from JOB_COMMANDS.
+
+    With uuids, the command runs for those photos only, through its --uuid
+    option. They are added to a job for the same command that is still
+    queued, rather than queueing another one.
+    """
+    if command not in settings.JOB_COMMANDS:
+        raise ValueError(f'{command} is not in JOB_COMMANDS')
+    if uuids is None:
+        return Job.objects.create(command=command, options=options, priority=priority)
+
+    uuids = sorted(set(uuids))
+    with transaction.atomic():
+        queued = Job.objects.select_for_update().filter(command=command, status=Job.QUEUED)
+        for job in queued:
+            job_uuids = job.options.get('uuid')
+            rest = {key: value for key, value in job.options.items() if key != 'uuid'}
+            if rest != options:
+                continue
+            if job_uuids is None:
+                # Already queued for the whole library
+                return job
+            merged = sorted(set(job_uuids).union(uuids))
+            if len(merged) > MAX_JOB_UUIDS:
+                job.options = rest
+            else:
+                job.options = {**rest, 'uuid': merged}
+            job.priority = max(job.priority, priority)
+            job.save(update_fields=['options', 'priority'])
+            return job
+
+        if len(uuids) <= MAX_JOB_UUIDS:
+            options = {**options, 'uuid': uuids}
+        return Job.objects.create(command=command, options=options, priority=priority)
+
+
+def enqueue_after_sync(uuids):
+    """Queue JOBS_AFTER_SYNC for the photos a sync created or updated"""
+    return [
+        enqueue(command, uuids=uuids)
+        for command in settings.JOBS_AFTER_SYNC
+        if command in settings.JOB_COMMANDS
+    ]
+
+
+def requeue_stale():
+    """Queue again the running jobs whose worker stopped reporting, or fail
+    them once they have used up their attempts"""
+    stale = Job.objects.filter(
+        status=Job.RUNNING,
+        heartbeat_at__lt=timezone.now() - timedelta(seconds=settings.JOB_STALE_AFTER),
+    )
+    failed = stale.filter(attempts__gte=settings.JOB_MAX_ATTEMPTS).update(
+        status=Job.FAILED, finished_at=timezone.now(), error='Worker stopped responding',
+    )
+    requeued = stale.update(status=Job.QUEUED, worker='')
+    return requeued, failed
+
+
+def claim(worker, commands=None):
+    """Mark the most urgent job that may run now as running and return it,
+    or None.
+
+    The claim is a conditional update, so two workers cannot take the same
+    job. A worker that finds its command over the concurrency limit once the
+    job is claimed puts it back.
+    """
+    candidates = Job.objects.filter(status=Job.QUEUED)
+    if commands:
+        candidates = candidates.filter(command__in=commands)
+    candidates = list(
+        candidates.order_by('-priority', 'created_at', 'id').values_list('id', 'command')[:CLAIM_CANDIDATES]
+    )
+    if not candidates:
+        return None
+
+    running = dict(
+        Job.objects.filter(status=Job.RUNNING).values_list('command').annotate(count=Count('id'))
+    )
+    for pk, command in candidates:
+        limit = settings.JOB_COMMANDS.get(command, 0)
+        if running.get(command, 0) >= limit:
+            continue
+        now = timezone.now()
+        claimed = Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+            status=Job.RUNNING, worker=worker, started_at=now, heartbeat_at=now,
+            attempts=F('attempts') + 1, progress=0, total=None, message='', error='',
+        )
+        if not claimed:
+            continue
+        first = Job.objects.filter(status=Job.RUNNING, command=command).order_by('started_at', 'id')
+        if pk in first.values_list('id', flat=True)[:limit]:
+            return Job.objects.get(pk=pk)
+        Job.objects.filter(pk=pk).update(
+            status=Job.QUEUED, worker='', started_at=None, attempts=F('attempts') - 1,
+        )
+        running[command] = limit
+    return None
+
+
+class ProgressOutput(io.TextIOBase):
+    """stdout for a job's command: keeps the last line as the job message
+    and "Progress: done/total" lines as its progress"""
+
+    def __init__(self, job, echo=None):
+        self.job = job
+        self.echo = echo
+        self._saved = 0.0
+
+    def write(self, text):
+        if self.echo:
+            self.echo.write(text)
+        lines = [line for line in text.splitlines() if line.strip()]
+        if not lines:
+            return len(text)
+        for line in lines:
+            match = PROGRESS_PATTERN.search(line)
+            if match:
+                self.job.progress = int(match[1])
+                if match[2]:
+                    self.job.total = int(match[2])
+        self.job.message = lines[-1].strip()[:255]
+        if time.monotonic() - self._saved >= PROGRESS_INTERVAL:
+            self.save()
+        return len(text)
+
+    def save(self):
+        self._saved = time.monotonic()
+        Job.objects.filter(pk=self.job.pk).update(
+            progress=self.job.progress, total=self.job.total, message=self.job.message,
+            heartbeat_at=timezone.now(),
+        )
+
+
+def _heartbeat(job, stop):
+    """Keep a job from looking stale while its command is quiet"""
+    try:
+        while not stop.wait(settings.JOB_STALE_AFTER / 3):
+            try:
+                Job.objects.filter(pk=job.pk, status=Job.RUNNING).update(heartbeat_at=timezone.now())
+            except DatabaseError:
+                # SQLite may be locked by the command's own writes; the
+                # next beat is soon enough
+                pass
+    finally:
+        connection.close()
+
+
+def run_job(job, echo=None):
+    """Run a claimed job's command and record how it ended"""
+    output = ProgressOutput(job, echo)
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(job, stop), daemon=True)
+    heartbeat.start()
+    try:
+        call_command(job.command, stdout=output, stderr=output, **job.options)
+    except Exception:
+        job.status = Job.FAILED
+        job.error = traceback.format_exc()
+    else:
+        job.status = Job.DONE
+        if job.total is not None:
+            job.progress = job.total
+    finally:
+        stop.set()
+        heartbeat.join()
+
+    job.finished_at = timezone.now()
+    Job.objects.filter(pk=job.pk).update(
+        status=job.status, error=job.error, progress=job.progress, total=job.total,
+        message=job.message, finished_at=job.finished_at, heartbeat_at=job.finished_at,
+    )
+    return job
+
+
+def throughput(hours=24):
+    """Per-command job counts and timings of the last hours, for the jobs page"""
+    since = timezone.now() - timedelta(hours=hours)
+    commands = {
+        command: {
+            'command': command, 'limit': limit, 'queued': 0, 'running': 0, 'done': 0,
+            'failed': 0, 'items': 0, 'seconds': 0.0,
+        }
+        for command, limit in settings.JOB_COMMANDS.items()
+    }
+    counts = Job.objects.filter(
+        Q(status__in=[Job.QUEUED, Job.RUNNING]) | Q(finished_at__gte=since)
+    ).values_list('command', 'status').annotate(count=Count('id'))
+    for command, status, count in counts:
+        if command in commands:
+            commands[command][status] = count
+
+    finished = Job.objects.filter(status=Job.DONE, finished_at__gte=since).values_list(
+        'command', 'progress', 'started_at', 'finished_at',
+    )
+    for command, progress, started_at, finished_at in finished.iterator():
+        if command in commands and started_at:
+            commands[command]['items'] += progress
+            commands[command]['seconds'] += (finished_at - started_at).total_seconds()
+
+    rows = []
+    for row in commands.values():
+        row['jobs_per_hour'] = row['done'] / hours
+        row['average_seconds'] = row['seconds'] / row['done'] if row['done'] else None
+        row['items_per_second'] = row['items'] / row['seconds'] if row['seconds'] else None
+        rows.append(row)
+    return rows
@@ -0,0 +1,277 @@
+import io
+import json
+import statistics
+import tempfile
+import time
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory, override_settings
+from photos.management.commands.sync_photos_command import Command as SyncCommand
+from photos.models import Photo, Album, Person
+from photos.synthetic import SYNTHETIC_PREFIX, generate_library, photo_infos
+from photos.thumbnails import get_thumbnail
+from photos.views import PhotoListView, search_autocomplete, stats_view
+
+
+# List pages timed by the benchmark. 'popular' is replaced with the most
+# used synthetic tag of that kind.
+LIST_PAGES = [
+    ('list_default', {}),
+    ('list_deep_page', {'page': '20'}),
+    ('list_favorites', {'favorites': 'true'}),
+    ('list_videos', {'videos': 'true'}),
+    ('list_album', {'album': 'popular'}),
+    ('list_person_favorites', {'person': 'popular', 'favorites': 'true'}),
+    ('list_date_range', {'date_from': '2018-01-01', 'date_to': '2018-12-31'}),
+    ('list_score_sort', {'sort': '-score__overall'}),
+    ('search', {'search': 'keyword-12'}),
+]
+
+AUTOCOMPLETE_QUERIES = ['ke', 'album-1', 'person-27', 'label-300']
+
+# Seed of the photos synced by the sync targets, far from the seeds
+# generate_library() uses so their uuids do not collide
+SYNC_SEED = 10 ** 9
+
+
+class Command(BaseCommand):
+    help = (
+        'Times sync, list pages, search, autocomplete, stats and thumbnails on a '
+        'synthetic library and compares the results to a saved baseline. '
+        'Point SQLITE_PATH (or POSTGRES_DB) at a scratch database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--photos',
+            type=int,
+            default=10000,
+            help='Top the library up to this many photos first '
+                 '(10000, 100000 and 500000 are the reference sizes)',
+        )
+        parser.add_argument(
+            '--images',
+            type=int,
+            default=200,
+            help='Number of generated photos that get a JPEG file',
+        )
+        parser.add_argument(
+            '--image-dir',
+            default=str(settings.LIBRARY_STATE_DIR / 'benchmark_images'),
+            help='Directory for the generated JPEG files',
+        )
+        parser.add_argument(
+            '--sync-photos',
+            type=int,
+            default=2000,
+            help='Number of photos in the full and incremental sync targets',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Number of timed runs per request target',
+        )
+        parser.add_argument(
+            '--skip',
+            default='',
+            help='Comma-separated target name prefixes to leave out, e.g. sync,thumbnail',
+        )
+        parser.add_argument(
+            '--baseline',
+            help='Compare against this JSON baseline and fail on regressions',
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=0.25,
+            help='Allowed slowdown over the baseline median, as a fraction. '
+                 'A target in the baseline may set its own "threshold".',
+        )
+        parser.add_argument(
+            '--min-delta-ms',
+            type=float,
+            default=2.0,
+            help='Ignore slowdowns smaller than this, to keep fast targets from flapping',
+        )
+        parser.add_argument(
+            '--output',
+            help='Write the results as JSON to this file (use it as the next baseline)',
+        )
+
+    def handle(self, *args, **options):
+        existing = Photo.objects.count()
+        if options['photos'] > existing:
+            generate_library(
+                options['photos'] - existing,
+                seed=existing,
+                images=options['images'],
+                image_dir=options['image_dir'],
+                stdout=self.stdout,
+            )
+
+        self.factory = RequestFactory()
+        targets = {}
+        for name, timings in self._run_targets(options):
+            targets[name] = self._summarize(timings)
+            self.stdout.write(
+                f'{name:<24}{targets[name]["median_ms"]:>10.2f} ms  '
+                f'(max {targets[name]["max_ms"]:.2f} ms, {len(timings)} runs)'
+            )
+
+        results = {
+            'photos': Photo.objects.count(),
+            'vendor': connection.vendor,
+            'created_at': time.time(),
+            'targets': targets,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+        if options['baseline']:
+            self._compare(results, options)
+
+    def _run_targets(self, options):
+        """Yield (name, timings in seconds) for every target. Targets run
+        lazily so --skip saves their time too."""
+        skip = tuple(prefix for prefix in options['skip'].split(',') if prefix)
+
+        def wanted(name):
+            return not (skip and name.startswith(skip))
+
+        if wanted('sync'):
+            yield from self._sync_targets(options['sync_photos'])
+
+        popular = {
+            'album': self._popular(Album, 'album'),
+            'person': self._popular(Person, 'person'),
+        }
+        view = PhotoListView.as_view()
+        for name, params in LIST_PAGES:
+            if not wanted(name):
+                continue
+            params = {
+                key: str(popular[key]) if value == 'popular' else value
+                for key, value in params.items()
+            }
+            yield name, self._repeat(
+                lambda: view(self.factory.get('/', params)).render(),
+                options['repeat'], clear_cache=True,
+            )
+
+        if wanted('autocomplete'):
+            autocomplete = async_to_sync(search_autocomplete)
+            yield 'autocomplete', [
+                timing
+                for query in AUTOCOMPLETE_QUERIES
+                for timing in self._repeat(
+                    lambda: autocomplete(self.factory.get('/', {'q': query})), options['repeat'],
+                )
+            ]
+
+        if wanted('stats'):
+            yield 'stats', self._repeat(
+                lambda: stats_view(self.factory.get('/')), options['repeat'], clear_cache=True,
+            )
+
+        if wanted('thumbnail'):
+            yield from self._thumbnail_targets()
+
+    def _sync_targets(self, count):
+        """Time a full sync of count new photos, then an incremental sync
+        where 5% of them changed"""
+        command = SyncCommand(stdout=io.StringIO())
+        full = photo_infos(count, seed=SYNC_SEED)
+        Photo.objects.filter(uuid__in=[info.uuid for info in full]).delete()
+
+        # Keep the generation, snapshot and last sync summary of the real
+        # library state, and queue no follow-up jobs
+        with tempfile.TemporaryDirectory() as state_dir:
+            with override_settings(LIBRARY_STATE_DIR=state_dir, JOBS_AFTER_SYNC=[]):
+                started = time.perf_counter()
+                summary = command.sync(full)
+                yield 'sync_full', [time.perf_counter() - started]
+                if summary['counts']['errors']:
+                    raise CommandError(f'Full sync had {summary["counts"]["errors"]} errors')
+
+                incremental = photo_infos(count, seed=SYNC_SEED, modified=0.05)
+                started = time.perf_counter()
+                command.sync(incremental)
+                yield 'sync_incremental', [time.perf_counter() - started]
+
+    def _thumbnail_targets(self):
+        photos = list(
+            Photo.objects.filter(uuid__startswith=SYNTHETIC_PREFIX)
+            .exclude(path='')
+            .values_list('uuid', 'path')
+        )
+        if not photos:
+            self.stdout.write(self.style.ERROR('No photos with image files; skipping thumbnails'))
+            return
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with override_settings(THUMBNAIL_CACHE_DIR=cache_dir):
+                yield 'thumbnail_cold', [self._time(get_thumbnail, *photo) for photo in photos]
+                yield 'thumbnail_warm', [self._time(get_thumbnail, *photo) for photo in photos]
+
+    def _popular(self, model, prefix):
+        # generate_library() makes the lowest numbered tags the most used
+        return model.objects.filter(name=f'{SYNTHETIC_PREFIX}{prefix}-0').values_list('id', flat=True).first()
+
+    def _time(self, func, *args):
+        started = time.perf_counter()
+        func(*args)
+        return time.perf_counter() - started
+
+    def _repeat(self, func, repeat, clear_cache=False):
+        timings = []
+        for _ in range(repeat):
+            if clear_cache:
+                cache.clear()
+            timings.append(self._time(func))
+        return timings
+
+    def _summarize(self, timings):
+        timings = sorted(timings)
+        return {
+            'runs': len(timings),
+            'median_ms': round(statistics.median(timings) * 1000, 3),
+            'max_ms': round(timings[-1] * 1000, 3),
+        }
+
+    def _compare(self, results, options):
+        with open(options['baseline']) as f:
+            baseline = json.load(f)
+
+        if baseline.get('photos') != results['photos']:
+            self.stdout.write(self.style.ERROR(
+                f'Baseline was recorded with {baseline.get("photos")} photos, '
+                f'this run has {results["photos"]}'
+            ))
+
+        self.stdout.write(f'\n{"target":<24}{"baseline ms":>12}{"now ms":>10}{"change":>9}')
+        regressions = []
+        for name, before in baseline['targets'].items():
+            now = results['targets'].get(name)
+            if now is None:
+                continue
+            threshold = before.get('threshold', options['threshold'])
+            change = now['median_ms'] / before['median_ms'] - 1 if before['median_ms'] else 0
+            regressed = (
+                change > threshold
+                and now['median_ms'] - before['median_ms'] > options['min_delta_ms']
+            )
+            line = f'{name:<24}{before["median_ms"]:>12.1f}{now["median_ms"]:>10.1f}{change:>+9.0%}'
+            self.stdout.write(self.style.ERROR(line) if regressed else line)
+            if regressed:
+                regressions.append(name)
+
+        if regressions:
+            raise CommandError(f'Slower than the baseline: {", ".join(regressions)}')
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
@@ -0,0 +1,187 @@
+import json
+import statistics
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, models
+from django.db.models import Count
+from photos.filters import filter_photos
+from photos.models import Photo, PhotoScore, Album, Person, Keyword, Label
+from photos.synthetic import generate_library
+
+
+# Representative PhotoListView parameter combinations. Values of 'popular'
+# and 'rare' are resolved to the largest and a small tag of that kind.
+QUERY_SHAPES = [
+    ('default', {}),
+    ('favorites', {'favorites': 'true'}),
+    ('videos', {'videos': 'true'}),
+    ('images', {'photos': 'true'}),
+    ('selfies', {'selfies': 'true'}),
+    ('favorite_videos', {'favorites': 'true', 'videos': 'true'}),
+    ('live_hdr', {'live_photos': 'true', 'hdr': 'true'}),
+    ('album_popular', {'album': 'popular'}),
+    ('album_rare', {'album': 'rare'}),
+    ('person_popular', {'person': 'popular'}),
+    ('person_favorites', {'person': 'popular', 'favorites': 'true'}),
+    ('keyword', {'keyword': 'popular'}),
+    ('label', {'label': 'popular'}),
+    ('camera', {'camera_make': 'Apple', 'camera_model': 'iPhone 12'}),
+    ('date_range', {'date_from': '2018-01-01', 'date_to': '2018-12-31'}),
+    ('has_location', {'has_location': 'true'}),
+    ('score_sort', {'sort': '-score__overall'}),
+    ('score_sort_favorites', {'sort': '-score__overall', 'favorites': 'true'}),
+    ('title_sort', {'sort': 'title'}),
+    ('search', {'search': 'keyword-12'}),
+]
+
+TAG_PARAMS = {
+    'album': Album,
+    'person': Person,
+    'keyword': Keyword,
+    'label': Label,
+}
+
+# Indexes added by the index audit, and the ones they replaced. Used by
+# --compare-indexes to reproduce the schema from before the audit.
+AUDIT_INDEXES = [
+    (Photo, index) for index in Photo._meta.indexes
+    if index.name.startswith('photo_')
+] + [
+    (PhotoScore, index) for index in PhotoScore._meta.indexes
+]
+
+LEGACY_INDEXES = [
+    (Photo, models.Index(fields=['date', 'favorite'], name='photos_phot_date_dc2af6_idx')),
+    (Photo, models.Index(fields=['camera_make', 'camera_model'], name='photos_phot_camera__362392_idx')),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Replays representative photo list queries, capturing timings and '
+        'EXPLAIN plans. Point SQLITE_PATH (or POSTGRES_DB) at a scratch database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--generate',
+            type=int,
+            default=0,
+            help='Top the library up to this many photos with synthetic data',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Number of timed runs per query shape',
+        )
+        parser.add_argument(
+            '--compare-indexes',
+            action='store_true',
+            help='Also measure with the pre-audit indexes and report both',
+        )
+        parser.add_argument(
+            '--output',
+            help='Write the results as JSON to this file',
+        )
+
+    def handle(self, *args, **options):
+        existing = Photo.objects.count()
+        if options['generate'] > existing:
+            generate_library(options['generate'] - existing, seed=existing, stdout=self.stdout)
+
+        shapes = self._resolve_shapes()
+        results = {'photos': Photo.objects.count(), 'vendor': connection.vendor}
+
+        if options['compare_indexes']:
+            self._swap_indexes(drop=AUDIT_INDEXES, create=LEGACY_INDEXES)
+            try:
+                results['before'] = self._run(shapes, options['repeat'])
+            finally:
+                self._swap_indexes(drop=LEGACY_INDEXES, create=AUDIT_INDEXES)
+
+        results['after'] = self._run(shapes, options['repeat'])
+        self._report(results)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+    def _resolve_shapes(self):
+        """Replace 'popular'/'rare' placeholders with real tag ids"""
+        picks = {}
+        for param, model in TAG_PARAMS.items():
+            tags = list(
+                model.objects.annotate(photo_count=Count('photos'))
+                .filter(photo_count__gt=0)
+                .order_by('-photo_count')
+                .values_list('id', flat=True)
+            )
+            if tags:
+                picks[param] = {'popular': tags[0], 'rare': tags[len(tags) * 3 // 4]}
+
+        shapes = []
+        for name, params in QUERY_SHAPES:
+            params = dict(params)
+            for param in TAG_PARAMS:
+                if param in params:
+                    if param not in picks:
+                        break
+                    params[param] = str(picks[param][params[param]])
+            else:
+                shapes.append((name, params))
+        return shapes
+
+    def _run(self, shapes, repeat):
+        call_command('optimize_database', analyze=True, stdout=self.stdout)
+        results = {}
+        for name, params in shapes:
+            queryset = filter_photos(params)
+            count_times, page_times = [], []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                count = queryset.count()
+                count_times.append(time.perf_counter() - started)
+
+                started = time.perf_counter()
+                list(queryset[:50])
+                page_times.append(time.perf_counter() - started)
+
+            results[name] = {
+                'params': params,
+                'rows': count,
+                'count_ms': round(statistics.median(count_times) * 1000, 2),
+                'page_ms': round(statistics.median(page_times) * 1000, 2),
+                'plan': queryset[:50].explain(),
+            }
+        return results
+
+    def _swap_indexes(self, drop, create):
+        with connection.schema_editor() as schema_editor:
+            for model, index in drop:
+                schema_editor.remove_index(model, index)
+            for model, index in create:
+                schema_editor.add_index(model, index)
+
+    def _report(self, results):
+        self.stdout.write(f'\n{results["photos"]} photos on {results["vendor"]}')
+        before = results.get('before', {})
+        header = f'{"shape":<22}{"rows":>8}{"count ms":>11}{"page ms":>10}'
+        if before:
+            header += f'{"before count":>14}{"before page":>13}'
+        self.stdout.write(header)
+
+        for name, result in results['after'].items():
+            line = (
+                f'{name:<22}{result["rows"]:>8}'
+                f'{result["count_ms"]:>11.1f}{result["page_ms"]:>10.1f}'
+            )
+            if name in before:
+                line += (
+                    f'{before[name]["count_ms"]:>14.1f}'
+                    f'{before[name]["page_ms"]:>13.1f}'
+                )
+            self.stdout.write(line)
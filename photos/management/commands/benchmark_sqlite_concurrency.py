@@ -0,0 +1,163 @@
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.test import RequestFactory
+from photos.models import Photo
+from photos.synthetic import generate_library
+from photos.views import PhotoListView
+
+
+LIST_PAGES = [
+    {},
+    {'favorites': 'true'},
+    {'videos': 'true'},
+    {'page': '3'},
+    {'sort': '-score__overall'},
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures list page latency with and without a concurrent sync writer. '
+        'Run once with DATABASE_PROFILE=performance and once without to compare.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--readers',
+            type=int,
+            default=4,
+            help='Number of concurrent reader threads',
+        )
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=10,
+            help='Seconds to measure each phase',
+        )
+        parser.add_argument(
+            '--seed-photos',
+            type=int,
+            default=0,
+            help='Generate this many synthetic photos first if the library is empty',
+        )
+        parser.add_argument(
+            '--sync',
+            action='store_true',
+            help='Run sync_photos_command --force-update as the writer instead '
+                 'of simulating its write pattern',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('This benchmark targets the SQLite backend')
+
+        if not Photo.objects.exists():
+            if not options['seed_photos']:
+                raise CommandError('The library is empty; pass --seed-photos N')
+            generate_library(options['seed_photos'], stdout=self.stdout)
+
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            journal_mode = cursor.fetchone()[0]
+        self.stdout.write(
+            f'Profile: {settings.DATABASE_PROFILE} (journal_mode={journal_mode}), '
+            f'{options["readers"]} readers, {options["duration"]}s per phase'
+        )
+
+        idle = self._measure(options, writer=None)
+        self._report('Readers only', idle)
+
+        writer = self._run_sync if options['sync'] else self._simulate_sync
+        busy = self._measure(options, writer=writer)
+        self._report('Readers during sync', busy)
+
+    def _measure(self, options, writer):
+        stop = threading.Event()
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+
+        def read():
+            factory = RequestFactory()
+            view = PhotoListView.as_view()
+            rng = random.Random()
+            try:
+                while not stop.is_set():
+                    request = factory.get('/', rng.choice(LIST_PAGES))
+                    # The simulated writer leaves the generation alone, so
+                    # cached result ids would turn every read into a hit
+                    cache.clear()
+                    started = time.perf_counter()
+                    try:
+                        view(request).render()
+                    except Exception as e:
+                        with lock:
+                            errors.append(str(e))
+                        continue
+                    with lock:
+                        latencies.append(time.perf_counter() - started)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=read) for _ in range(options['readers'])]
+        if writer:
+            threads.append(threading.Thread(target=writer, args=(stop,)))
+        for thread in threads:
+            thread.start()
+
+        time.sleep(options['duration'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        return latencies, errors
+
+    def _simulate_sync(self, stop):
+        """Rewrite photos the way sync_photos_command does: one save() per
+        photo inside transactions of 100"""
+        ids = list(Photo.objects.values_list('id', flat=True))
+        rng = random.Random(0)
+        try:
+            while not stop.is_set():
+                with transaction.atomic():
+                    for photo in Photo.objects.filter(id__in=rng.sample(ids, min(100, len(ids)))):
+                        photo.title = f'Synced {rng.randrange(100000)}'
+                        photo.save()
+        finally:
+            connections.close_all()
+
+    def _run_sync(self, stop):
+        process = subprocess.Popen(
+            [sys.executable, 'manage.py', 'sync_photos_command', '--force-update'],
+            cwd=settings.BASE_DIR,
+            stdout=subprocess.DEVNULL,
+        )
+        stop.wait()
+        if process.poll() is None:
+            process.terminate()
+        process.wait()
+
+    def _report(self, label, result):
+        latencies, errors = result
+        if len(latencies) < 2:
+            self.stdout.write(self.style.ERROR(f'{label}: no successful requests'))
+            return
+
+        latencies = sorted(latency * 1000 for latency in latencies)
+        quantiles = statistics.quantiles(latencies, n=100)
+        self.stdout.write(
+            f'{label}: {len(latencies)} requests, {len(errors)} errors\n'
+            f'  p50={quantiles[49]:.1f}ms p95={quantiles[94]:.1f}ms '
+            f'p99={quantiles[98]:.1f}ms max={latencies[-1]:.1f}ms'
+        )
+        for error in sorted(set(errors))[:5]:
+            self.stdout.write(self.style.ERROR(f'  {error}'))
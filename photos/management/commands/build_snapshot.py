@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from photos.generation import next_generation
+from photos.snapshot import write_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Writes a columnar snapshot of the library and starts a new generation'
+
+    def handle(self, *args, **options):
+        with next_generation() as generation:
+            path = write_snapshot(generation)
+        self.stdout.write(
+            self.style.SUCCESS(f'Snapshot for generation {generation} written to {path}')
+        )
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from photos.events import rebuild_events, update_events
+from photos.models import Event, Photo
+
+
+class Command(BaseCommand):
+    help = (
+        'Groups photos into events by time and place. Sync keeps events up to '
+        'date; run this after changing EVENT_GAP_HOURS or EVENT_DISTANCE_KM.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Drop all events and group every photo from scratch',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f'Splitting events at gaps over {settings.EVENT_GAP_HOURS} hours '
+            f'or {settings.EVENT_DISTANCE_KM} km'
+        )
+        if options['rebuild'] or not Event.objects.exists():
+            removed, created = rebuild_events()
+        else:
+            # Only the dated photos not in an event yet
+            removed, created = update_events(
+                Photo.objects.filter(event__isnull=True, date__isnull=False).values_list('id', flat=True)
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'\nEvent clustering completed!\n'
+                f'Removed: {removed}\n'
+                f'Created: {created}\n'
+                f'Total events: {Event.objects.count()}'
+            )
+        )
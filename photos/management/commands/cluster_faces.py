@@ -0,0 +1,144 @@
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from PIL import Image
+from photos import embeddings
+from photos.faces import assign_clusters, crop_face, from_bytes, to_bytes, update_cluster_sizes
+from photos.models import Face, FaceCluster
+from photos.thumbnails import get_thumbnail
+
+
+class Command(BaseCommand):
+    help = 'Embeds unnamed faces and groups them into clusters'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=64,
+            help='Number of faces to embed per model call',
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=settings.FACE_CLUSTER_THRESHOLD,
+            help='Minimum cosine similarity for joining an existing cluster',
+        )
+        parser.add_argument(
+            '--recluster',
+            action='store_true',
+            help='Drop all clusters and assign every face from scratch',
+        )
+
+    def handle(self, *args, **options):
+        if options['recluster']:
+            FaceCluster.objects.all().delete()
+
+        embedded = self._embed_faces(options['batch_size'])
+        assigned, created = self._cluster_faces(options['threshold'])
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'\nFace clustering completed!\n'
+                f'Embedded: {embedded}\n'
+                f'Assigned: {assigned}\n'
+                f'New clusters: {created}'
+            )
+        )
+
+    def _embed_faces(self, batch_size):
+        """Embed every unnamed face that has no embedding yet"""
+        faces = Face.objects.filter(
+            person__isnull=True, embedding__isnull=True
+        ).select_related('photo').only(
+            'id', 'center_x', 'center_y', 'width', 'height',
+            'photo__uuid', 'photo__path',
+        )
+
+        # Group by photo so every source image is opened once
+        by_photo = defaultdict(list)
+        for face in faces.iterator():
+            by_photo[face.photo_id].append(face)
+
+        self.stdout.write(f'Embedding faces from {len(by_photo)} photos...')
+
+        embedded = 0
+        crops, pending = [], []
+        for photo_faces in by_photo.values():
+            photo = photo_faces[0].photo
+            try:
+                source = get_thumbnail(photo.uuid, photo.path, settings.FACE_SOURCE_SIZE)
+                if source is None:
+                    continue
+                with Image.open(source) as img:
+                    img = img.convert('RGB')
+                    for face in photo_faces:
+                        crop = crop_face(img, face)
+                        if crop is not None:
+                            crops.append(crop)
+                            pending.append(face)
+            except Exception as e:
+                self.stdout.write(
+                    self.style.ERROR(f'Error loading photo {photo.uuid}: {str(e)}')
+                )
+
+            if len(crops) >= batch_size:
+                embedded += self._save_embeddings(pending, crops)
+                crops, pending = [], []
+                self.stdout.write(f'Progress: {embedded} faces embedded')
+
+        if crops:
+            embedded += self._save_embeddings(pending, crops)
+
+        return embedded
+
+    def _save_embeddings(self, faces, crops):
+        vectors = embeddings.encode_images(crops)
+        for face, vector in zip(faces, vectors):
+            face.embedding = to_bytes(vector)
+        Face.objects.bulk_update(faces, ['embedding'])
+        return len(faces)
+
+    def _cluster_faces(self, threshold):
+        """Assign unclustered faces to existing centroids or new clusters"""
+        faces = list(
+            Face.objects.filter(
+                person__isnull=True, cluster__isnull=True, embedding__isnull=False
+            ).only('id', 'embedding')
+        )
+        if not faces:
+            return 0, 0
+
+        clusters = list(FaceCluster.objects.all())
+        vectors = np.vstack([from_bytes(face.embedding) for face in faces])
+        centroids = np.vstack(
+            [from_bytes(cluster.centroid) for cluster in clusters]
+        ) if clusters else np.empty((0, vectors.shape[1]), dtype=np.float32)
+
+        labels, centroids, sizes = assign_clusters(
+            vectors, centroids, [cluster.size for cluster in clusters], threshold
+        )
+
+        with transaction.atomic():
+            for index, cluster in enumerate(clusters):
+                cluster.centroid = to_bytes(centroids[index])
+                cluster.size = sizes[index]
+            FaceCluster.objects.bulk_update(clusters, ['centroid', 'size'])
+
+            new_clusters = FaceCluster.objects.bulk_create([
+                FaceCluster(centroid=to_bytes(centroids[index]), size=sizes[index])
+                for index in range(len(clusters), len(sizes))
+            ])
+            clusters.extend(new_clusters)
+
+            for face, label in zip(faces, labels):
+                face.cluster = clusters[label]
+            Face.objects.bulk_update(faces, ['cluster'], batch_size=500)
+            # The running sizes above only count additions; faces named or
+            # removed since are only seen by counting
+            update_cluster_sizes()
+
+        return len(faces), len(new_clusters)
@@ -0,0 +1,99 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from photos.duplicates import dhash_file, to_signed
+from photos.models import Photo
+from photos.thumbnails import render_thumbnail, thumbnail_path
+
+
+def _hash_photo(task):
+    """Hash one photo from its cached thumbnail (runs in a worker process)"""
+    pk, source_path, cache_path = task
+    try:
+        if not os.path.exists(cache_path):
+            if not source_path or not os.path.exists(source_path):
+                return pk, None, 'file not found'
+            render_thumbnail(source_path, cache_path)
+        return pk, to_signed(dhash_file(cache_path)), None
+    except Exception as e:
+        return pk, None, str(e)
+
+
+class Command(BaseCommand):
+    help = 'Computes perceptual hashes for duplicate detection'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Recompute hashes for photos that already have one',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Number of worker processes',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of hashes to write per database update',
+        )
+        parser.add_argument(
+            '--uuid',
+            action='append',
+            help='Only hash the photo with this uuid; repeat for several',
+        )
+
+    def handle(self, *args, **options):
+        queryset = Photo.objects.filter(is_photo=True)
+        if not options['force']:
+            queryset = queryset.filter(phash__isnull=True)
+        if options['uuid']:
+            queryset = queryset.filter(uuid__in=options['uuid'])
+
+        tasks = [
+            (pk, path, thumbnail_path(uuid))
+            for pk, uuid, path in queryset.values_list(
+                'pk', 'uuid', 'path'
+            ).iterator()
+        ]
+        self.stdout.write(f'Hashing {len(tasks)} photos...')
+
+        hashed = 0
+        errors = 0
+        pending = []
+        # bulk_update() skips auto_now, and the duplicates page caches its
+        # clusters until updated_at changes
+        now = timezone.now()
+        batch_size = options['batch_size']
+
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            for pk, value, error in executor.map(_hash_photo, tasks, chunksize=64):
+                if error:
+                    errors += 1
+                    self.stdout.write(
+                        self.style.ERROR(f'Error hashing photo {pk}: {error}')
+                    )
+                    continue
+
+                pending.append(Photo(pk=pk, phash=value, updated_at=now))
+                hashed += 1
+                if len(pending) >= batch_size:
+                    Photo.objects.bulk_update(pending, ['phash', 'updated_at'])
+                    pending = []
+                    self.stdout.write(f'Progress: {hashed}/{len(tasks)}')
+
+        if pending:
+            Photo.objects.bulk_update(pending, ['phash', 'updated_at'])
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'\nHashing completed!\n'
+                f'Hashed: {hashed}\n'
+                f'Errors: {errors}'
+            )
+        )
@@ -0,0 +1,104 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from PIL import Image
+from photos import embeddings
+from photos.generation import next_generation
+from photos.models import Photo
+from photos.snapshot import write_snapshot
+from photos.thumbnails import get_thumbnail
+
+
+class Command(BaseCommand):
+    help = 'Embeds photo thumbnails into the Qdrant vector index for semantic search'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Re-embed photos that are already in the index',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=64,
+            help='Number of photos to embed per model call',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            help='Limit the number of photos to process',
+        )
+        parser.add_argument(
+            '--uuid',
+            action='append',
+            help='Only embed the photo with this uuid; repeat for several',
+        )
+
+    def handle(self, *args, **options):
+        embeddings.ensure_collection()
+
+        queryset = Photo.objects.filter(is_photo=True)
+        if options['uuid']:
+            queryset = queryset.filter(uuid__in=options['uuid'])
+        photos = list(queryset.values_list('pk', 'uuid', 'path'))
+        if options['limit']:
+            photos = photos[:options['limit']]
+
+        total_photos = len(photos)
+        self.stdout.write(f'Embedding {total_photos} photos...')
+
+        embedded = 0
+        skipped = 0
+        errors = 0
+        batch_size = options['batch_size']
+
+        for i in range(0, total_photos, batch_size):
+            batch = photos[i:i + batch_size]
+
+            if not options['force']:
+                done = embeddings.existing_ids([pk for pk, _, _ in batch])
+                skipped += len(done)
+                batch = [row for row in batch if row[0] not in done]
+
+            ids, uuids, images = [], [], []
+            for pk, uuid, path in batch:
+                try:
+                    thumb_path = get_thumbnail(uuid, path)
+                    if thumb_path is None:
+                        errors += 1
+                        continue
+                    with Image.open(thumb_path) as img:
+                        images.append(img.convert('RGB'))
+                    ids.append(pk)
+                    uuids.append(uuid)
+                except Exception as e:
+                    errors += 1
+                    self.stdout.write(
+                        self.style.ERROR(f'Error loading photo {uuid}: {str(e)}')
+                    )
+
+            if images:
+                embeddings.upsert_photos(ids, uuids, embeddings.encode_images(images))
+                embedded += len(images)
+
+            self.stdout.write(
+                f'Progress: {min(i + batch_size, total_photos)}/{total_photos} '
+                f'(Embedded: {embedded}, Skipped: {skipped}, Errors: {errors})'
+            )
+
+        if embedded:
+            # Cached semantic search results are keyed by generation, so
+            # start a new one for them to pick up the new embeddings
+            with next_generation() as generation:
+                if settings.PHOTO_SNAPSHOT:
+                    write_snapshot(generation)
+            self.stdout.write(f'Library generation is now {generation}')
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'\nEmbedding completed!\n'
+                f'Embedded: {embedded}\n'
+                f'Skipped: {skipped}\n'
+                f'Errors: {errors}'
+            )
+        )
@@ -0,0 +1,85 @@
+import sys
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from photos.export import FORMATS, export_chunks, export_stream
+from photos.filters import filter_photos
+from photos.models import Photo
+
+
+class Command(BaseCommand):
+    help = (
+        'Streams the metadata, scores and tag names of every photo to a file as '
+        'NDJSON, CSV or Parquet, in constant memory'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format',
+            choices=list(FORMATS),
+            default='ndjson',
+            help='Output format; parquet needs pyarrow',
+        )
+        parser.add_argument(
+            '--output',
+            default='-',
+            help='File to write, or - for standard output',
+        )
+        parser.add_argument(
+            '--filter',
+            action='append',
+            default=[],
+            metavar='KEY=VALUE',
+            help='Photo list filter to apply, e.g. favorites=true or album=3; repeat for several',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Number of photos read from the database at a time',
+        )
+        parser.add_argument(
+            '--row-group-size',
+            type=int,
+            default=50000,
+            help='Number of photos per Parquet row group',
+        )
+
+    def handle(self, *args, **options):
+        params = {}
+        for item in options['filter']:
+            key, sep, value = item.partition('=')
+            if not sep:
+                raise CommandError(f'Filters are KEY=VALUE, got {item!r}')
+            params[key] = value
+        queryset = filter_photos(params) if params else Photo.objects.order_by('id')
+
+        chunks = export_chunks(queryset, options['chunk_size'])
+        counted = self._count(chunks)
+        try:
+            stream = export_stream(options['format'], counted, options['row_group_size'])
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+
+        to_stdout = options['output'] == '-'
+        output = sys.stdout.buffer if to_stdout else open(options['output'], 'wb')
+        try:
+            for block in stream:
+                output.write(block)
+        finally:
+            if to_stdout:
+                output.flush()
+            else:
+                output.close()
+
+        # Keep standard output clean for the data itself
+        report = self.stderr if to_stdout else self.stdout
+        report.write(self.style.SUCCESS(
+            f'Exported {self.exported} photos to {options["output"]} as {options["format"]}'
+        ))
+
+    def _count(self, chunks):
+        self.exported = 0
+        for chunk in chunks:
+            self.exported += len(chunk)
+            yield chunk
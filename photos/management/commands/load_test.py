@@ -0,0 +1,134 @@
+import asyncio
+import json
+import statistics
+import time
+
+import httpx
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+from photos.models import Photo
+
+
+class Command(BaseCommand):
+    help = (
+        'Fires concurrent requests at a running server and reports throughput '
+        'and latency for each concurrency level'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url',
+            default='http://localhost:8000',
+            help='Base URL of the server under test',
+        )
+        parser.add_argument(
+            '--endpoint',
+            choices=['thumbnail', 'full', 'autocomplete', 'list'],
+            default='thumbnail',
+            help='Which view to request',
+        )
+        parser.add_argument(
+            '--concurrency',
+            default='1,8,32,128',
+            help='Comma-separated numbers of requests kept in flight',
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=500,
+            help='Requests to send per concurrency level',
+        )
+        parser.add_argument(
+            '--photos',
+            type=int,
+            default=50,
+            help='Number of distinct photos to cycle through',
+        )
+        parser.add_argument(
+            '--timeout',
+            type=float,
+            default=30,
+            help='Per-request timeout in seconds',
+        )
+        parser.add_argument(
+            '--output',
+            help='Write the results as JSON to this file',
+        )
+
+    def handle(self, *args, **options):
+        paths = self._paths(options['endpoint'], options['requests'], options['photos'])
+        if not paths:
+            self.stdout.write(self.style.ERROR('No photos to request'))
+            return
+
+        results = []
+        for concurrency in [int(c) for c in options['concurrency'].split(',')]:
+            result = asyncio.run(
+                self._run(options['url'], paths, concurrency, options['timeout'])
+            )
+            results.append(result)
+            self.stdout.write(
+                f'concurrency {concurrency:>4}: {result["rps"]:>8.1f} req/s  '
+                f'p50 {result["p50_ms"]:>7.1f} ms  p95 {result["p95_ms"]:>7.1f} ms  '
+                f'p99 {result["p99_ms"]:>7.1f} ms  errors {result["errors"]}'
+            )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'endpoint': options['endpoint'], 'results': results}, f, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+    def _paths(self, endpoint, count, photos):
+        """Build the request paths, cycling through photos that have a file"""
+        if endpoint == 'autocomplete':
+            return [f'{reverse("photos:search_autocomplete")}?q=a{i % 10}' for i in range(count)]
+        if endpoint == 'list':
+            return [f'{reverse("photos:photo_list")}?page={i % 20 + 1}' for i in range(count)]
+
+        ids = list(
+            Photo.objects.exclude(path='').order_by('-date').values_list('id', flat=True)[:photos]
+        )
+        name = 'photos:photo_thumbnail' if endpoint == 'thumbnail' else 'photos:photo_full'
+        return [reverse(name, args=[ids[i % len(ids)]]) for i in range(count)] if ids else []
+
+    async def _run(self, url, paths, concurrency, timeout):
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        queue = asyncio.Queue()
+        for path in paths:
+            queue.put_nowait(path)
+        latencies, errors = [], 0
+
+        async def worker(client):
+            nonlocal errors
+            while not queue.empty():
+                path = queue.get_nowait()
+                started = time.perf_counter()
+                try:
+                    response = await client.get(path)
+                    await response.aread()
+                    if response.status_code >= 400:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        async with httpx.AsyncClient(base_url=url, limits=limits, timeout=timeout) as client:
+            started = time.perf_counter()
+            await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+            elapsed = time.perf_counter() - started
+
+        latencies.sort()
+
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2)
+
+        return {
+            'concurrency': concurrency,
+            'requests': len(paths),
+            'errors': errors,
+            'rps': round(len(paths) / elapsed, 1),
+            'mean_ms': round(statistics.mean(latencies) * 1000, 2),
+            'p50_ms': percentile(0.50),
+            'p95_ms': percentile(0.95),
+            'p99_ms': percentile(0.99),
+        }
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+
+class Command(BaseCommand):
+    help = 'Refreshes query planner statistics (run periodically, e.g. from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--analyze',
+            action='store_true',
+            help='Run a full ANALYZE instead of the incremental PRAGMA optimize',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            action='store_true',
+            help='Checkpoint and truncate the SQLite write-ahead log',
+        )
+
+    def handle(self, *args, **options):
+        with connection.cursor() as cursor:
+            if connection.vendor != 'sqlite':
+                cursor.execute('ANALYZE')
+                self.stdout.write(self.style.SUCCESS('ANALYZE completed'))
+                return
+
+            if options['analyze']:
+                cursor.execute('ANALYZE')
+            else:
+                # Only re-analyzes tables whose statistics are out of date
+                cursor.execute('PRAGMA analysis_limit=1000')
+                cursor.execute('PRAGMA optimize')
+
+            if options['checkpoint']:
+                cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+        self.stdout.write(self.style.SUCCESS('Database optimized'))
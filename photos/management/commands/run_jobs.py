@@ -0,0 +1,80 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from photos.jobs import claim, requeue_stale, run_job, worker_name
+from photos.models import Job
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs queued jobs one at a time, most urgent first. Start several '
+        'workers to run jobs in parallel; JOB_COMMANDS caps each command. '
+        'Stops after the current job on SIGINT or SIGTERM.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--command',
+            action='append',
+            dest='commands',
+            help='Only run jobs for this command; repeat for several',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once no job can run, instead of waiting for more',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=settings.JOB_POLL_INTERVAL,
+            help='Seconds to wait between checks of an empty queue',
+        )
+        parser.add_argument(
+            '--quiet',
+            action='store_true',
+            help="Do not echo the jobs' output",
+        )
+
+    def handle(self, *args, **options):
+        worker = worker_name()
+        self.stopping = threading.Event()
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGTERM, self._stop)
+        self.stdout.write(f'Worker {worker} waiting for jobs')
+
+        done = failed = 0
+        while not self.stopping.is_set():
+            close_old_connections()
+            requeued, expired = requeue_stale()
+            if requeued or expired:
+                self.stdout.write(f'Stale jobs: {requeued} queued again, {expired} failed')
+
+            job = claim(worker, options['commands'])
+            if job is None:
+                if options['once']:
+                    break
+                self.stopping.wait(options['poll_interval'])
+                continue
+
+            described = {
+                key: f'{len(value)} photos' if key == 'uuid' else value
+                for key, value in job.options.items()
+            }
+            self.stdout.write(f'Running job {job.pk}: {job.command} {described or ""}')
+            job = run_job(job, echo=None if options['quiet'] else self.stdout)
+            if job.status == Job.DONE:
+                done += 1
+                self.stdout.write(self.style.SUCCESS(f'Job {job.pk} done'))
+            else:
+                failed += 1
+                self.stdout.write(self.style.ERROR(f'Job {job.pk} failed:\n{job.error}'))
+
+        self.stdout.write(self.style.SUCCESS(f'Worker stopped ({done} done, {failed} failed)'))
+
+    def _stop(self, signum, frame):
+        self.stdout.write('Stopping after the current job...')
+        self.stopping.set()
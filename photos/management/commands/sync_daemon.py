@@ -0,0 +1,338 @@
+import json
+import os
+import signal
+import tempfile
+import threading
+import time
+from datetime import datetime
+from itertools import chain
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils import timezone
+from photos.filesystem import FilesystemSource, IMAGE_TYPES, walk
+from photos.management.commands.sync_photos_command import Command as SyncCommand
+from photos.models import Photo
+
+
+class PendingChanges:
+    """Changes collected between syncs.
+
+    A batch is due once nothing has changed for debounce seconds, or
+    max_delay seconds after its first change when changes keep coming.
+    """
+
+    def __init__(self, debounce, max_delay):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._items = set()
+        self._first = self._last = None
+
+    def add(self, *items):
+        now = time.monotonic()
+        with self._lock:
+            self._items.update(items)
+            if self._first is None:
+                self._first = now
+            self._last = now
+
+    def due(self):
+        now = time.monotonic()
+        with self._lock:
+            return self._first is not None and (
+                now - self._last >= self.debounce or now - self._first >= self.max_delay
+            )
+
+    def take(self):
+        with self._lock:
+            items, self._items = self._items, set()
+            self._first = self._last = None
+        return items
+
+    def __bool__(self):
+        with self._lock:
+            return self._first is not None
+
+
+def checkpoint_path():
+    return os.path.join(str(settings.LIBRARY_STATE_DIR), 'sync_daemon.json')
+
+
+def load_checkpoint():
+    try:
+        with open(checkpoint_path()) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_checkpoint(checkpoint):
+    os.makedirs(str(settings.LIBRARY_STATE_DIR), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=str(settings.LIBRARY_STATE_DIR), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, checkpoint_path())
+
+
+class Command(BaseCommand):
+    help = (
+        'Watches the photo source and syncs what changed in debounced batches. '
+        'Stops after the current batch on SIGINT or SIGTERM.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source',
+            choices=['photos', 'filesystem'],
+            default='photos',
+            help='Watch the macOS Photos library, or the image files under --root',
+        )
+        parser.add_argument(
+            '--root',
+            action='append',
+            default=[],
+            help='Directory to watch with --source filesystem; repeat for several',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Processes reading files for --source filesystem (default: FILESYSTEM_IMPORT_WORKERS)',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=1.0,
+            help='Seconds between checks for changes',
+        )
+        parser.add_argument(
+            '--debounce',
+            type=float,
+            default=3.0,
+            help='Sync once nothing has changed for this many seconds',
+        )
+        parser.add_argument(
+            '--max-delay',
+            type=float,
+            default=30.0,
+            help='Sync at the latest this many seconds after the first change of a burst',
+        )
+        parser.add_argument(
+            '--maintenance-interval',
+            type=float,
+            default=600.0,
+            help='Seconds between refreshes of planner statistics, face cluster sizes and the '
+                 'snapshot after syncs; they also run at startup and shutdown',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Number of photos to write in each transaction',
+        )
+
+    def handle(self, *args, **options):
+        if options['source'] == 'filesystem' and not options['root']:
+            raise CommandError('--source filesystem needs at least one --root')
+
+        self.options = options
+        self.syncer = SyncCommand(stdout=self.stdout, stderr=self.stderr)
+        self.pending = PendingChanges(options['debounce'], options['max_delay'])
+        self.checkpoint = load_checkpoint()
+        if self.checkpoint.get('source') != options['source']:
+            self.checkpoint = {'source': options['source']}
+        # Batches skip the library-wide work after a sync; it runs in
+        # _maintain() once enough time has passed
+        self.unmaintained = False
+        self.maintained_at = time.monotonic()
+
+        self.stopping = threading.Event()
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGTERM, self._stop)
+
+        if options['source'] == 'filesystem':
+            self._watch_filesystem()
+        else:
+            self._watch_photos()
+        self.stdout.write(self.style.SUCCESS('Sync daemon stopped'))
+
+    def _stop(self, signum, frame):
+        self.stdout.write('Stopping after the current batch...')
+        self.stopping.set()
+
+    def _run(self, poll, flush):
+        """Poll for changes and flush them when due, until asked to stop.
+        Changes still pending at shutdown are flushed before returning."""
+        while not self.stopping.wait(self.options['interval']):
+            poll()
+            if self.pending.due():
+                self._flush(flush)
+            self._maintain()
+        if self.pending:
+            self._flush(flush)
+        self._maintain(force=True)
+
+    def _sync(self, photos, **options):
+        self.syncer.sync(photos, batch_size=self.options['batch_size'], maintenance=False, **options)
+        self.unmaintained = True
+
+    def _maintain(self, force=False):
+        """Run the work batches leave out, at most once every
+        --maintenance-interval seconds unless forced"""
+        if not self.unmaintained:
+            return
+        if not force and time.monotonic() - self.maintained_at < self.options['maintenance_interval']:
+            return
+        close_old_connections()
+        try:
+            generation = self.syncer.maintain()
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Maintenance failed, will retry: {e}'))
+            return
+        self.unmaintained = False
+        self.maintained_at = time.monotonic()
+        self.stdout.write(f'Library maintained, generation is now {generation}')
+
+    def _flush(self, flush):
+        changes = self.pending.take()
+        close_old_connections()
+        try:
+            flush(changes)
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Sync failed, will retry: {e}'))
+            self.pending.add(*changes)
+            return
+        self.checkpoint['synced_at'] = timezone.now().isoformat()
+        save_checkpoint(self.checkpoint)
+
+    # Photos library
+
+    def _watch_photos(self):
+        # Imported here so the rest of the app runs where osxphotos is not installed
+        import osxphotos
+
+        self.osxphotos = osxphotos
+        photosdb = self._sync_library()
+        self._maintain(force=True)
+        save_checkpoint(self.checkpoint)
+        # Photos writes through SQLite's write-ahead log, so watch both files
+        self.watched = [photosdb.db_path, f'{photosdb.db_path}-wal']
+        self.mtimes = self._mtimes()
+        self.stdout.write(f'Watching {photosdb.db_path}')
+        self._run(self._poll_library, lambda changes: self._sync_library())
+
+    def _mtimes(self):
+        mtimes = []
+        for path in self.watched:
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return mtimes
+
+    def _poll_library(self):
+        mtimes = self._mtimes()
+        if mtimes != self.mtimes:
+            self.mtimes = mtimes
+            self.pending.add('library')
+
+    def _sync_library(self):
+        """Sync the photos added or modified since the checkpoint"""
+        photosdb = self.osxphotos.PhotosDB()
+        since = self.checkpoint.get('last_change')
+        since = datetime.fromisoformat(since) if since else None
+
+        changed, last_change = [], since
+        for photo_info in photosdb.photos():
+            changed_at = self._changed_at(photo_info)
+            if changed_at is None or (since and changed_at <= since):
+                continue
+            changed.append(photo_info)
+            last_change = max(last_change, changed_at) if last_change else changed_at
+
+        if changed:
+            self.stdout.write(f'{len(changed)} photos changed in the Photos library')
+            self._sync(changed)
+        if last_change:
+            self.checkpoint['last_change'] = last_change.isoformat()
+        return photosdb
+
+    def _changed_at(self, photo_info):
+        dates = [
+            timezone.make_aware(date) if timezone.is_naive(date) else date
+            for date in (photo_info.date_modified, photo_info.date_added) if date
+        ]
+        return max(dates) if dates else None
+
+    # Directory trees
+
+    def _watch_filesystem(self):
+        from watchdog.observers import Observer
+
+        observer = Observer()
+        handler = FileEventHandler(self.pending)
+        for root in self.options['root']:
+            observer.schedule(handler, os.path.abspath(root), recursive=True)
+        observer.start()
+        try:
+            # Catch up with what changed while the daemon was not running;
+            # only new and changed files are read
+            self._sync_files(None)
+            self._maintain(force=True)
+            self.stdout.write(f'Watching {", ".join(self.options["root"])}')
+            self._run(lambda: None, self._sync_files)
+        finally:
+            observer.stop()
+            observer.join()
+
+    def _sync_files(self, changes):
+        """Sync the changed files, or the whole roots when changes is None"""
+        paths = None
+        if changes is not None:
+            paths = set()
+            for path, is_directory in changes:
+                if not is_directory:
+                    paths.add(path)
+                    continue
+                # A directory was created, moved or removed: take every file
+                # now under it and every photo imported from under it
+                paths.update(file[0] for file in walk(path))
+                paths.update(
+                    Photo.objects.filter(path__startswith=os.path.join(path, ''))
+                    .values_list('path', flat=True)
+                )
+
+        source = FilesystemSource(self.options['root'], workers=self.options['workers'])
+        photos = source.photos(paths)
+        # Leave the library generation alone when nothing changed
+        first = next(photos, None)
+        if first is not None or source.missing:
+            self._sync(chain([first], photos) if first is not None else [], force_update=True)
+        for path, error in source.failed:
+            self.stdout.write(self.style.ERROR(f'Could not read {path}: {error}'))
+        for path, original in source.duplicates:
+            self.stdout.write(f'Skipped {path}: same content as {original}')
+        self.stdout.write(
+            f'Files: {source.unchanged} unchanged, {len(source.failed)} unreadable, '
+            f'{len(source.duplicates)} duplicates, {source.missing} photos marked missing'
+        )
+
+
+class FileEventHandler:
+    """watchdog event handler queueing changed image files and directories"""
+
+    def __init__(self, pending):
+        self.pending = pending
+
+    def dispatch(self, event):
+        if event.event_type in ('opened', 'closed_no_write'):
+            return
+        for path in (event.src_path, getattr(event, 'dest_path', '')):
+            if not path or os.path.basename(path).startswith('.'):
+                continue
+            if event.is_directory:
+                if event.event_type != 'modified':
+                    self.pending.add((path, True))
+            elif os.path.splitext(path)[1].lower() in IMAGE_TYPES:
+                self.pending.add((path, False))
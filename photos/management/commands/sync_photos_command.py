@@ -1,18 +1,57 @@
-import osxphotos
-from django.core.management.base import BaseCommand
+import json
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
 from django.utils import timezone
 from datetime import datetime
 import pytz
+from photos.events import update_events
+from photos.faces import update_cluster_sizes
+from photos.filesystem import FilesystemSource
+from photos.flags import compute_flags
+from photos.generation import bump_generation, next_generation
+from photos.jobs import enqueue_after_sync
+from photos.metrics import SyncMetrics
+from photos.profiling import Profiler
 from photos.models import (
     Photo, Album, Person, Keyword, Label, PhotoScore, Face
 )
+from photos.snapshot import write_snapshot
+from photos.thumbnails import discard_thumbnails
+
+
+# Face fields taken from the source on every sync
+FACE_SYNC_FIELDS = [
+    'uuid', 'center_x', 'center_y', 'width', 'height', 'age', 'gender', 'ethnicity',
+    'quality', 'is_hidden', 'person',
+]
 
 
 class Command(BaseCommand):
-    help = 'Syncs photos from macOS Photos app to Django database'
+    help = 'Syncs photos from macOS Photos app, or from directories of image files, to Django database'
 
     def add_arguments(self, parser):
+        parser.add_argument(
+            '--source',
+            choices=['photos', 'filesystem'],
+            default='photos',
+            help='Read the macOS Photos library, or the image files under --root',
+        )
+        parser.add_argument(
+            '--root',
+            action='append',
+            default=[],
+            help='Directory to import with --source filesystem; repeat for several',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Processes reading files for --source filesystem (default: FILESYSTEM_IMPORT_WORKERS)',
+        )
         parser.add_argument(
             '--force-update',
             action='store_true',
@@ -29,62 +68,142 @@ class Command(BaseCommand):
             type=int,
             help='Limit the number of photos to process',
         )
+        parser.add_argument(
+            '--profile',
+            action='store_true',
+            help='Profile the sync and write a report to PROFILE_DIR',
+        )
 
     def handle(self, *args, **options):
+        if not options['profile']:
+            return self._sync(options)
+
+        with Profiler() as profiler:
+            self._sync(options)
+        path = profiler.save('sync', title='sync_photos_command')
+        self.stdout.write(self.style.SUCCESS(f'Profile written to {path}.txt'))
+
+    def _sync(self, options):
         self.stdout.write('Starting Photos sync...')
+        sync_metrics = SyncMetrics()
+        source = None
+        force_update = options['force_update']
 
-        # Initialize osxphotos
-        photosdb = osxphotos.PhotosDB()
+        if options['source'] == 'filesystem':
+            if not options['root']:
+                raise CommandError('--source filesystem needs at least one --root')
+            source = FilesystemSource(options['root'], workers=options['workers'])
+            photos = source.photos()
+            # Only new and changed files come through, and a moved file keeps
+            # its uuid and modification time, so write every one of them
+            force_update = True
+        else:
+            with sync_metrics.stage('load'):
+                # Imported here so the rest of the app runs where osxphotos is not installed
+                import osxphotos
 
-        # Get all photos
-        photos = photosdb.photos()
+                # Get all photos
+                photos = osxphotos.PhotosDB().photos()
+            self.stdout.write(f'Found {len(photos)} photos in Photos library')
 
         if options['limit']:
-            photos = photos[:options['limit']]
+            # Slicing the osxphotos list keeps its length for the progress total
+            if isinstance(photos, list):
+                photos = photos[:options['limit']]
+            else:
+                photos = islice(photos, options['limit'])
+
+        self.sync(
+            photos,
+            batch_size=options['batch_size'],
+            force_update=force_update,
+            sync_metrics=sync_metrics,
+        )
+
+        if source:
+            for path, error in source.failed:
+                self.stdout.write(self.style.ERROR(f'Could not read {path}: {error}'))
+            for path, original in source.duplicates:
+                self.stdout.write(f'Skipped {path}: same content as {original}')
+            self.stdout.write(
+                f'Files: {source.unchanged} unchanged, {len(source.failed)} unreadable, '
+                f'{len(source.duplicates)} duplicates, {source.missing} photos marked missing'
+            )
+
+    def sync(self, photos, batch_size=100, force_update=False, sync_metrics=None, maintenance=True):
+        """Sync osxphotos PhotoInfo objects, or objects shaped like them.
 
-        total_photos = len(photos)
-        self.stdout.write(f'Found {total_photos} photos in Photos library')
+        photos may be any iterable; it is consumed one batch at a time.
+        Without maintenance the library-wide work of maintain() is left to
+        the caller, and the new generation is published without a snapshot.
+        """
+        sync_metrics = sync_metrics or SyncMetrics()
+        total_photos = len(photos) if isinstance(photos, list) else '?'
 
         processed = 0
         created = 0
         updated = 0
         skipped = 0
         errors = 0
-
-        batch_size = options['batch_size']
-        force_update = options['force_update']
+        # Photos created or updated, whose events are regrouped and derived
+        # data refreshed afterwards
+        changed_ids = []
+        changed_uuids = []
+        # Updated photos whose image may have changed. Their cached
+        # thumbnails are deleted, so the follow-up jobs render them again
+        # rather than skipping photos that already have one.
+        stale_uuids = []
 
         # Process photos in batches
-        for i in range(0, total_photos, batch_size):
-            batch = photos[i:i + batch_size]
+        photos = iter(photos)
+        while True:
+            with sync_metrics.stage('load'):
+                batch = list(islice(photos, batch_size))
+            if not batch:
+                break
 
             with transaction.atomic():
                 for photo_info in batch:
                     try:
                         processed += 1
 
-                        # Check if photo already exists
-                        try:
-                            photo = Photo.objects.get(uuid=photo_info.uuid)
-
-                            # Check if photo has been modified
-                            if not force_update and photo.date_modified:
-                                photo_modified = self._make_aware(photo_info.date_modified)
-                                if photo_modified and photo.date_modified >= photo_modified:
-                                    skipped += 1
-                                    continue
+                        with sync_metrics.stage('extract'):
+                            # Check if photo already exists
+                            try:
+                                photo = Photo.objects.get(uuid=photo_info.uuid)
+
+                                # Check if photo has been modified
+                                if not force_update and photo.date_modified:
+                                    photo_modified = self._make_aware(photo_info.date_modified)
+                                    if photo_modified and photo.date_modified >= photo_modified:
+                                        skipped += 1
+                                        continue
+
+                                # Update existing photo
+                                if self._update_photo(photo, photo_info):
+                                    stale_uuids.append(photo.uuid)
+                                updated += 1
+
+                            except Photo.DoesNotExist:
+                                # Create new photo
+                                photo = self._create_photo(photo_info)
+                                created += 1
+                            changed_ids.append(photo.id)
+                            changed_uuids.append(photo.uuid)
 
-                            # Update existing photo
-                            self._update_photo(photo, photo_info)
-                            updated += 1
+                        # Update relationships
+                        with sync_metrics.stage('relationships'):
+                            self._update_relationships(photo, photo_info)
 
-                        except Photo.DoesNotExist:
-                            # Create new photo
-                            photo = self._create_photo(photo_info)
-                            created += 1
+                        # Update scores
+                        if hasattr(photo_info, 'score') and photo_info.score:
+                            with sync_metrics.stage('scores'):
+                                self._update_scores(photo, photo_info.score)
 
-                        # Update relationships
-                        self._update_relationships(photo, photo_info)
+                        # Update faces
+                        if hasattr(photo_info, 'faces') and photo_info.faces:
+                            with sync_metrics.stage('faces'):
+                                self._update_faces(photo, photo_info.faces)
 
                         if processed % 10 == 0:
                             self.stdout.write(
@@ -101,6 +220,13 @@ class Command(BaseCommand):
                             )
                         )
 
+                commit_started = time.perf_counter()
+            sync_metrics.stages.observe(time.perf_counter() - commit_started, stage='commit')
+
+        if stale_uuids:
+            removed = discard_thumbnails(stale_uuids)
+            self.stdout.write(f'Discarded {removed} thumbnails of {len(stale_uuids)} changed images')
+
         self.stdout.write(
             self.style.SUCCESS(
                 f'\nSync completed!\n'
@@ -112,6 +238,48 @@ class Command(BaseCommand):
             )
         )
 
+        if changed_ids:
+            with sync_metrics.stage('events'):
+                removed, grouped = update_events(changed_ids)
+            self.stdout.write(f'Events: {removed} removed, {grouped} created')
+
+        # Publish the new library state to the web workers
+        if maintenance:
+            generation = self.maintain(sync_metrics)
+        else:
+            generation = bump_generation()
+        self.stdout.write(f'Library generation is now {generation}')
+
+        if changed_uuids and settings.JOBS_AFTER_SYNC:
+            jobs = enqueue_after_sync(changed_uuids)
+            self.stdout.write(f'Queued {", ".join(job.command for job in jobs)} for {len(changed_uuids)} photos')
+
+        sync_metrics.counts.update(
+            processed=processed, created=created, updated=updated, skipped=skipped, errors=errors,
+        )
+        summary = sync_metrics.save()
+        del summary['histogram']
+        self.stdout.write(json.dumps(summary, indent=2))
+        return summary
+
+    def maintain(self, sync_metrics=None):
+        """Refresh what is derived from the whole library after syncing:
+        face cluster sizes, planner statistics and the snapshot, published
+        as a new generation. Returns the generation."""
+        sync_metrics = sync_metrics or SyncMetrics()
+        # Faces may have been named or removed
+        update_cluster_sizes()
+
+        # Refresh planner statistics for the tables the sync just rewrote
+        with sync_metrics.stage('optimize'):
+            call_command('optimize_database', stdout=self.stdout)
+
+        with next_generation() as generation:
+            if settings.PHOTO_SNAPSHOT:
+                with sync_metrics.stage('snapshot'):
+                    write_snapshot(generation)
+        return generation
+
     def _make_aware(self, dt):
         """Convert naive datetime to aware datetime"""
         if dt is None:
@@ -204,11 +372,18 @@ class Command(BaseCommand):
             photo.place_address = photo_info.place.address_str or ''
             photo.place_is_home = getattr(photo_info.place, 'ishome', False)
 
+        photo.flags = compute_flags(photo)
         photo.save()
         return photo
 
     def _update_photo(self, photo, photo_info):
-        """Update an existing Photo object"""
+        """Update an existing Photo object.
+
+        Returns whether its image may have changed, in which case the
+        perceptual hash is cleared for compute_photo_hashes to redo.
+        """
+        image = (photo.path, photo.path_edited, photo.date_modified)
+
         # Update all fields to match create logic
         photo.original_filename = photo_info.original_filename or ''
         photo.filename = photo_info.filename or ''
@@ -280,7 +455,12 @@ class Command(BaseCommand):
         photo.burst_uuid = getattr(photo_info, 'burst_uuid', '') or ''
         photo.raw_path = getattr(photo_info, 'raw_path', '') or ''
 
+        photo.flags = compute_flags(photo)
+        image_changed = image != (photo.path, photo.path_edited, photo.date_modified)
+        if image_changed:
+            photo.phash = None
         photo.save()
+        return image_changed
 
     def _update_relationships(self, photo, photo_info):
         """Update many-to-many relationships"""
@@ -325,14 +505,6 @@ class Command(BaseCommand):
                 label, _ = Label.objects.get_or_create(name=label_name)
                 label.photos.add(photo)
 
-        # Update scores
-        if hasattr(photo_info, 'score') and photo_info.score:
-            self._update_scores(photo, photo_info.score)
-
-        # Update faces
-        if hasattr(photo_info, 'faces') and photo_info.faces:
-            self._update_faces(photo, photo_info.faces)
-
     def _update_scores(self, photo, score_info):
         """Update or create PhotoScore"""
         score_data = {
@@ -381,12 +553,26 @@ class Command(BaseCommand):
         )
 
     def _update_faces(self, photo, faces_info):
-        """Update face information"""
-        # Clear existing faces
-        photo.faces.all().delete()
+        """Update face information.
+
+        Faces are matched to the stored ones by their uuid, or by their box
+        when the source has none, so embeddings and cluster assignments
+        survive a re-sync. A face whose box moved is embedded again.
+        """
+        def box_key(face):
+            return tuple(
+                round(value, 4) for value in (face.center_x, face.center_y, face.width, face.height)
+            )
+
+        def key(face):
+            return face.uuid or box_key(face)
+
+        existing = {key(face): face for face in photo.faces.all()}
+        changed, added = [], []
 
         for face_info in faces_info:
             face_data = {
+                'uuid': getattr(face_info, 'uuid', '') or '',
                 'center_x': face_info.center_x,
                 'center_y': face_info.center_y,
                 'width': face_info.width,
@@ -396,16 +582,39 @@ class Command(BaseCommand):
                 'ethnicity': getattr(face_info, 'ethnicity', '') or '',
                 'quality': getattr(face_info, 'quality', None),
                 'is_hidden': getattr(face_info, 'is_hidden', False),
+                'person': None,
             }
 
-            face = Face(photo=photo, **face_data)
-
             # Link to person if identified
             if hasattr(face_info, 'person_info') and face_info.person_info and face_info.person_info.name:
-                person, _ = Person.objects.get_or_create(
+                face_data['person'], _ = Person.objects.get_or_create(
                     name=face_info.person_info.name,
                     defaults={'uuid': getattr(face_info.person_info, 'uuid', None)}
                 )
-                face.person = person
 
-            face.save()
+            face = existing.pop(key(Face(**face_data)), None)
+            if face is None and face_data['uuid']:
+                # Faces stored before they had a uuid are found by their
+                # box, and get the uuid from here on
+                face = existing.pop(box_key(Face(**face_data)), None)
+            if face is None:
+                added.append(Face(photo=photo, **face_data))
+                continue
+
+            box = (face.center_x, face.center_y, face.width, face.height)
+            for field, value in face_data.items():
+                setattr(face, field, value)
+            if box != (face.center_x, face.center_y, face.width, face.height):
+                face.embedding = None
+                face.cluster = None
+            # Named faces leave the clusters of unknown faces
+            if face.person is not None:
+                face.cluster = None
+            changed.append(face)
+
+        if existing:
+            Face.objects.filter(pk__in=[face.pk for face in existing.values()]).delete()
+        if changed:
+            Face.objects.bulk_update(changed, [*FACE_SYNC_FIELDS, 'embedding', 'cluster'])
+        if added:
+            Face.objects.bulk_create(added)
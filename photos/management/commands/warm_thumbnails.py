@@ -0,0 +1,67 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from photos.models import Photo
+from photos.thumbnails import DEFAULT_SIZE, get_thumbnail, thumbnail_path
+
+
+class Command(BaseCommand):
+    help = 'Renders the thumbnails missing from the cache, so the photo grid never waits on them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--uuid',
+            action='append',
+            help='Only render the thumbnail of the photo with this uuid; repeat for several',
+        )
+        parser.add_argument(
+            '--size',
+            type=int,
+            default=DEFAULT_SIZE,
+            help='Thumbnail size in pixels',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Number of threads rendering thumbnails; decodes are still '
+                 'limited by THUMBNAIL_RENDER_CONCURRENCY',
+        )
+
+    def handle(self, *args, **options):
+        size = options['size']
+        queryset = Photo.objects.exclude(path='')
+        if options['uuid']:
+            queryset = queryset.filter(uuid__in=options['uuid'])
+
+        missing = [
+            (uuid, path)
+            for uuid, path in queryset.values_list('uuid', 'path').iterator()
+            if not os.path.exists(thumbnail_path(uuid, size))
+        ]
+        self.stdout.write(f'Rendering {len(missing)} thumbnails...')
+
+        rendered = 0
+        errors = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = [executor.submit(get_thumbnail, uuid, path, size) for uuid, path in missing]
+            for i, ((uuid, _), future) in enumerate(zip(missing, futures), 1):
+                try:
+                    if future.result() is None:
+                        errors += 1
+                    else:
+                        rendered += 1
+                except Exception as e:
+                    errors += 1
+                    self.stdout.write(self.style.ERROR(f'Error rendering thumbnail {uuid}: {str(e)}'))
+                if i % 100 == 0:
+                    self.stdout.write(f'Progress: {i}/{len(missing)}')
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'\nThumbnails completed!\n'
+                f'Rendered: {rendered}\n'
+                f'Errors: {errors}'
+            )
+        )
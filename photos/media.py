@@ -0,0 +1,96 @@
+import asyncio
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+
+from .thumbnails import scheduler
+
+
+# Blocking file and image work from async views runs here, so a burst of
+# slow disk reads or decodes cannot grow the number of threads unbounded
+_executor = ThreadPoolExecutor(
+    max_workers=settings.MEDIA_IO_THREADS, thread_name_prefix='media-io'
+)
+
+# Thumbnail renders get threads of their own, one per render slot, so
+# renders waiting for a slot never hold the threads serving full photos
+_render_executor = ThreadPoolExecutor(
+    max_workers=scheduler.max_concurrent, thread_name_prefix='thumbnail-render'
+)
+
+
+async def run_blocking(func, *args):
+    """Run func(*args) on the media thread pool and await its result"""
+    return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+
+async def run_render(func, *args):
+    """Run a thumbnail render on the render thread pool and await its result"""
+    return await asyncio.get_running_loop().run_in_executor(_render_executor, func, *args)
+
+
+def map_render(func, *iterables):
+    """Map func over iterables on the render thread pool, for sync callers"""
+    return _render_executor.map(func, *iterables)
+
+
+def is_asgi(request):
+    """Whether an ASGI server serves the request. Streaming responses must
+    match it: WSGI servers collect async iterators into memory before
+    sending them, and ASGI servers do the same with sync ones."""
+    return isinstance(request, ASGIRequest)
+
+
+def iter_file(path, chunk_size=None):
+    """Yield the contents of a file in chunks, for responses served by WSGI"""
+    chunk_size = chunk_size or settings.MEDIA_CHUNK_SIZE
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+async def aiter_file(path, chunk_size=None):
+    """Yield the contents of a file in chunks read on the media thread pool"""
+    chunk_size = chunk_size or settings.MEDIA_CHUNK_SIZE
+    f = await run_blocking(open, path, 'rb')
+    try:
+        while chunk := await run_blocking(f.read, chunk_size):
+            yield chunk
+    finally:
+        await run_blocking(f.close)
+
+
+def file_size(path):
+    """Return the size of a file, or None if it does not exist"""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+class StreamSink(io.RawIOBase):
+    """Unseekable write-only file that hands what was written so far to the
+    caller, so archives and exports can be streamed as they are written"""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self):
+        data = b''.join(self._parts)
+        self._parts.clear()
+        return data
@@ -0,0 +1,328 @@
+import fcntl
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metric:
+    """Base for labelled metrics kept in process memory"""
+
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+    def _format_labels(self, key, **extra):
+        pairs = list(zip(self.labels, key)) + list(extra.items())
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def empty(self):
+        """A metric like this one, without values"""
+        return type(self)(self.name, self.help, self.labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def _render_value(self, key, value):
+        return [f'{self.name}{self._format_labels(key)} {value}']
+
+    def dump(self):
+        with self._lock:
+            return [
+                {'labels': dict(zip(self.labels, key)), 'value': value}
+                for key, value in sorted(self.values.items())
+            ]
+
+    def load(self, dumped):
+        """Add dumped values to this counter's"""
+        for entry in dumped:
+            self.inc(entry['value'], **entry['labels'])
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def empty(self):
+        return type(self)(self.name, self.help, self.labels, self.buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['buckets'][i] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _render_value(self, key, state):
+        lines = [
+            f'{self.name}_bucket{self._format_labels(key, le=bound)} {count}'
+            for bound, count in zip(self.buckets, state['buckets'])
+        ]
+        lines.append(f'{self.name}_bucket{self._format_labels(key, le="+Inf")} {state["count"]}')
+        lines.append(f'{self.name}_sum{self._format_labels(key)} {state["sum"]}')
+        lines.append(f'{self.name}_count{self._format_labels(key)} {state["count"]}')
+        return lines
+
+    def dump(self):
+        """Return the histogram state in a JSON-serializable form"""
+        with self._lock:
+            return [
+                {'labels': dict(zip(self.labels, key)), **state}
+                for key, state in sorted(self.values.items())
+            ]
+
+    def load(self, dumped):
+        """Add dumped observations to this histogram's"""
+        with self._lock:
+            for entry in dumped:
+                state = self.values.setdefault(
+                    self._key(entry['labels']),
+                    {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0},
+                )
+                state['buckets'] = [a + b for a, b in zip(state['buckets'], entry['buckets'])]
+                state['sum'] += entry['sum']
+                state['count'] += entry['count']
+
+
+# Request metrics, recorded by photos.middleware.MetricsMiddleware
+request_duration = Histogram(
+    'photos_request_duration_seconds', 'Time spent handling requests', ['view', 'method'],
+)
+requests_total = Counter(
+    'photos_requests_total', 'Requests handled', ['view', 'method', 'status'],
+)
+request_queries = Histogram(
+    'photos_request_queries', 'Database queries per request', ['view'], buckets=QUERY_BUCKETS,
+)
+request_query_duration = Histogram(
+    'photos_request_query_duration_seconds', 'Database time per request', ['view'],
+)
+response_bytes = Counter(
+    'photos_response_bytes_total', 'Response body bytes served', ['view'],
+)
+
+REQUEST_METRICS = [request_duration, requests_total, request_queries, request_query_duration, response_bytes]
+
+
+# Request metrics are per process, and every web worker serves its share of
+# the requests, so each process writes its own to METRICS_DIR and render()
+# adds them up. Files of processes that exited are folded into one archive
+# file, so their counts are kept without the directory growing with every
+# recycled worker.
+_HOST = socket.gethostname()
+_flushed_at = 0
+
+
+def _write_json(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def flush(force=False):
+    """Write this process's request metrics to METRICS_DIR, at most every
+    METRICS_FLUSH_INTERVAL seconds unless forced"""
+    global _flushed_at
+    now = time.monotonic()
+    if not force and now - _flushed_at < settings.METRICS_FLUSH_INTERVAL:
+        return
+    _flushed_at = now
+    os.makedirs(str(settings.METRICS_DIR), exist_ok=True)
+    _write_json(
+        os.path.join(str(settings.METRICS_DIR), f'{_HOST}-{os.getpid()}.json'),
+        {metric.name: metric.dump() for metric in REQUEST_METRICS},
+    )
+
+
+def _exited(name):
+    """Whether the process that wrote a metrics file has exited. Only
+    processes of this host can be checked."""
+    host, _, pid = name[:-len('.json')].rpartition('-')
+    if host != _HOST or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def collect():
+    """Return REQUEST_METRICS summed over every process"""
+    flush(force=True)
+    root = str(settings.METRICS_DIR)
+    totals = {metric.name: metric.empty() for metric in REQUEST_METRICS}
+    archive = os.path.join(root, 'archive.json')
+
+    with open(os.path.join(root, '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        exited = [name for name in os.listdir(root) if name.endswith('.json') and _exited(name)]
+        if exited:
+            archived = {metric.name: metric.empty() for metric in REQUEST_METRICS}
+            for path in [archive] + [os.path.join(root, name) for name in exited]:
+                for name, dumped in _read_json(path).items():
+                    if name in archived:
+                        archived[name].load(dumped)
+            _write_json(archive, {name: metric.dump() for name, metric in archived.items()})
+            for name in exited:
+                os.unlink(os.path.join(root, name))
+
+        for name in os.listdir(root):
+            if name.endswith('.json'):
+                for metric_name, dumped in _read_json(os.path.join(root, name)).items():
+                    if metric_name in totals:
+                        totals[metric_name].load(dumped)
+    return list(totals.values())
+
+
+class SyncMetrics:
+    """Stage timings and counters for one sync run"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.stages = Histogram(
+            'photos_sync_stage_duration_seconds',
+            'Time spent in each stage of the last sync, per photo or batch',
+            ['stage'],
+            buckets=STAGE_BUCKETS,
+        )
+        self.counts = {}
+
+    def stage(self, name):
+        return self.stages.time(stage=name)
+
+    def count(self, name, amount=1):
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+    def summary(self):
+        stages = {
+            entry['labels']['stage']: {
+                'count': entry['count'],
+                'total_seconds': round(entry['sum'], 4),
+                'mean_ms': round(entry['sum'] / entry['count'] * 1000, 3) if entry['count'] else 0,
+            }
+            for entry in self.stages.dump()
+        }
+        return {
+            'started_at': self.started,
+            'duration_seconds': round(time.time() - self.started, 3),
+            'counts': self.counts,
+            'stages': stages,
+            'histogram': self.stages.dump(),
+        }
+
+    def save(self):
+        """Write the summary where the metrics endpoint picks it up"""
+        summary = self.summary()
+        os.makedirs(str(settings.LIBRARY_STATE_DIR), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=str(settings.LIBRARY_STATE_DIR), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(summary, f)
+        os.replace(tmp_path, last_sync_path())
+        return summary
+
+
+def last_sync_path():
+    return os.path.join(str(settings.LIBRARY_STATE_DIR), 'last_sync.json')
+
+
+def render_last_sync():
+    """Prometheus lines for the summary of the last sync run, if any"""
+    try:
+        with open(last_sync_path()) as f:
+            summary = json.load(f)
+    except (OSError, ValueError):
+        return []
+
+    stages = SyncMetrics().stages
+    stages.load(summary['histogram'])
+    lines = stages.render()
+    lines += [
+        '# HELP photos_sync_last_run_timestamp_seconds When the last sync started',
+        '# TYPE photos_sync_last_run_timestamp_seconds gauge',
+        f'photos_sync_last_run_timestamp_seconds {summary["started_at"]}',
+        '# HELP photos_sync_last_run_duration_seconds How long the last sync took',
+        '# TYPE photos_sync_last_run_duration_seconds gauge',
+        f'photos_sync_last_run_duration_seconds {summary["duration_seconds"]}',
+        '# HELP photos_sync_last_run_photos Photos handled by the last sync, by outcome',
+        '# TYPE photos_sync_last_run_photos gauge',
+    ]
+    lines += [
+        f'photos_sync_last_run_photos{{outcome="{outcome}"}} {count}'
+        for outcome, count in sorted(summary['counts'].items())
+    ]
+    return lines
+
+
+def render():
+    """Return all metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in collect():
+        lines.extend(metric.render())
+    lines.extend(render_last_sync())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,157 @@
+import hmac
+import os
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from . import metrics
+from .profiling import Profiler
+
+
+# Query totals of the request being handled. A context variable follows the
+# request into the threads async views run their ORM calls on.
+_query_stats = ContextVar('query_stats', default=None)
+
+
+def _record_query(execute, sql, params, many, context):
+    stats = _query_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats[0] += 1
+        stats[1] += time.perf_counter() - started
+
+
+def _install_wrapper(connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+class MetricsMiddleware:
+    """Records latency, query count and time, and bytes served per view"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+        connection_created.connect(_install_wrapper)
+        for connection in connections.all(initialized_only=True):
+            _install_wrapper(connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats, token, started = self._start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _query_stats.reset(token)
+        self._finish(request, response, stats, started)
+        return response
+
+    async def __acall__(self, request):
+        stats, token, started = self._start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _query_stats.reset(token)
+        self._finish(request, response, stats, started)
+        return response
+
+    def _start(self):
+        stats = [0, 0.0]
+        return stats, _query_stats.set(stats), time.perf_counter()
+
+    def _finish(self, request, response, stats, started):
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+
+        metrics.request_duration.observe(time.perf_counter() - started, view=view, method=request.method)
+        metrics.requests_total.inc(view=view, method=request.method, status=response.status_code)
+        metrics.request_queries.observe(stats[0], view=view)
+        metrics.request_query_duration.observe(stats[1], view=view)
+
+        if response.streaming:
+            # Streamed bodies rarely have a Content-Length; count the bytes
+            # as they go out instead
+            response.streaming_content = (
+                _acount(response.streaming_content, view) if response.is_async
+                else _count(response.streaming_content, view)
+            )
+        else:
+            metrics.response_bytes.inc(len(response.content), view=view)
+        metrics.flush()
+
+
+def _count(content, view):
+    size = 0
+    try:
+        for chunk in content:
+            size += len(chunk)
+            yield chunk
+    finally:
+        metrics.response_bytes.inc(size, view=view)
+
+
+async def _acount(content, view):
+    size = 0
+    try:
+        async for chunk in content:
+            size += len(chunk)
+            yield chunk
+    finally:
+        metrics.response_bytes.inc(size, view=view)
+
+
+class ProfileMiddleware:
+    """Profiles requests sent with an X-Profile header.
+
+    Only staff users, or requests whose header holds PROFILE_TOKEN, are
+    profiled. The middleware is dropped at startup unless PROFILING_ENABLED,
+    so it costs nothing when off. Async views are profiled through their
+    synchronous adapter, so their ORM calls show up in the SQL list but
+    not all of their frames in the call profile.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not self._requested(request):
+            return self.get_response(request)
+
+        with Profiler() as profiler:
+            response = self.get_response(request)
+
+        match = request.resolver_match
+        path = profiler.save(
+            match.view_name if match else 'unmatched',
+            title=f'{request.method} {request.get_full_path()}',
+        )
+        response['X-Profile'] = os.path.basename(path)
+        return response
+
+    def _requested(self, request):
+        header = request.headers.get('X-Profile')
+        if not header:
+            return False
+        if settings.PROFILE_TOKEN and hmac.compare_digest(
+            header.encode(), settings.PROFILE_TOKEN.encode()
+        ):
+            return True
+        user = getattr(request, 'user', None)
+        return bool(user and user.is_staff)
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 22:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='phash',
+            field=models.BigIntegerField(blank=True, db_index=True, null=True),
+        ),
+    ]
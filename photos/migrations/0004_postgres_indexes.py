@@ -0,0 +1,56 @@
+from django.db import migrations
+
+
+# Trigram indexes are built on UPPER(col::text) because that is the
+# expression Django generates for __icontains on PostgreSQL.
+TRIGRAM_INDEXES = [
+    ('photos_album_name_trgm', 'photos_album', 'name'),
+    ('photos_person_name_trgm', 'photos_person', 'name'),
+    ('photos_keyword_name_trgm', 'photos_keyword', 'name'),
+    ('photos_label_name_trgm', 'photos_label', 'name'),
+    ('photos_photo_title_trgm', 'photos_photo', 'title'),
+    ('photos_photo_filename_trgm', 'photos_photo', 'filename'),
+    ('photos_photo_description_trgm', 'photos_photo', 'description'),
+]
+
+INDEXES = [
+    # Photos are imported roughly in capture order, so a BRIN index on date
+    # is tiny and still prunes most of the table for date ranges.
+    'CREATE INDEX IF NOT EXISTS photos_photo_date_brin '
+    'ON photos_photo USING brin (date)',
+]
+
+INDEX_NAMES = [
+    'photos_photo_date_brin',
+]
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON {table} '
+            f'USING gin ((UPPER({column}::text)) gin_trgm_ops)'
+        )
+    for sql in INDEXES:
+        schema_editor.execute(sql)
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in [name for name, _, _ in TRIGRAM_INDEXES] + INDEX_NAMES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0003_face_clusters'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.3 on 2026-10-18 22:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0004_postgres_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='photo',
+            name='photos_phot_date_dc2af6_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='photo',
+            name='photos_phot_camera__362392_idx',
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(condition=models.Q(('favorite', True)), fields=['-date'], name='photo_favorite_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(condition=models.Q(('is_movie', True)), fields=['-date'], name='photo_movie_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(condition=models.Q(('is_screenshot', True)), fields=['-date'], name='photo_screenshot_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(condition=models.Q(('is_selfie', True)), fields=['-date'], name='photo_selfie_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(condition=models.Q(('is_portrait', True)), fields=['-date'], name='photo_portrait_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(condition=models.Q(('is_panorama', True)), fields=['-date'], name='photo_panorama_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(condition=models.Q(('live_photo', True)), fields=['-date'], name='photo_live_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(condition=models.Q(('is_burst', True)), fields=['-date'], name='photo_burst_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(condition=models.Q(('is_hdr', True)), fields=['-date'], name='photo_hdr_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(fields=['camera_make', 'camera_model', '-date'], name='photo_camera_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photoscore',
+            index=models.Index(fields=['-overall'], name='photoscore_overall_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.3 on 2026-10-18 22:20
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+# Frozen copy of photos.flags.FLAG_FIELDS at the time of this migration
+FLAG_FIELDS = [
+    'is_photo', 'is_movie', 'is_cloud_photo', 'has_adjustments', 'is_missing',
+    'place_is_home', 'live_photo', 'is_burst', 'is_hdr', 'is_portrait',
+    'is_screenshot', 'is_slow_mo', 'is_selfie', 'is_panorama', 'has_raw',
+    'favorite', 'hidden', 'in_trash', 'shared',
+]
+
+
+def backfill_flags(apps, schema_editor):
+    Photo = apps.get_model('photos', 'Photo')
+    for position, field in enumerate(FLAG_FIELDS):
+        Photo.objects.filter(**{field: True}).update(flags=F('flags').bitor(1 << position))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0005_list_view_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='flags',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_flags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.3 on 2026-10-18 22:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0006_photo_flags'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Event',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField(db_index=True)),
+                ('end', models.DateTimeField(db_index=True)),
+                ('place_name', models.CharField(blank=True, max_length=255)),
+                ('latitude', models.FloatField(blank=True, null=True)),
+                ('longitude', models.FloatField(blank=True, null=True)),
+                ('photo_count', models.IntegerField(default=0)),
+                ('video_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('cover', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='photos.photo')),
+            ],
+            options={
+                'ordering': ['-start'],
+            },
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='event',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='photos', to='photos.event'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 23:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0008_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='face',
+            name='uuid',
+            field=models.CharField(blank=True, db_index=True, max_length=100),
+        ),
+    ]
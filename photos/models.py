@@ -58,6 +58,7 @@ class Photo(models.Model):
     height = models.IntegerField(null=True, blank=True)
     width = models.IntegerField(null=True, blank=True)
     duration = models.FloatField(null=True, blank=True)  # For videos
+    phash = models.BigIntegerField(null=True, blank=True, db_index=True)  # 64-bit dHash, stored signed
     
     # EXIF data
     camera_make = models.CharField(max_length=100, blank=True)
@@ -78,6 +79,12 @@ class Photo(models.Model):
     in_trash = models.BooleanField(default=False)
     shared = models.BooleanField(default=False)
     
+    # All of the boolean flags above packed into one bitmask (see photos.flags)
+    flags = models.IntegerField(default=0)
+    
+    # Group of photos taken close together in time and place (see photos.events)
+    event = models.ForeignKey('Event', on_delete=models.SET_NULL, null=True, blank=True, related_name='photos')
+    
     # File size
     original_file_size = models.BigIntegerField(null=True, blank=True)
     
@@ -87,9 +94,20 @@ class Photo(models.Model):
     
     class Meta:
         ordering = ['-date']
+        # List pages are ordered by -date. Each flag filter gets a partial
+        # date index holding only the flagged photos, so a checkbox filter
+        # reads its page (and count) straight from a small index.
         indexes = [
-            models.Index(fields=['date', 'favorite']),
-            models.Index(fields=['camera_make', 'camera_model']),
+            models.Index(fields=['-date'], condition=models.Q(favorite=True), name='photo_favorite_date_idx'),
+            models.Index(fields=['-date'], condition=models.Q(is_movie=True), name='photo_movie_date_idx'),
+            models.Index(fields=['-date'], condition=models.Q(is_screenshot=True), name='photo_screenshot_date_idx'),
+            models.Index(fields=['-date'], condition=models.Q(is_selfie=True), name='photo_selfie_date_idx'),
+            models.Index(fields=['-date'], condition=models.Q(is_portrait=True), name='photo_portrait_date_idx'),
+            models.Index(fields=['-date'], condition=models.Q(is_panorama=True), name='photo_panorama_date_idx'),
+            models.Index(fields=['-date'], condition=models.Q(live_photo=True), name='photo_live_date_idx'),
+            models.Index(fields=['-date'], condition=models.Q(is_burst=True), name='photo_burst_date_idx'),
+            models.Index(fields=['-date'], condition=models.Q(is_hdr=True), name='photo_hdr_date_idx'),
+            models.Index(fields=['camera_make', 'camera_model', '-date'], name='photo_camera_date_idx'),
             models.Index(fields=['latitude', 'longitude']),
         ]
     
@@ -97,6 +115,27 @@ class Photo(models.Model):
         return f"{self.filename or self.original_filename} ({self.uuid})"
 
 
+class Event(models.Model):
+    """Model to store groups of photos taken close together in time and place"""
+    start = models.DateTimeField(db_index=True)
+    end = models.DateTimeField(db_index=True)
+    place_name = models.CharField(max_length=255, blank=True)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    
+    cover = models.ForeignKey(Photo, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    photo_count = models.IntegerField(default=0)
+    video_count = models.IntegerField(default=0)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-start']
+    
+    def __str__(self):
+        return f"{self.place_name or 'Event'} ({self.start:%Y-%m-%d}, {self.photo_count} photos)"
+
+
 class Album(models.Model):
     """Model to store album information"""
     name = models.CharField(max_length=255, db_index=True)
@@ -187,14 +226,33 @@ class PhotoScore(models.Model):
     curation_time = models.FloatField(null=True, blank=True)
     curation_version = models.FloatField(null=True, blank=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['-overall'], name='photoscore_overall_idx'),
+        ]
+    
     def __str__(self):
         return f"Scores for {self.photo.uuid}"
 
 
+class FaceCluster(models.Model):
+    """Model to store groups of similar unnamed faces"""
+    centroid = models.BinaryField()  # float32 unit vector
+    size = models.IntegerField(default=0, db_index=True)  # Unnamed member faces
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Face cluster {self.pk} ({self.size} faces)"
+
+
 class Face(models.Model):
     """Model to store face detection information"""
     photo = models.ForeignKey(Photo, on_delete=models.CASCADE, related_name='faces')
     person = models.ForeignKey(Person, on_delete=models.SET_NULL, null=True, blank=True, related_name='faces')
+    cluster = models.ForeignKey(FaceCluster, on_delete=models.SET_NULL, null=True, blank=True, related_name='faces')
+    uuid = models.CharField(max_length=100, blank=True, db_index=True)  # Photos' face uuid, kept across syncs
     
     # Face coordinates (normalized 0-1)
     center_x = models.FloatField(validators=[MinValueValidator(0), MaxValueValidator(1)])
@@ -209,5 +267,49 @@ class Face(models.Model):
     quality = models.FloatField(null=True, blank=True)
     is_hidden = models.BooleanField(default=False)
     
+    # Appearance embedding (float32 unit vector) used for clustering
+    embedding = models.BinaryField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"Face in {self.photo.uuid} - {self.person.name if self.person else 'Unknown'}"
+
+
+class Job(models.Model):
+    """Model to store management commands queued for the `run_jobs` workers"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    
+    command = models.CharField(max_length=100)
+    options = models.JSONField(default=dict, blank=True)
+    priority = models.IntegerField(default=0)  # Higher runs first
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.IntegerField(default=0)
+    
+    # Progress, parsed from the command's "Progress: done/total" lines
+    progress = models.IntegerField(default=0)
+    total = models.IntegerField(null=True, blank=True)
+    message = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    
+    worker = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', '-priority', 'created_at'], name='job_queue_idx'),
+        ]
+    
     def __str__(self):
-        return f"Face in {self.photo.uuid} - {self.person.name if self.person else 'Unknown'}"
\ No newline at end of file
+        return f"{self.command} ({self.status})"
@@ -0,0 +1,90 @@
+import base64
+import json
+
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+
+
+# Sorts paged by keyset: the cursor holds the last row's date and id, so
+# every page is an index range scan no matter how deep it is
+KEYSET_SORTS = {'-date': True, 'date': False}
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(position):
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        raise InvalidCursor(cursor)
+
+
+def paginate(queryset, params, fields, limit):
+    """Return (rows, next_cursor) for one page of a filtered photo queryset.
+
+    rows are value tuples for fields. Date sorts page by keyset; any other
+    ordering falls back to an offset stored in the cursor.
+    """
+    sort = params.get('sort', '-date')
+    keyset = sort in KEYSET_SORTS and not params.get('semantic')
+    position = decode_cursor(params['cursor']) if params.get('cursor') else None
+
+    columns = list(dict.fromkeys([*fields, 'id', 'date']))
+    if keyset:
+        descending = KEYSET_SORTS[sort]
+        # Ties on date are broken by ascending id either way, which is the
+        # order SQLite keeps rowids in within each date index entry
+        queryset = queryset.order_by(
+            F('date').desc(nulls_last=True) if descending else F('date').asc(nulls_last=True),
+            'id',
+        )
+        if position:
+            queryset = queryset.filter(_after(position, descending))
+        page = list(queryset.values_list(*columns)[:limit + 1])
+    else:
+        try:
+            offset = int(position['offset']) if position else 0
+        except (KeyError, TypeError, ValueError):
+            raise InvalidCursor(position)
+        # Rows that tie on a non-unique sort must come back in the same order
+        # on every request, or pages would repeat and skip them
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        if not {'id', 'pk', '-id', '-pk'} & {item for item in ordering if isinstance(item, str)}:
+            queryset = queryset.order_by(*ordering, 'id')
+        page = list(queryset.values_list(*columns)[offset:offset + limit + 1])
+
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        last = dict(zip(columns, page[-1]))
+        if keyset:
+            date = last['date'].isoformat() if last['date'] else None
+            next_cursor = encode_cursor({'date': date, 'id': last['id']})
+        else:
+            next_cursor = encode_cursor({'offset': offset + limit})
+
+    return [row[:len(fields)] for row in page], next_cursor
+
+
+def _after(position, descending):
+    """Rows after the cursor position, with undated photos last"""
+    try:
+        pk = int(position['id'])
+        date = parse_datetime(position['date']) if position['date'] else None
+    except (KeyError, TypeError, ValueError):
+        raise InvalidCursor(position)
+
+    later = 'lt' if descending else 'gt'
+    if date is None:
+        return Q(date__isnull=True, id__gt=pk)
+    return (
+        Q(**{f'date__{later}': date})
+        | Q(date=date, id__gt=pk)
+        | Q(date__isnull=True)
+    )
@@ -0,0 +1,108 @@
+import cProfile
+import io
+import os
+import pstats
+import re
+import time
+from contextvars import ContextVar
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+# SQL statements of the profile being captured, as [sql, seconds] pairs
+_captured_queries = ContextVar('captured_queries', default=None)
+
+
+def _capture_query(execute, sql, params, many, context):
+    queries = _captured_queries.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        queries.append((sql, time.perf_counter() - started))
+
+
+def _install_wrapper(connection, **kwargs):
+    if _capture_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_capture_query)
+
+
+class Profiler:
+    """Captures a cProfile run and the SQL it executed.
+
+    Use as a context manager around the code to profile, then save() the
+    report into PROFILE_DIR.
+    """
+
+    def __init__(self):
+        connection_created.connect(_install_wrapper)
+        for connection in connections.all(initialized_only=True):
+            _install_wrapper(connection)
+        self.profile = cProfile.Profile()
+        self.queries = []
+        self.duration = 0
+
+    def __enter__(self):
+        self._token = _captured_queries.set(self.queries)
+        self._started = time.perf_counter()
+        self.profile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profile.disable()
+        self.duration = time.perf_counter() - self._started
+        _captured_queries.reset(self._token)
+
+    def report(self, title):
+        """Return a text report: top functions and the slowest queries"""
+        output = io.StringIO()
+        output.write(f'{title}\n')
+        output.write(
+            f'{self.duration * 1000:.1f} ms, {len(self.queries)} queries, '
+            f'{sum(seconds for _, seconds in self.queries) * 1000:.1f} ms in SQL\n\n'
+        )
+
+        output.write(f'Slowest {settings.PROFILE_TOP_QUERIES} queries\n')
+        slowest = sorted(self.queries, key=lambda query: -query[1])
+        for sql, seconds in slowest[:settings.PROFILE_TOP_QUERIES]:
+            if len(sql) > 300:
+                sql = sql[:300] + '...'
+            output.write(f'{seconds * 1000:9.2f} ms  {sql}\n')
+
+        output.write('\n')
+        stats = pstats.Stats(self.profile, stream=output)
+        stats.sort_stats('cumulative').print_stats(settings.PROFILE_TOP_FUNCTIONS)
+        return output.getvalue()
+
+    def save(self, label, title=None):
+        """Write <timestamp>-<label>.prof and .txt into PROFILE_DIR and
+        return the base path. Only the newest PROFILE_KEEP profiles are kept."""
+        directory = str(settings.PROFILE_DIR)
+        os.makedirs(directory, exist_ok=True)
+        label = re.sub(r'[^A-Za-z0-9_.-]+', '_', label).strip('_')[:80] or 'profile'
+        base = os.path.join(directory, f'{datetime.now():%Y%m%d-%H%M%S-%f}-{label}')
+
+        self.profile.dump_stats(f'{base}.prof')
+        with open(f'{base}.txt', 'w') as f:
+            f.write(self.report(title or label))
+
+        _rotate(directory)
+        return base
+
+
+def _rotate(directory):
+    profiles = sorted(
+        (entry for entry in os.scandir(directory) if entry.name.endswith('.prof')),
+        key=lambda entry: entry.stat().st_mtime,
+    )
+    for entry in profiles[:-settings.PROFILE_KEEP]:
+        for path in (entry.path, entry.path[:-len('.prof')] + '.txt'):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,134 @@
+import threading
+import time
+
+from django.conf import settings
+
+from .generation import current_generation
+from .snapshot import NO_DATE, SCORE_FIELDS, LibrarySnapshot, build_columns, get_snapshot
+
+
+GROUPINGS = {'month', 'year', 'person'}
+
+
+def parse_weights(text):
+    """Parse 'aesthetics:1,utility_blurry:-1' into {field: weight}"""
+    weights = {}
+    for part in filter(None, text.split(',')):
+        field, _, weight = part.partition(':')
+        field = field.strip()
+        if field not in SCORE_FIELDS:
+            raise ValueError(f'Unknown score: {field}')
+        weights[field] = float(weight) if weight else 1.0
+    if not weights:
+        raise ValueError('No weights given')
+    return weights
+
+
+def combined_scores(library, weights):
+    """Return the weighted sum of score columns for every row.
+
+    Photos without scores get -inf so they never rank.
+    """
+    import numpy as np
+
+    fields = library.meta['score_fields']
+    columns = [fields.index(field) for field in weights]
+    combined = library.scores[:, columns].astype(np.float64) @ np.array(list(weights.values()))
+    combined[np.isnan(combined)] = -np.inf
+    return combined
+
+
+def top_rows(rows, values, n):
+    """Return the n rows with the highest values, best first"""
+    import numpy as np
+
+    rows = rows[np.isfinite(values[rows])]
+    if len(rows) > n:
+        rows = rows[np.argpartition(-values[rows], n - 1)[:n]]
+    return rows[np.argsort(-values[rows], kind='stable')]
+
+
+def top_rows_per_group(keys, rows, values, n):
+    """Return {key: best rows} keeping the n highest values of each key"""
+    import numpy as np
+
+    rows = rows[np.isfinite(values[rows])]
+    order = np.lexsort((-values[rows], keys[rows]))
+    rows = rows[order]
+    group_keys, starts = np.unique(keys[rows], return_index=True)
+    bounds = np.append(starts, len(rows))
+    return {
+        key: rows[bounds[i]:min(bounds[i] + n, bounds[i + 1])]
+        for i, key in enumerate(group_keys.tolist())
+    }
+
+
+def rank(library, weights, n=10, per=None, year=None):
+    """Rank photos by a weighted combination of scores.
+
+    Returns a list of (group, rows, values) with group None unless per is
+    'month', 'year' or 'person'.
+    """
+    import numpy as np
+
+    values = combined_scores(library, weights)
+    rows = np.arange(len(library))
+
+    dates = np.asarray(library.dates)
+    if year is not None or per in ('month', 'year'):
+        rows = rows[dates[rows] != NO_DATE]
+        days = dates.astype('datetime64[s]')
+    if year is not None:
+        rows = rows[days[rows].astype('datetime64[Y]').astype(int) + 1970 == year]
+
+    if per is None:
+        return [(None, top_rows(rows, values, n), values)]
+
+    if per == 'person':
+        eligible = np.zeros(len(library), dtype=bool)
+        eligible[rows] = True
+        groups = []
+        for tag_id, name in library.meta['facets']['person']:
+            person_rows = np.asarray(library.facet_rows('person', tag_id))
+            best = top_rows(person_rows[eligible[person_rows]], values, n)
+            if len(best):
+                groups.append(({'id': tag_id, 'name': name}, best, values))
+        return groups
+
+    unit = 'datetime64[M]' if per == 'month' else 'datetime64[Y]'
+    keys = np.zeros(len(library), dtype=np.int64)
+    keys[rows] = days[rows].astype(unit).astype(np.int64)
+    return [
+        (str(np.datetime64(key, unit[-2])), best, values)
+        for key, best in top_rows_per_group(keys, rows, values, n).items()
+    ]
+
+
+_library = None
+_lock = threading.Lock()
+
+
+def get_library():
+    """Return the columns to rank from.
+
+    The shared snapshot is used when there is one; otherwise the columns are
+    read from the database and cached in this process until the generation
+    changes or RANKING_CACHE_TTL passes.
+    """
+    global _library
+    snapshot = get_snapshot()
+    if snapshot:
+        return snapshot
+
+    generation = current_generation()
+    library = _library
+    if (
+        library is None
+        or library[0].generation != generation
+        or time.monotonic() - library[1] > settings.RANKING_CACHE_TTL
+    ):
+        with _lock:
+            if _library is library:
+                _library = (LibrarySnapshot(*build_columns(generation)), time.monotonic())
+            library = _library
+    return library[0]
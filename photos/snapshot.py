@@ -0,0 +1,245 @@
+import json
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+
+from .flags import FLAG_BITS
+from .generation import current_generation
+from .models import Photo, PhotoScore, Album, Person, Keyword, Label, Face
+
+
+SCORE_FIELDS = [
+    field.name for field in PhotoScore._meta.get_fields()
+    if field.get_internal_type() == 'FloatField'
+]
+
+FACETS = {
+    'album': Album,
+    'person': Person,
+    'keyword': Keyword,
+    'label': Label,
+}
+
+# Stored in place of a missing date: the smallest int64
+NO_DATE = -(1 << 63)
+
+
+def snapshot_dir(generation):
+    return os.path.join(str(settings.LIBRARY_STATE_DIR), 'snapshots', str(generation))
+
+
+def build_columns(generation):
+    """Read the library into numpy columns and a JSON-serializable meta dict.
+
+    Rows are photos ordered by id. Tag membership is stored per facet as CSR
+    arrays: the rows of the i-th tag are rows[indptr[i]:indptr[i + 1]].
+    """
+    import numpy as np
+
+    photos = list(Photo.objects.order_by('id').values_list(
+        'id', 'date', 'flags', 'camera_make', 'camera_model', 'latitude', 'longitude',
+    ))
+    count = len(photos)
+
+    camera_ids = {}
+    columns = {
+        'ids': np.array([row[0] for row in photos], dtype=np.int64),
+        'dates': np.array(
+            [int(row[1].timestamp()) if row[1] else NO_DATE for row in photos], dtype=np.int64
+        ),
+        'flags': np.array([row[2] for row in photos], dtype=np.int32),
+        'cameras': np.array(
+            [camera_ids.setdefault((row[3], row[4]), len(camera_ids)) for row in photos],
+            dtype=np.int32,
+        ),
+        'latitude': np.array([row[5] for row in photos], dtype=np.float64),
+        'longitude': np.array([row[6] for row in photos], dtype=np.float64),
+    }
+    ids = columns['ids']
+    row_of = np.full(int(ids.max()) + 1 if count else 1, -1, dtype=np.int64)
+    row_of[ids] = np.arange(count)
+
+    face_photos = np.fromiter(Face.objects.values_list('photo_id', flat=True), dtype=np.int64)
+    columns['face_counts'] = np.bincount(row_of[face_photos], minlength=count).astype(np.int32)
+
+    scores = np.full((count, len(SCORE_FIELDS)), np.nan, dtype=np.float32)
+    score_rows = np.array(
+        PhotoScore.objects.values_list('photo_id', *SCORE_FIELDS), dtype=np.float64
+    ).reshape(-1, len(SCORE_FIELDS) + 1)
+    scores[row_of[score_rows[:, 0].astype(np.int64)]] = score_rows[:, 1:]
+    columns['scores'] = scores
+
+    meta = {
+        'generation': generation,
+        'count': count,
+        'cameras': [list(camera) for camera in camera_ids],
+        'score_fields': SCORE_FIELDS,
+        'facets': {},
+    }
+    for facet, model in FACETS.items():
+        tags = list(model.objects.order_by('id').values_list('id', 'name'))
+        tag_ids = np.array([tag_id for tag_id, _ in tags], dtype=np.int64)
+        links = np.array(
+            model.photos.through.objects.values_list(f'{facet}_id', 'photo_id'), dtype=np.int64
+        ).reshape(-1, 2)
+        order = np.argsort(links[:, 0], kind='stable')
+        tag_rows = np.searchsorted(tag_ids, links[order, 0])
+        columns[f'{facet}_indptr'] = np.append(
+            0, np.cumsum(np.bincount(tag_rows, minlength=len(tags)))
+        ).astype(np.int64)
+        columns[f'{facet}_rows'] = row_of[links[order, 1]]
+        meta['facets'][facet] = tags
+
+    return columns, meta
+
+
+def write_snapshot(generation):
+    """Write the columnar snapshot for a library generation"""
+    import numpy as np
+
+    columns, meta = build_columns(generation)
+
+    # Build next to the final location and rename, so readers never map a
+    # half-written snapshot
+    root = os.path.dirname(snapshot_dir(generation))
+    os.makedirs(root, exist_ok=True)
+    building = tempfile.mkdtemp(dir=root, prefix='.building-')
+    for name, array in columns.items():
+        np.save(os.path.join(building, f'{name}.npy'), array)
+    with open(os.path.join(building, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    target = snapshot_dir(generation)
+    shutil.rmtree(target, ignore_errors=True)
+    os.rename(building, target)
+    _prune(root, generation)
+    return target
+
+
+def _prune(root, generation):
+    """Remove snapshots older than the previous generation.
+
+    Workers that still map an older snapshot keep reading it until they
+    notice the new generation; unlinked files stay valid while mapped.
+    """
+    for name in os.listdir(root):
+        if name.isdigit() and int(name) < generation - 1:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+
+class LibrarySnapshot:
+    """Columnar view of the library, usually memory-mapped by load()"""
+
+    def __init__(self, columns, meta):
+        self.columns = columns
+        self.meta = meta
+        self.generation = meta['generation']
+
+    @classmethod
+    def load(cls, path):
+        """Map a snapshot written by write_snapshot()"""
+        import numpy as np
+
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        columns = {
+            name[:-4]: np.load(os.path.join(path, name), mmap_mode='r')
+            for name in os.listdir(path) if name.endswith('.npy')
+        }
+        return cls(columns, meta)
+
+    def __getattr__(self, name):
+        try:
+            return self.columns[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __len__(self):
+        return self.meta['count']
+
+    def flag_count(self, field):
+        import numpy as np
+
+        return int(np.count_nonzero(self.flags & FLAG_BITS[field]))
+
+    def score(self, field):
+        return self.scores[:, self.meta['score_fields'].index(field)]
+
+    def facet_counts(self, facet):
+        """Return {'id', 'name', 'photo_count'} for every tag of a facet, by name"""
+        import numpy as np
+
+        counts = np.diff(self.columns[f'{facet}_indptr'])
+        tags = [
+            {'id': tag_id, 'name': name, 'photo_count': int(count)}
+            for (tag_id, name), count in zip(self.meta['facets'][facet], counts)
+        ]
+        return sorted(tags, key=lambda tag: tag['name'])
+
+    def facet_rows(self, facet, tag_id):
+        """Return the rows of the photos with a tag"""
+        import numpy as np
+
+        tags = self.meta['facets'][facet]
+        index = np.searchsorted([tag[0] for tag in tags], tag_id)
+        if index == len(tags) or tags[index][0] != tag_id:
+            return np.empty(0, dtype=np.int64)
+        indptr = self.columns[f'{facet}_indptr']
+        return self.columns[f'{facet}_rows'][indptr[index]:indptr[index + 1]]
+
+    def top_facets(self, facet, n=10):
+        return sorted(self.facet_counts(facet), key=lambda tag: -tag['photo_count'])[:n]
+
+    def top_cameras(self, n=10):
+        import numpy as np
+
+        counts = np.bincount(self.cameras, minlength=len(self.meta['cameras']))
+        cameras = [
+            {'camera_make': make, 'camera_model': model, 'count': int(count)}
+            for (make, model), count in zip(self.meta['cameras'], counts)
+            if model and count
+        ]
+        return sorted(cameras, key=lambda camera: -camera['count'])[:n]
+
+    def stats(self):
+        """Library statistics, matching what stats_view computes through the ORM"""
+        import numpy as np
+
+        located = ~(np.isnan(self.latitude) & np.isnan(self.longitude))
+        return {
+            'total_photos': self.flag_count('is_photo'),
+            'total_videos': self.flag_count('is_movie'),
+            'total_favorites': self.flag_count('favorite'),
+            'total_persons': len(self.meta['facets']['person']),
+            'total_albums': len(self.meta['facets']['album']),
+            'total_keywords': len(self.meta['facets']['keyword']),
+            'total_labels': len(self.meta['facets']['label']),
+            'photos_with_location': int(np.count_nonzero(located)),
+            'photos_with_faces': int(np.count_nonzero(self.face_counts)),
+            'top_cameras': self.top_cameras(),
+            'top_persons': self.top_facets('person'),
+            'top_keywords': self.top_facets('keyword'),
+        }
+
+
+_snapshot = None
+
+
+def get_snapshot():
+    """Return the snapshot of the current generation, or None if there isn't one.
+
+    Each process maps the files once per generation; the pages themselves are
+    shared through the OS page cache.
+    """
+    global _snapshot
+    if not settings.PHOTO_SNAPSHOT:
+        return None
+    generation = current_generation()
+    if _snapshot is None or _snapshot.generation != generation:
+        path = snapshot_dir(generation)
+        if not os.path.exists(os.path.join(path, 'meta.json')):
+            return None
+        _snapshot = LibrarySnapshot.load(path)
+    return _snapshot
@@ -0,0 +1,53 @@
+import io
+import math
+
+from . import media
+from .thumbnails import cached_thumbnail, get_thumbnail, open_image
+
+
+def _render_tile(uuid, path):
+    from PIL import Image
+
+    try:
+        return get_thumbnail(uuid, path)
+    except (OSError, Image.DecompressionBombError):
+        return None
+
+
+def build_sprite(photos, tile_size, columns):
+    """Pack the thumbnails of photos into one JPEG grid.
+
+    photos is a sequence of (id, uuid, path). Returns the tile manifest, a
+    list of {'id', 'x', 'y', 'w', 'h'} in photo order, and the JPEG bytes.
+    Photos without a thumbnail are left out of the manifest and their cell
+    stays blank.
+    """
+    from PIL import Image, ImageOps
+
+    columns = max(1, min(columns, len(photos)))
+    rows = math.ceil(len(photos) / columns)
+    sheet = Image.new('RGB', (columns * tile_size, max(rows, 1) * tile_size), 'white')
+
+    # Missing thumbnails render in parallel on the render thread pool
+    thumb_paths = [cached_thumbnail(uuid) for _, uuid, _ in photos]
+    missing = [index for index, thumb_path in enumerate(thumb_paths) if thumb_path is None]
+    rendered = media.map_render(
+        _render_tile, [photos[index][1] for index in missing], [photos[index][2] for index in missing],
+    )
+    for index, thumb_path in zip(missing, rendered):
+        thumb_paths[index] = thumb_path
+
+    tiles = []
+    for index, ((pk, uuid, path), thumb_path) in enumerate(zip(photos, thumb_paths)):
+        if thumb_path is None:
+            continue
+
+        x, y = index % columns * tile_size, index // columns * tile_size
+        with open_image(thumb_path) as thumb:
+            # Square tiles cropped to the centre, like the grid's object-cover
+            sheet.paste(ImageOps.fit(thumb.convert('RGB'), (tile_size, tile_size)), (x, y))
+        tiles.append({'id': pk, 'x': x, 'y': y, 'w': tile_size, 'h': tile_size})
+
+    output = io.BytesIO()
+    sheet.save(output, 'JPEG', quality=80, optimize=True)
+    return tiles, output.getvalue()
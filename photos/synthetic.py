@@ -0,0 +1,286 @@
+import os
+import random
+import uuid as uuid_lib
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from django.db import transaction
+from PIL import Image
+
+from .flags import compute_flags
+from .models import Photo, Album, Person, Keyword, Label, PhotoScore, Face
+
+
+SYNTHETIC_PREFIX = 'synthetic-'
+
+CAMERAS = [
+    ('Apple', 'iPhone 15 Pro'),
+    ('Apple', 'iPhone 12'),
+    ('Apple', 'iPhone 8'),
+    ('Canon', 'EOS R6'),
+    ('FUJIFILM', 'X-T4'),
+    ('SONY', 'ILCE-7M3'),
+    ('', ''),
+]
+
+PLACES = [
+    ('Lisbon', 'PT', 38.72, -9.14),
+    ('Porto', 'PT', 41.15, -8.61),
+    ('Paris', 'FR', 48.86, 2.35),
+    ('London', 'GB', 51.51, -0.13),
+    ('New York', 'US', 40.71, -74.01),
+    ('Tokyo', 'JP', 35.68, 139.69),
+]
+
+# (field, probability) for the boolean flags filtered by PhotoListView
+FLAG_RATES = [
+    ('favorite', 0.05),
+    ('is_screenshot', 0.04),
+    ('is_selfie', 0.06),
+    ('is_portrait', 0.08),
+    ('is_panorama', 0.01),
+    ('live_photo', 0.30),
+    ('is_burst', 0.03),
+    ('is_hdr', 0.15),
+    ('hidden', 0.01),
+]
+
+# osxphotos PhotoInfo attribute of each flag above, for photo_infos()
+PHOTOINFO_FLAGS = {
+    'favorite': 'favorite',
+    'is_screenshot': 'isscreenshot',
+    'is_selfie': 'isselfie',
+    'is_portrait': 'isportrait',
+    'is_panorama': 'ispanorama',
+    'live_photo': 'live_photo',
+    'is_burst': 'isburst',
+    'is_hdr': 'ishdr',
+    'hidden': 'hidden',
+}
+
+SCORE_FIELDS = [
+    field.name for field in PhotoScore._meta.get_fields()
+    if field.get_internal_type() == 'FloatField'
+]
+
+IMAGE_SIZE = (2048, 1536)
+
+# Share of photos with a face nobody has named yet
+UNNAMED_FACE_RATE = 0.2
+
+
+def _date_range(start):
+    start = start or datetime(2010, 1, 1, tzinfo=timezone.utc)
+    return start, (datetime(2025, 1, 1, tzinfo=timezone.utc) - start).total_seconds()
+
+
+def _draw_photo(rng, start, span):
+    """Return an unsaved Photo with random metadata"""
+    photo_uuid = f'{SYNTHETIC_PREFIX}{uuid_lib.UUID(int=rng.getrandbits(128))}'
+    make, model = rng.choice(CAMERAS)
+    is_movie = rng.random() < 0.08
+    date = start + timedelta(seconds=rng.random() * span)
+    photo = Photo(
+        uuid=photo_uuid,
+        original_filename=f'IMG_{rng.randrange(10000):04d}.JPG',
+        filename=f'{photo_uuid}.jpeg',
+        is_photo=not is_movie,
+        is_movie=is_movie,
+        date=date,
+        date_modified=date,
+        date_added=date,
+        title=f'Photo {rng.randrange(100000)}' if rng.random() < 0.1 else '',
+        camera_make=make,
+        camera_model=model,
+        width=4032,
+        height=3024,
+        duration=rng.uniform(1, 120) if is_movie else None,
+        original_file_size=rng.randrange(500_000, 8_000_000),
+    )
+    for field, rate in FLAG_RATES:
+        setattr(photo, field, rng.random() < rate)
+    if rng.random() < 0.6:
+        name, country, lat, lon = rng.choice(PLACES)
+        photo.latitude = round(lat + rng.gauss(0, 0.05), 6)
+        photo.longitude = round(lon + rng.gauss(0, 0.05), 6)
+        photo.place_name = name
+        photo.place_country_code = country
+    photo.flags = compute_flags(photo)
+    return photo
+
+
+def _draw_tags(rng, amount):
+    """Pick up to 5 tag indexes; squaring the draw makes low indexes much
+    more popular"""
+    return {int(rng.random() ** 2 * amount) for _ in range(min(int(rng.expovariate(1.0)), 5))}
+
+
+def _draw_face(rng):
+    return {
+        'center_x': rng.uniform(0.2, 0.8),
+        'center_y': rng.uniform(0.2, 0.8),
+        'width': rng.uniform(0.05, 0.2),
+        'height': rng.uniform(0.05, 0.2),
+        'quality': rng.random(),
+    }
+
+
+def write_image(path, rng, size=IMAGE_SIZE):
+    """Write a JPEG of smooth random colour blobs, which decodes and
+    compresses roughly like a photo"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    seed = Image.frombytes('RGB', (8, 6), rng.randbytes(8 * 6 * 3))
+    seed.resize(size, Image.Resampling.BICUBIC).save(path, 'JPEG', quality=90)
+
+
+def generate_library(count, seed=0, albums=200, persons=300, keywords=500,
+                     labels=800, batch_size=5000, start=None, images=0,
+                     image_dir=None, stdout=None):
+    """Insert a synthetic library of count photos with relations, faces and scores.
+
+    All generated uuids start with SYNTHETIC_PREFIX so they can be removed
+    again with delete_library(). Distributions are skewed the way real
+    libraries are: a few albums, people and labels cover most photos. The
+    first images photos get a JPEG written to image_dir as their file.
+    """
+    rng = random.Random(seed)
+    start, span = _date_range(start)
+
+    tag_models = [
+        (Album, albums, 'album', 'albums'),
+        (Person, persons, 'person', 'persons'),
+        (Keyword, keywords, 'keyword', 'keywords'),
+        (Label, labels, 'label', 'labels'),
+    ]
+    tag_ids = {}
+    for model, amount, prefix, _ in tag_models:
+        existing = model.objects.filter(name__startswith=SYNTHETIC_PREFIX).count()
+        model.objects.bulk_create([
+            model(name=f'{SYNTHETIC_PREFIX}{prefix}-{i}')
+            for i in range(existing, amount)
+        ])
+        tag_ids[model] = list(
+            model.objects.filter(name__startswith=SYNTHETIC_PREFIX).values_list('id', flat=True)
+        )
+
+    created = 0
+    while created < count:
+        size = min(batch_size, count - created)
+        photos = []
+        for i in range(size):
+            photo = _draw_photo(rng, start, span)
+            if created + i < images and photo.is_photo:
+                photo.path = os.path.join(str(image_dir), f'{photo.uuid}.jpg')
+                write_image(photo.path, rng)
+            photos.append(photo)
+
+        with transaction.atomic():
+            photos = Photo.objects.bulk_create(photos)
+            PhotoScore.objects.bulk_create([
+                PhotoScore(photo=photo, **{field: rng.random() for field in SCORE_FIELDS})
+                for photo in photos
+            ])
+            faces = []
+            for model, _, prefix, related_name in tag_models:
+                through = getattr(Photo, related_name).through
+                ids = tag_ids[model]
+                links = [
+                    (photo.pk, ids[index])
+                    for photo in photos for index in _draw_tags(rng, len(ids))
+                ]
+                through.objects.bulk_create([
+                    through(**{'photo_id': photo_id, f'{prefix}_id': tag_id})
+                    for photo_id, tag_id in links
+                ])
+                if model is Person:
+                    faces.extend(
+                        Face(photo_id=photo_id, person_id=person_id, **_draw_face(rng))
+                        for photo_id, person_id in links
+                    )
+            faces.extend(
+                Face(photo=photo, **_draw_face(rng))
+                for photo in photos if rng.random() < UNNAMED_FACE_RATE
+            )
+            Face.objects.bulk_create(faces)
+
+        created += size
+        if stdout:
+            stdout.write(f'Generated {created}/{count} photos')
+
+    return created
+
+
+def photo_infos(count, seed=0, modified=0.0, albums=200, persons=300,
+                keywords=500, labels=800, start=None):
+    """Return osxphotos PhotoInfo look-alikes for driving sync_photos_command.
+
+    The same seed gives the same photos. modified is the share of them
+    reported with a later modification date, as an incremental sync sees.
+    """
+    rng = random.Random(seed)
+    changes = random.Random(-seed - 1)
+    start, span = _date_range(start)
+
+    infos = []
+    for _ in range(count):
+        photo = _draw_photo(rng, start, span)
+        tags = {
+            kind: [f'{SYNTHETIC_PREFIX}{kind}-{index}' for index in sorted(_draw_tags(rng, amount))]
+            for kind, amount in (
+                ('album', albums), ('person', persons), ('keyword', keywords), ('label', labels),
+            )
+        }
+        faces = [
+            SimpleNamespace(person_info=SimpleNamespace(name=name, uuid=None), **_draw_face(rng))
+            for name in tags['person']
+        ]
+        date_modified = photo.date_modified
+        if changes.random() < modified:
+            date_modified += timedelta(days=1)
+
+        infos.append(SimpleNamespace(
+            uuid=photo.uuid,
+            original_filename=photo.original_filename,
+            filename=photo.filename,
+            path='',
+            path_edited='',
+            isphoto=photo.is_photo,
+            ismovie=photo.is_movie,
+            date=photo.date,
+            date_modified=date_modified,
+            date_added=photo.date_added,
+            title=photo.title,
+            description='',
+            latitude=photo.latitude,
+            longitude=photo.longitude,
+            place=SimpleNamespace(
+                name=photo.place_name, country_code=photo.place_country_code,
+                address_str='', ishome=False,
+            ) if photo.place_name else None,
+            uti='public.jpeg',
+            orientation=1,
+            width=photo.width,
+            height=photo.height,
+            duration=photo.duration,
+            camera_make=photo.camera_make,
+            camera_model=photo.camera_model,
+            timezone_name='',
+            in_trash=False,
+            shared=False,
+            original_file_size=photo.original_file_size,
+            albums=tags['album'],
+            persons=tags['person'],
+            keywords=tags['keyword'],
+            labels=tags['label'],
+            score=SimpleNamespace(**{field: rng.random() for field in SCORE_FIELDS}),
+            faces=faces,
+            **{name: getattr(photo, field) for field, name in PHOTOINFO_FLAGS.items()},
+        ))
+    return infos
+
+
+def delete_library():
+    """Remove everything created by generate_library()"""
+    Photo.objects.filter(uuid__startswith=SYNTHETIC_PREFIX).delete()
+    for model in (Album, Person, Keyword, Label):
+        model.objects.filter(name__startswith=SYNTHETIC_PREFIX).delete()
@@ -1,3 +1,983 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import io
+import json
+import os
+import pstats
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import warnings
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count, F
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import bitmap, embeddings, media, metrics, thumbnails
+from .duplicates import cluster_hashes, to_signed
+from .events import rebuild_events, segment, update_events
+from .export import TAGS, export_chunks
+from .faces import update_cluster_sizes
+from .filters import filter_photos
+from .flags import FLAG_BITS, FLAG_FIELDS, compute_flags, filter_flags, list_filter_flags
+from .generation import bump_generation, current_generation, next_generation
+from .jobs import ProgressOutput, claim, enqueue
+from .management.commands.sync_daemon import Command as SyncDaemonCommand, FileEventHandler, PendingChanges
+from .management.commands.sync_photos_command import Command as SyncCommand
+from .middleware import ProfileMiddleware
+from .models import Photo, PhotoScore, Album, Person, Face, FaceCluster, Event, Job
+from .snapshot import LibrarySnapshot, snapshot_dir, write_snapshot
+from .synthetic import generate_library, photo_infos
+from .thumbnails import RenderScheduler, get_thumbnail, render_thumbnail, thumbnail_path
+
+
+# Queries a photo list page may run with a cold cache: the result ids, the
+# page's rows and the album options of the sidebar
+LIST_PAGE_QUERY_BUDGET = 3
+
+# Imported on first use only: web workers and management commands start
+# without them
+HEAVY_MODULES = {'numpy', 'PIL', 'osxphotos', 'pyarrow', 'sentence_transformers', 'qdrant_client'}
+
+# Milliseconds the app's own modules may take to import on startup
+STARTUP_IMPORT_BUDGET = 50
+
+
+@override_settings(PHOTO_BITMAP_INDEX=False, PHOTO_SNAPSHOT=False)
+class PhotoListQueryBudgetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        photos = []
+        for i in range(120):
+            photo = Photo(
+                uuid=f'photo-{i}',
+                filename=f'IMG_{i:04d}.JPG',
+                date=start + timedelta(hours=i),
+                favorite=i % 3 == 0,
+            )
+            photo.flags = compute_flags(photo)
+            photos.append(photo)
+        photos = Photo.objects.bulk_create(photos)
+        cls.album = Album.objects.create(name='Holidays')
+        cls.album.photos.add(*photos[:80])
+
+    def setUp(self):
+        cache.clear()
+
+    def get_page(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('photos:photo_list'), params)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_first_page_within_budget(self):
+        _, count = self.get_page()
+        self.assertLessEqual(count, LIST_PAGE_QUERY_BUDGET)
+
+    def test_filtered_page_within_budget(self):
+        _, count = self.get_page(album=self.album.pk, page=2)
+        self.assertLessEqual(count, LIST_PAGE_QUERY_BUDGET)
+
+    def test_repeat_browsing_only_loads_page_rows(self):
+        self.get_page()
+        response, count = self.get_page(page=2)
+        self.assertEqual(count, 1)
+        self.assertEqual(len(response.context['photos']), 50)
+
+    def test_score_sort_within_budget(self):
+        _, count = self.get_page(sort='-score__overall')
+        self.assertLessEqual(count, LIST_PAGE_QUERY_BUDGET)
+
+    def test_cached_sidebar_skips_snapshot_facets(self):
+        with tempfile.TemporaryDirectory() as root, override_settings(
+            LIBRARY_STATE_DIR=root, PHOTO_SNAPSHOT=True,
+        ):
+            with next_generation() as generation:
+                write_snapshot(generation)
+            with mock.patch.object(
+                LibrarySnapshot, 'facet_counts', autospec=True, side_effect=LibrarySnapshot.facet_counts,
+            ) as facet_counts:
+                first, _ = self.get_page()
+                self.get_page()
+        self.assertEqual(facet_counts.call_count, 1)
+        self.assertContains(first, 'Holidays (80)')
+
+    def test_score_sort_keeps_unscored_photos(self):
+        scored = Photo.objects.get(uuid='photo-7')
+        PhotoScore.objects.create(photo=scored, overall=0.9)
+        response, _ = self.get_page(sort='-score__overall')
+        self.assertEqual(response.context['paginator'].count, 120)
+        self.assertEqual(response.context['photos'][0].pk, scored.pk)
+
+
+class GenerationTests(SimpleTestCase):
+    def test_concurrent_bumps_get_distinct_generations(self):
+        with tempfile.TemporaryDirectory() as root, override_settings(LIBRARY_STATE_DIR=root):
+            with ThreadPoolExecutor(8) as pool:
+                generations = list(pool.map(lambda _: bump_generation(), range(40)))
+            self.assertEqual(sorted(generations), list(range(1, 41)))
+            self.assertEqual(current_generation(), 40)
+
+    def test_failed_publish_keeps_generation(self):
+        with tempfile.TemporaryDirectory() as root, override_settings(LIBRARY_STATE_DIR=root):
+            with self.assertRaises(RuntimeError), next_generation():
+                raise RuntimeError
+            self.assertEqual(current_generation(), 0)
+
+
+class DuplicateDetectionTests(TestCase):
+    def test_clusters_near_hashes_apart_from_far_ones(self):
+        far = (1 << 64) - 1
+        hashes = [
+            ('a', 0), ('b', 0b111), ('c', to_signed(far)), ('d', to_signed(far ^ 1)),
+            ('e', 0b1111111111 << 20),
+        ]
+        clusters = cluster_hashes(hashes, threshold=4)
+        self.assertEqual(sorted(sorted(cluster) for cluster in clusters), [['a', 'b'], ['c', 'd']])
+        self.assertEqual(cluster_hashes(hashes, threshold=0), [])
+
+    def test_rejects_invalid_parameters(self):
+        photo = Photo.objects.create(uuid='photo-1', filename='IMG_0001.JPG')
+        response = self.client.get(reverse('photos:duplicates'), {'threshold': 'x'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('photos:duplicates'), {'threshold': 64})
+        self.assertEqual(response.context['threshold'], 16)
+        for size in ('abc', 301):
+            response = self.client.get(reverse('photos:photo_thumbnail', args=[photo.pk]), {'size': size})
+            self.assertEqual(response.status_code, 400)
+
+
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        from PIL import Image
+
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        settings_override = override_settings(
+            THUMBNAIL_CACHE_DIR=os.path.join(root.name, 'cache'),
+            LIBRARY_STATE_DIR=os.path.join(root.name, 'state'),
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+        self.photos = []
+        for i, color in enumerate(['red', 'green', 'blue']):
+            path = os.path.join(root.name, f'IMG_{i}.png')
+            Image.new('RGB', (40, 30), color).save(path)
+            self.photos.append(Photo.objects.create(
+                uuid=f'photo-{i}', filename=f'IMG_{i}.png', path=path,
+                date=datetime(2024, 1, 1 + i, tzinfo=timezone.utc),
+            ))
+
+    def test_renders_on_render_threads(self):
+        from . import views
+
+        threads = []
+
+        def record(*args):
+            threads.append(threading.current_thread().name)
+            return get_thumbnail(*args)
+
+        url = reverse('photos:photo_thumbnail', args=[self.photos[0].pk])
+        with mock.patch.object(views, 'get_thumbnail', side_effect=record):
+            first = self.client.get(url)
+            second = self.client.get(url)
+        self.assertEqual((first.status_code, second.status_code), (200, 200))
+        self.assertEqual(first.content[:2], b'\xff\xd8')
+        # The cached thumbnail is served without going through a render
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith('thumbnail-render'))
+
+    def test_concurrent_cold_requests_render_once(self):
+        renders = []
+
+        def slow_render(*args):
+            renders.append(args)
+            # Long enough for every request to reach the scheduler
+            time.sleep(0.2)
+            return render_thumbnail(*args)
+
+        url = reverse('photos:photo_thumbnail', args=[self.photos[0].pk])
+
+        async def fetch():
+            return await asyncio.gather(*[self.async_client.get(url) for _ in range(8)])
+
+        # Enough render slots and threads that only coalescing keeps the
+        # requests from rendering side by side
+        pool = ThreadPoolExecutor(8)
+        self.addCleanup(pool.shutdown)
+        with mock.patch.object(thumbnails, 'scheduler', RenderScheduler(8)), \
+                mock.patch.object(media, '_render_executor', pool), \
+                mock.patch.object(thumbnails, 'render_thumbnail', side_effect=slow_render):
+            responses = async_to_sync(fetch)()
+        self.assertEqual(len(renders), 1)
+        self.assertEqual({response.status_code for response in responses}, {200})
+        self.assertEqual(len({response.content for response in responses}), 1)
+
+    def test_full_photo_streams_under_wsgi_and_asgi(self):
+        photo = self.photos[0]
+        with open(photo.path, 'rb') as f:
+            original = f.read()
+        url = reverse('photos:photo_full', args=[photo.pk])
+        # An async iterator would be collected into memory by WSGI, with a warning
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            response = self.client.get(url)
+            self.assertFalse(response.is_async)
+            self.assertEqual(b''.join(response), original)
+
+        async def download():
+            response = await self.async_client.get(url)
+            self.assertTrue(response.is_async)
+            return b''.join([chunk async for chunk in response])
+
+        self.assertEqual(async_to_sync(download)(), original)
+
+    def test_sprite_sheet_is_pinned_to_the_manifest_generation(self):
+        from PIL import Image
+
+        manifest = self.client.get(reverse('photos:sprite_manifest'), {'columns': 2, 'size': 20}).json()
+        self.assertEqual(
+            [tile['id'] for tile in manifest['tiles']], [photo.pk for photo in reversed(self.photos)],
+        )
+        self.assertIn(f'generation={current_generation()}', manifest['sprite'])
+
+        # A sync between the two requests still serves the manifest's sheet
+        Photo.objects.filter(pk=self.photos[-1].pk).delete()
+        bump_generation()
+        sheet = self.client.get(manifest['sprite'])
+        self.assertEqual(sheet.status_code, 200)
+        self.assertEqual(Image.open(io.BytesIO(sheet.content)).size, (40, 40))
+
+        # Unless it has left the cache, as the photos have changed since
+        cache.clear()
+        self.assertEqual(self.client.get(manifest['sprite']).status_code, 410)
+
+    def test_sprite_rejects_non_integer_parameters(self):
+        for params in ({'columns': 'two'}, {'limit': 'all'}, {'size': '1.5'}):
+            response = self.client.get(reverse('photos:sprite_manifest'), params)
+            self.assertEqual(response.status_code, 400)
+            response = self.client.get(reverse('photos:sprite_sheet'), params)
+            self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('photos:sprite_sheet'), {'generation': 'latest'})
+        self.assertEqual(response.status_code, 400)
+
+
+class SemanticSearchFallbackTests(TestCase):
+    def test_unavailable_index_falls_back_to_text_search(self):
+        Photo.objects.create(uuid='beach', filename='beach.jpg', title='Beach day')
+        Photo.objects.create(uuid='city', filename='city.jpg', title='City lights')
+        self.addCleanup(setattr, embeddings, '_unavailable_until', 0)
+        with mock.patch.object(embeddings, 'get_client', side_effect=ConnectionError('refused')):
+            response = self.client.get(reverse('photos:photo_list'), {'semantic': 'beach'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['semantic_unavailable'])
+        self.assertEqual([photo.uuid for photo in response.context['photos']], ['beach'])
+
+
+class FaceSyncTests(TestCase):
+    def face(self, uuid, x=0.5, name=None):
+        person = SimpleNamespace(name=name, uuid=None) if name else None
+        return SimpleNamespace(uuid=uuid, center_x=x, center_y=0.5, width=0.1, height=0.1, person_info=person)
+
+    def test_resync_keeps_embeddings_and_clusters(self):
+        photo = Photo.objects.create(uuid='photo-1', filename='IMG_0001.JPG')
+        sync = SyncCommand(stdout=io.StringIO())
+        sync._update_faces(photo, [self.face('a'), self.face('b'), self.face('c')])
+        cluster = FaceCluster.objects.create(centroid=b'', size=0)
+        photo.faces.update(embedding=b'vector', cluster=cluster)
+        update_cluster_sizes()
+        self.assertEqual(FaceCluster.objects.get().size, 3)
+
+        # a is unchanged, b was named, c moved and d is new
+        sync._update_faces(photo, [
+            self.face('a'), self.face('b', name='Ann'), self.face('c', x=0.2), self.face('d'),
+        ])
+        faces = {face.uuid: face for face in photo.faces.all()}
+        self.assertEqual((faces['a'].embedding, faces['a'].cluster_id), (b'vector', cluster.pk))
+        self.assertEqual((faces['b'].person.name, faces['b'].cluster_id), ('Ann', None))
+        self.assertEqual((faces['c'].embedding, faces['c'].cluster_id), (None, None))
+        self.assertIsNone(faces['d'].embedding)
+
+        update_cluster_sizes()
+        self.assertEqual(FaceCluster.objects.get().size, 1)
+        Face.objects.filter(uuid='c').update(cluster=cluster)
+        Face.objects.filter(uuid='b').update(cluster=cluster)
+        response = self.client.get(reverse('photos:face_clusters'))
+        listed = [face['id'] for face in response.json()['clusters'][0]['faces']]
+        self.assertEqual(sorted(listed), sorted([faces['a'].pk, faces['c'].pk]))
+
+    def test_faces_stored_without_uuid_keep_their_embeddings(self):
+        photo = Photo.objects.create(uuid='photo-1', filename='IMG_0001.JPG')
+        legacy = Face.objects.create(
+            photo=photo, center_x=0.5, center_y=0.5, width=0.1, height=0.1, embedding=b'vector',
+        )
+        SyncCommand(stdout=io.StringIO())._update_faces(photo, [self.face('a'), self.face('b', x=0.2)])
+        faces = {face.uuid: face for face in photo.faces.all()}
+        self.assertEqual(set(faces), {'a', 'b'})
+        self.assertEqual((faces['a'].pk, faces['a'].embedding), (legacy.pk, b'vector'))
+        self.assertIsNone(faces['b'].embedding)
+
+    def test_cluster_api_validates_paging(self):
+        photo = Photo.objects.create(uuid='photo-1', filename='IMG_0001.JPG')
+        cluster = FaceCluster.objects.create(centroid=b'', size=2)
+        Face.objects.bulk_create([
+            Face(photo=photo, cluster=cluster, center_x=x, center_y=0.5, width=0.1, height=0.1)
+            for x in (0.2, 0.6)
+        ])
+        url = reverse('photos:face_clusters')
+        for params in ({'page_size': 'abc'}, {'samples': 'x'}):
+            self.assertEqual(self.client.get(url, params).status_code, 400)
+        for params in ({'page_size': 0}, {'page_size': -3}, {'samples': -1}):
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()['clusters']), 1)
+        self.assertEqual(len(self.client.get(url, {'samples': 0}).json()['clusters'][0]['faces']), 1)
+
+
+class PhotoListApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        # Pairs of photos share a date so pages have to break ties by id
+        Photo.objects.bulk_create([
+            Photo(uuid=f'photo-{i}', filename=f'IMG_{i:04d}.JPG', date=start + timedelta(days=i // 2))
+            for i in range(25)
+        ] + [Photo(uuid='undated', filename='IMG_9999.JPG')])
+
+    def walk(self, **params):
+        ids, cursor = [], None
+        while True:
+            if cursor:
+                params['cursor'] = cursor
+            data = self.client.get(reverse('photos:photo_list_api'), params).json()
+            ids += [row[0] for row in data['rows']]
+            cursor = data['next']
+            if not cursor:
+                return ids
+
+    def test_cursor_pages_cover_every_photo_once(self):
+        expected = list(
+            Photo.objects.order_by(F('date').desc(nulls_last=True), 'id').values_list('id', flat=True)
+        )
+        self.assertEqual(self.walk(limit=4, fields='id'), expected)
+
+    def test_ascending_and_offset_sorts(self):
+        expected = list(
+            Photo.objects.order_by(F('date').asc(nulls_last=True), 'id').values_list('id', flat=True)
+        )
+        self.assertEqual(self.walk(limit=5, fields='id', sort='date'), expected)
+        self.assertEqual(
+            self.walk(limit=7, fields='id', sort='filename'),
+            list(Photo.objects.order_by('filename').values_list('id', flat=True)),
+        )
+
+    def test_offset_sort_breaks_ties_by_id(self):
+        Photo.objects.filter(uuid__in=['photo-3', 'photo-4', 'photo-5']).update(filename='IMG_SAME.JPG')
+        self.assertEqual(
+            self.walk(limit=2, fields='id', sort='filename'),
+            list(Photo.objects.order_by('filename', 'id').values_list('id', flat=True)),
+        )
+
+    def test_rejects_unknown_fields(self):
+        response = self.client.get(reverse('photos:photo_list_api'), {'fields': 'id,secret'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_rejects_non_integer_limit(self):
+        response = self.client.get(reverse('photos:photo_list_api'), {'limit': 'all'})
+        self.assertEqual(response.status_code, 400)
+
+
+class BestPhotosApiTests(TestCase):
+    def test_rejects_non_integer_parameters(self):
+        for params in ({'n': 'ten'}, {'year': '20x4'}):
+            response = self.client.get(reverse('photos:best_photos'), params)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', response.json())
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        photos = Photo.objects.bulk_create([
+            Photo(uuid=f'photo-{i}', filename=f'IMG_{i:04d}.JPG') for i in range(25)
+        ])
+        Album.objects.create(name='Holidays').photos.add(*photos[::2])
+        Album.objects.create(name='Family').photos.add(*photos[:3])
+
+    def test_queries_per_chunk_not_per_photo(self):
+        with CaptureQueriesContext(connection) as queries:
+            records = [record for chunk in export_chunks(chunk_size=10) for record in chunk]
+        self.assertEqual(len(records), 25)
+        # The photos query, then one query per tag model for each chunk
+        self.assertEqual(len(queries), 1 + 3 * len(TAGS))
+        self.assertEqual(records[0]['albums'], ['Family', 'Holidays'])
+        self.assertEqual(records[1]['albums'], ['Family'])
+        self.assertEqual(records[3]['albums'], [])
+
+    def test_streams_ndjson_and_csv(self):
+        # An async iterator would be collected into memory by WSGI, with a warning
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            response = self.client.get(reverse('photos:photo_export'))
+            self.assertFalse(response.is_async)
+            self.assertEqual(b''.join(response).count(b'\n'), 25)
+            response = self.client.get(reverse('photos:photo_export'), {'format': 'csv'})
+            self.assertEqual(b''.join(response).count(b'\n'), 26)
+        response = self.client.get(reverse('photos:photo_export'), {'format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.metrics_dir = directory.name
+        overrides = override_settings(METRICS_DIR=directory.name, METRICS_ALLOWED_IPS=['127.0.0.1'])
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def served_bytes(self, view):
+        return metrics.response_bytes.values.get((view,), 0)
+
+    def test_counts_streamed_bytes(self):
+        Photo.objects.create(uuid='photo-1', filename='IMG_0001.JPG')
+        before = self.served_bytes('photos:photo_export')
+        body = b''.join(self.client.get(reverse('photos:photo_export')))
+        self.assertEqual(self.served_bytes('photos:photo_export') - before, len(body))
+
+    def test_adds_up_every_process(self):
+        other = {metrics.requests_total.name: [
+            {'labels': {'view': 'photos:other', 'method': 'GET', 'status': '200'}, 'value': 5},
+        ]}
+        exited = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                                capture_output=True, text=True).stdout.strip()
+        for name in ('otherhost-1', f'{metrics._HOST}-{exited}'):
+            with open(os.path.join(self.metrics_dir, f'{name}.json'), 'w') as f:
+                json.dump(other, f)
+
+        totals = {metric.name: metric for metric in metrics.collect()}
+        self.assertEqual(totals[metrics.requests_total.name].values[('photos:other', 'GET', '200')], 10)
+        # The exited process's counts moved into the archive
+        self.assertFalse(os.path.exists(os.path.join(self.metrics_dir, f'{metrics._HOST}-{exited}.json')))
+        totals = {metric.name: metric for metric in metrics.collect()}
+        self.assertEqual(totals[metrics.requests_total.name].values[('photos:other', 'GET', '200')], 10)
+
+    def test_endpoint_needs_staff_or_allowed_address(self):
+        self.assertEqual(self.client.get(reverse('photos:metrics')).status_code, 200)
+        with override_settings(METRICS_ALLOWED_IPS=[]):
+            self.assertEqual(self.client.get(reverse('photos:metrics')).status_code, 403)
+
+
+class ProfileMiddlewareTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.profile_dir = directory.name
+        settings_override = override_settings(
+            PROFILING_ENABLED=True, PROFILE_TOKEN='secret', PROFILE_DIR=self.profile_dir,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        def view(request):
+            return HttpResponse(str(Photo.objects.count()))
+
+        self.middleware = ProfileMiddleware(view)
+
+    def get(self, **headers):
+        request = RequestFactory().get('/photos/', headers=headers)
+        request.user = AnonymousUser()
+        return self.middleware(request)
+
+    def test_removed_when_disabled(self):
+        with override_settings(PROFILING_ENABLED=False), self.assertRaises(MiddlewareNotUsed):
+            ProfileMiddleware(lambda request: HttpResponse())
+
+    def test_only_profiles_requests_with_the_token(self):
+        for headers in ({}, {'X-Profile': 'wrong'}, {'X-Profile': 'secrets'}):
+            response = self.get(**headers)
+            self.assertNotIn('X-Profile', response)
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+        response = self.get(**{'X-Profile': 'secret'})
+        base = os.path.join(self.profile_dir, response['X-Profile'])
+        self.assertEqual(
+            sorted(os.listdir(self.profile_dir)),
+            [f'{response["X-Profile"]}.prof', f'{response["X-Profile"]}.txt'],
+        )
+        with open(f'{base}.txt') as f:
+            report = f.read()
+        self.assertTrue(report.startswith('GET /photos/\n'))
+        self.assertIn('photos_photo', report)
+        pstats.Stats(f'{base}.prof')
+
+
+class PhotoArchiveTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        for name in ('a.jpg', 'b.jpg', 'b-edited.jpeg'):
+            with open(os.path.join(directory.name, name), 'wb') as f:
+                f.write(name.encode())
+        path = lambda name: os.path.join(directory.name, name)
+        Photo.objects.bulk_create([
+            Photo(uuid='a', original_filename='IMG_1.JPG', path=path('a.jpg'), favorite=True),
+            Photo(uuid='b', original_filename='IMG_1.JPG', path=path('b.jpg'),
+                  path_edited=path('b-edited.jpeg')),
+            Photo(uuid='missing', original_filename='IMG_2.JPG', path=path('gone.jpg')),
+        ])
+
+    def download(self, **params):
+        # An async iterator would be collected into memory by WSGI, with a warning
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            response = self.client.get(reverse('photos:photo_archive'), params)
+            self.assertEqual(response['Content-Type'], 'application/zip')
+            self.assertFalse(response.is_async)
+            archive = zipfile.ZipFile(io.BytesIO(b''.join(response)))
+        return {name: archive.read(name) for name in archive.namelist()}
+
+    def test_asgi_streams_the_same_archive(self):
+        async def download():
+            response = await self.async_client.get(reverse('photos:photo_archive'), {'version': 'edited'})
+            self.assertTrue(response.is_async)
+            return b''.join([chunk async for chunk in response])
+
+        archive = zipfile.ZipFile(io.BytesIO(async_to_sync(download)()))
+        self.assertEqual(
+            {name: archive.read(name) for name in archive.namelist()},
+            {'IMG_1.JPG': b'a.jpg', 'IMG_1.jpeg': b'b-edited.jpeg'},
+        )
+
+    def test_stores_originals_with_unique_names(self):
+        self.assertEqual(self.download(), {'IMG_1.JPG': b'a.jpg', 'IMG_1 (2).JPG': b'b.jpg'})
+
+    def test_edited_version_and_filters(self):
+        self.assertEqual(
+            self.download(version='edited'),
+            {'IMG_1.JPG': b'a.jpg', 'IMG_1.jpeg': b'b-edited.jpeg'},
+        )
+        self.assertEqual(self.download(favorites='true'), {'IMG_1.JPG': b'a.jpg'})
+
+
+class FilesystemImportTests(TestCase):
+    def test_copies_keep_the_first_path(self):
+        from PIL import Image
+
+        with tempfile.TemporaryDirectory() as root, override_settings(
+            LIBRARY_STATE_DIR=os.path.join(root, 'state'), PHOTO_SNAPSHOT=False, JOBS_AFTER_SYNC=[],
+        ):
+            library = os.path.join(root, 'library')
+            os.makedirs(os.path.join(library, 'copies'))
+            original = os.path.join(library, 'a.png')
+            Image.new('RGB', (4, 4), 'red').save(original)
+            Image.new('RGB', (4, 4), 'blue').save(os.path.join(library, 'b.png'))
+            shutil.copy(original, os.path.join(library, 'copies', 'a.png'))
+
+            for _ in range(2):
+                output = io.StringIO()
+                call_command(
+                    'sync_photos_command', source='filesystem', root=[library], workers=1, stdout=output,
+                )
+                self.assertIn('1 duplicates', output.getvalue())
+                self.assertEqual(
+                    sorted(Photo.objects.values_list('path', flat=True)),
+                    [original, os.path.join(library, 'b.png')],
+                )
+
+            # Once the first copy is gone the photo moves to the other one
+            os.remove(original)
+            call_command(
+                'sync_photos_command', source='filesystem', root=[library], workers=1, stdout=io.StringIO(),
+            )
+            moved = Photo.objects.get(path=os.path.join(library, 'copies', 'a.png'))
+            self.assertFalse(moved.is_missing)
+
+
+@override_settings(JOB_COMMANDS={'warm_thumbnails': 2, 'build_snapshot': 1})
+class JobQueueTests(TestCase):
+    def test_uuids_merge_into_queued_job(self):
+        first = enqueue('warm_thumbnails', uuids=['b', 'a'])
+        second = enqueue('warm_thumbnails', uuids=['c', 'a'])
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(Job.objects.get().options, {'uuid': ['a', 'b', 'c']})
+        with self.assertRaises(ValueError):
+            enqueue('flush')
+
+    def test_claims_by_priority_within_concurrency_limits(self):
+        for _ in range(3):
+            enqueue('warm_thumbnails')
+        snapshots = [enqueue('build_snapshot', priority=5) for _ in range(2)]
+        claimed = [claim('test') for _ in range(4)]
+        self.assertEqual(claimed[0].pk, snapshots[0].pk)
+        self.assertEqual([job.command for job in claimed[1:3]], ['warm_thumbnails'] * 2)
+        self.assertIsNone(claimed[3])
+        self.assertEqual(Job.objects.filter(status=Job.QUEUED).count(), 2)
+
+    def test_progress_lines_update_job(self):
+        job = enqueue('warm_thumbnails')
+        output = ProgressOutput(job)
+        output.write('Rendering 250 thumbnails...\nProgress: 100/250\n')
+        job.refresh_from_db()
+        self.assertEqual((job.progress, job.total, job.message), (100, 250, 'Progress: 100/250'))
+
+    def test_sync_refreshes_derived_data_of_changed_images(self):
+        infos = photo_infos(2, albums=2, persons=2, keywords=2, labels=2)
+        with tempfile.TemporaryDirectory() as root, override_settings(
+            THUMBNAIL_CACHE_DIR=root, LIBRARY_STATE_DIR=root, PHOTO_SNAPSHOT=False,
+            JOBS_AFTER_SYNC=['warm_thumbnails'],
+        ):
+            SyncCommand(stdout=io.StringIO()).sync(infos)
+            Photo.objects.update(phash=1)
+            for info in infos:
+                os.makedirs(os.path.dirname(thumbnail_path(info.uuid)), exist_ok=True)
+                open(thumbnail_path(info.uuid), 'wb').close()
+            Job.objects.all().delete()
+
+            edited, untouched = infos
+            edited.path_edited = '/edits/edited.jpg'
+            edited.date_modified += timedelta(days=1)
+            SyncCommand(stdout=io.StringIO()).sync(infos)
+
+            self.assertFalse(os.path.exists(thumbnail_path(edited.uuid)))
+            self.assertTrue(os.path.exists(thumbnail_path(untouched.uuid)))
+            phashes = dict(Photo.objects.values_list('uuid', 'phash'))
+            self.assertEqual(phashes, {edited.uuid: None, untouched.uuid: 1})
+            self.assertEqual(Job.objects.get().options, {'uuid': [edited.uuid]})
+
+
+@override_settings(EVENT_GAP_HOURS=6, EVENT_DISTANCE_KM=50)
+class EventTests(TestCase):
+    def test_segment_splits_on_time_gaps_and_distance(self):
+        import numpy as np
+
+        hour = 3600
+        nan = float('nan')
+        timestamps = np.array([0, hour, 8 * hour, 9 * hour, 9 * hour, 10 * hour, 11 * hour])
+        # Lisbon, Lisbon, Lisbon, Lisbon, Porto at the same moment, no
+        # location, Porto
+        latitudes = np.array([38.72, 38.72, 38.72, 38.72, 41.15, nan, 41.15])
+        longitudes = np.array([-9.14, -9.14, -9.14, -9.14, -8.61, nan, -8.61])
+        starts = segment(timestamps, latitudes, longitudes, 6 * hour, 50)
+        self.assertEqual(starts.tolist(), [0, 2])
+
+        # Back to Lisbon an hour later, then Porto again
+        latitudes[5], longitudes[5] = 38.72, -9.14
+        self.assertEqual(segment(timestamps, latitudes, longitudes, 6 * hour, 50).tolist(), [0, 2, 5, 6])
+        self.assertEqual(len(segment(timestamps[:0], latitudes[:0], longitudes[:0], 6 * hour, 50)), 0)
+
+    def groups(self):
+        return sorted(
+            sorted(event.photos.values_list('id', flat=True))
+            for event in Event.objects.all()
+        )
+
+    def test_update_events_matches_a_full_rebuild(self):
+        start = datetime(2024, 5, 1, tzinfo=timezone.utc)
+        hours = [0, 1, 2, 10, 11, 30, 31]
+        Photo.objects.bulk_create([
+            Photo(
+                uuid=f'photo-{hour}', filename=f'IMG_{hour}.JPG', date=start + timedelta(hours=hour),
+            )
+            for hour in hours
+        ])
+        self.assertEqual(rebuild_events(), (0, 3))
+
+        # A photo bridging the first two events joins them, and a moved one
+        # leaves its old event
+        bridge = Photo.objects.create(
+            uuid='bridge', filename='IMG_B.JPG', date=start + timedelta(hours=6),
+        )
+        moved = Photo.objects.get(uuid='photo-31')
+        moved.date = start + timedelta(hours=50)
+        moved.save()
+        update_events([bridge.id, moved.id])
+        incremental = self.groups()
+        self.assertEqual(len(incremental), 3)
+        self.assertEqual(Event.objects.get(photos=bridge).photo_count, 6)
+
+        rebuild_events()
+        self.assertEqual(self.groups(), incremental)
+
+
+class SyncDaemonTests(TestCase):
+    def test_pending_changes_wait_for_a_quiet_period(self):
+        clock = mock.patch('photos.management.commands.sync_daemon.time.monotonic')
+        now = clock.start()
+        self.addCleanup(clock.stop)
+        pending = PendingChanges(debounce=3, max_delay=10)
+
+        now.return_value = 0
+        self.assertFalse(pending.due())
+        pending.add('a')
+        now.return_value = 2
+        pending.add('b', 'a')
+        now.return_value = 4.9
+        self.assertFalse(pending.due())
+        now.return_value = 5
+        self.assertTrue(pending.due())
+        self.assertEqual(pending.take(), {'a', 'b'})
+        self.assertFalse(pending)
+        self.assertFalse(pending.due())
+
+    def test_pending_changes_flush_a_steady_stream_after_max_delay(self):
+        clock = mock.patch('photos.management.commands.sync_daemon.time.monotonic')
+        now = clock.start()
+        self.addCleanup(clock.stop)
+        pending = PendingChanges(debounce=3, max_delay=10)
+
+        for second in range(0, 10, 2):
+            now.return_value = second
+            pending.add(second)
+            self.assertFalse(pending.due())
+        now.return_value = 10
+        self.assertTrue(pending.due())
+
+    def test_batches_leave_maintenance_for_later(self):
+        from PIL import Image
+
+        with tempfile.TemporaryDirectory() as root, override_settings(
+            LIBRARY_STATE_DIR=os.path.join(root, 'state'), PHOTO_SNAPSHOT=True, JOBS_AFTER_SYNC=[],
+        ):
+            path = os.path.join(root, 'IMG_1.png')
+            Image.new('RGB', (4, 4), 'red').save(path)
+            daemon = SyncDaemonCommand(stdout=io.StringIO())
+            daemon.options = {'root': [root], 'workers': 1, 'batch_size': 100, 'maintenance_interval': 600}
+            daemon.syncer = SyncCommand(stdout=io.StringIO())
+            daemon.unmaintained, daemon.maintained_at = False, time.monotonic()
+
+            with mock.patch('photos.management.commands.sync_photos_command.call_command') as command:
+                daemon._sync_files({(path, False)})
+                self.assertEqual(Photo.objects.get().path, path)
+                command.assert_not_called()
+                # The batch is visible to new requests, without a snapshot yet
+                self.assertEqual(current_generation(), 1)
+                self.assertFalse(os.path.exists(snapshot_dir(1)))
+
+                daemon._maintain()
+                command.assert_not_called()
+                daemon._maintain(force=True)
+                command.assert_called_once_with('optimize_database', stdout=daemon.syncer.stdout)
+            self.assertEqual(current_generation(), 2)
+            self.assertTrue(os.path.exists(snapshot_dir(2)))
+            self.assertFalse(daemon.unmaintained)
+
+    def test_file_events_queue_image_files_and_directories(self):
+        pending = PendingChanges(debounce=3, max_delay=10)
+        handler = FileEventHandler(pending)
+        events = [
+            ('created', '/library/IMG_1.JPG', False),
+            ('modified', '/library/notes.txt', False),
+            ('created', '/library/.IMG_2.JPG', False),
+            ('opened', '/library/IMG_3.JPG', False),
+            ('modified', '/library/trip', True),
+            ('created', '/library/party', True),
+        ]
+        for event_type, path, is_directory in events:
+            handler.dispatch(SimpleNamespace(
+                event_type=event_type, src_path=path, is_directory=is_directory,
+            ))
+        handler.dispatch(SimpleNamespace(
+            event_type='moved', src_path='/library/a.png', dest_path='/library/b.png', is_directory=False,
+        ))
+        self.assertEqual(pending.take(), {
+            ('/library/IMG_1.JPG', False), ('/library/party', True),
+            ('/library/a.png', False), ('/library/b.png', False),
+        })
+
+
+# Photo list filters the bitmap index and snapshot must answer like the ORM.
+# 'album' and 'person' are replaced with the most used tag of that kind.
+EQUIVALENT_FILTERS = [
+    {},
+    {'favorites': 'true'},
+    {'videos': 'true'},
+    {'photos': 'true'},
+    {'live_photos': 'true', 'hdr': 'true'},
+    {'album': 'popular'},
+    {'person': 'popular'},
+    {'album': 'popular', 'favorites': 'true'},
+    {'person': 'popular', 'photos': 'true'},
+    {'album': 'popular', 'person': 'popular', 'live_photos': 'true'},
+]
+
+
+class LibraryIndexEquivalenceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        generate_library(600, albums=4, persons=4, keywords=4, labels=4)
+        cls.filters = []
+        for params in EQUIVALENT_FILTERS:
+            cls.filters.append({
+                key: str(cls.popular(key)) if value == 'popular' else value
+                for key, value in params.items()
+            })
+
+    @staticmethod
+    def popular(facet):
+        model = {'album': Album, 'person': Person}[facet]
+        return model.objects.annotate(photo_count=Count('photos')).order_by('-photo_count', 'id')[0].pk
+
+    def expected_ids(self, params):
+        return list(filter_photos(params).values_list('id', flat=True))
+
+    @override_settings(PHOTO_BITMAP_INDEX=True)
+    def test_bitmap_index_matches_filter_photos(self):
+        with mock.patch.object(bitmap, '_index', None):
+            for params in self.filters:
+                with self.subTest(params=params):
+                    self.assertTrue(bitmap.supports(params))
+                    selected = bitmap.select_photos(params)
+                    self.assertEqual([int(pk) for pk in selected.ids], self.expected_ids(params))
+                    self.assertGreater(len(selected), 0)
+
+    def test_snapshot_matches_the_orm(self):
+        import numpy as np
+
+        # The stats view below computes its numbers through the ORM
+        with tempfile.TemporaryDirectory() as root, override_settings(
+            LIBRARY_STATE_DIR=root, PHOTO_SNAPSHOT=False,
+        ):
+            with next_generation() as generation:
+                write_snapshot(generation)
+            snapshot = LibrarySnapshot.load(snapshot_dir(generation))
+
+            for params in self.filters:
+                with self.subTest(params=params):
+                    mask = sum(FLAG_BITS[field] for field in list_filter_flags(params))
+                    selected = (snapshot.flags & mask) == mask
+                    for facet in ('album', 'person'):
+                        if params.get(facet):
+                            member = np.zeros(len(snapshot), dtype=bool)
+                            member[snapshot.facet_rows(facet, int(params[facet]))] = True
+                            selected &= member
+                    self.assertEqual(
+                        sorted(snapshot.ids[selected].tolist()), sorted(self.expected_ids(params)),
+                    )
+
+            self.assertEqual(
+                [(tag['id'], tag['photo_count']) for tag in snapshot.facet_counts('album')],
+                list(
+                    Album.objects.annotate(photo_count=Count('photos'))
+                    .order_by('name').values_list('id', 'photo_count')
+                ),
+            )
+            orm_stats = self.client.get(reverse('photos:stats')).context['stats']
+            for key, value in snapshot.stats().items():
+                if not key.startswith('top_'):
+                    self.assertEqual(value, orm_stats[key], key)
+
+    def test_flags_match_boolean_columns(self):
+        for field in ('favorite', 'is_movie', 'is_photo', 'live_photo', 'hidden'):
+            with self.subTest(field=field):
+                self.assertEqual(
+                    set(filter_flags(Photo.objects.all(), [field]).values_list('id', flat=True)),
+                    set(Photo.objects.filter(**{field: True}).values_list('id', flat=True)),
+                )
+
+    def test_flags_backfill_matches_compute_flags(self):
+        migration = importlib.import_module('photos.migrations.0006_photo_flags')
+        self.assertEqual(migration.FLAG_FIELDS, FLAG_FIELDS[:len(migration.FLAG_FIELDS)])
+        Photo.objects.update(flags=0)
+        migration.backfill_flags(django_apps, None)
+        for photo in Photo.objects.all():
+            self.assertEqual(photo.flags, compute_flags(photo), photo.uuid)
+
+
+class DatabaseSettingsTests(SimpleTestCase):
+    def run_django(self, code, **environ):
+        """Run code after django.setup() with environ set, and return what
+        it prints as JSON"""
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'config.settings', **environ}
+        result = subprocess.run(
+            [sys.executable, '-c', f'import django, json; django.setup(); {code}'],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+        )
+        return json.loads(result.stdout)
+
+    def pragmas(self, profile):
+        with tempfile.TemporaryDirectory() as root:
+            return self.run_django(
+                'from django.db import connection; cursor = connection.cursor(); '
+                'print(json.dumps({name: cursor.execute(f"PRAGMA {name}").fetchone()[0] '
+                'for name in ("journal_mode", "synchronous", "busy_timeout", "temp_store")}))',
+                DATABASE_ENGINE='sqlite', DATABASE_PROFILE=profile,
+                SQLITE_PATH=os.path.join(root, 'db.sqlite3'),
+            )
+
+    def test_sqlite_performance_profile(self):
+        # synchronous=NORMAL is 1 and temp_store=MEMORY is 2
+        self.assertEqual(
+            self.pragmas('performance'),
+            {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 5000, 'temp_store': 2},
+        )
+        self.assertEqual(self.pragmas('default')['journal_mode'], 'delete')
+
+    def test_postgresql_connections_persist(self):
+        database = self.run_django(
+            'from django.conf import settings; print(json.dumps(settings.DATABASES["default"], default=str))',
+            DATABASE_ENGINE='postgresql', DATABASE_PROFILE='performance',
+            POSTGRES_DB='library', POSTGRES_HOST='db', CONN_MAX_AGE='60',
+        )
+        self.assertEqual(database['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual((database['NAME'], database['HOST']), ('library', 'db'))
+        self.assertEqual((database['CONN_MAX_AGE'], database['CONN_HEALTH_CHECKS']), (60, True))
+        # The SQLite PRAGMAs are not passed to PostgreSQL
+        self.assertEqual(database['OPTIONS'], {})
+
+
+class StartupImportTests(SimpleTestCase):
+    def import_times(self, *args):
+        """Run Python with -X importtime and return {module: self time in µs}"""
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'config.settings'}
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', *args],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+        )
+        times = {}
+        for line in result.stderr.splitlines():
+            if line.startswith('import time:') and 'self [us]' not in line:
+                own, _, name = line[len('import time:'):].split('|')
+                times[name.strip()] = int(own)
+        return times
+
+    def assert_fast_startup(self, *args):
+        times = self.import_times(*args)
+        self.assertFalse(HEAVY_MODULES & {name.split('.')[0] for name in times})
+        own = sum(us for name, us in times.items() if name.split('.')[0] == 'photos')
+        self.assertLess(own / 1000, STARTUP_IMPORT_BUDGET)
+
+    def test_django_setup(self):
+        self.assert_fast_startup('-c', 'import django; django.setup()')
+
+    def test_web_worker_startup(self):
+        # Workers load the URLconf, and with it every view, on the first request
+        self.assert_fast_startup(
+            '-c', 'import config.asgi, config.wsgi; from django.urls import get_resolver; '
+                  'get_resolver().url_patterns',
+        )
+
+    def test_management_command_startup(self):
+        # System checks load the URLconf before a command runs
+        self.assert_fast_startup('manage.py', 'check')
+        self.assert_fast_startup('manage.py', 'sync_photos_command', '--help')
@@ -0,0 +1,160 @@
+import os
+import tempfile
+import threading
+from concurrent.futures import Future
+
+from django.conf import settings
+
+
+DEFAULT_SIZE = 300
+
+
+def open_image(path):
+    """Open an image with Pillow, imported on first use.
+
+    Pillow refuses to open anything above THUMBNAIL_MAX_PIXELS, so a corrupt
+    or hostile file cannot make a worker allocate gigabytes.
+    """
+    from PIL import Image
+
+    Image.MAX_IMAGE_PIXELS = settings.THUMBNAIL_MAX_PIXELS
+    return Image.open(path)
+
+
+def thumbnail_path(uuid, size=DEFAULT_SIZE):
+    """Return the on-disk cache path for a photo thumbnail"""
+    return os.path.join(
+        str(settings.THUMBNAIL_CACHE_DIR), str(size), uuid[:2], f'{uuid}.jpg'
+    )
+
+
+def discard_thumbnails(uuids):
+    """Delete every cached size of these photos' thumbnails, returning how
+    many files were removed"""
+    root = str(settings.THUMBNAIL_CACHE_DIR)
+    try:
+        sizes = [name for name in os.listdir(root) if name.isdigit()]
+    except FileNotFoundError:
+        return 0
+    removed = 0
+    for uuid in uuids:
+        for size in sizes:
+            try:
+                os.unlink(thumbnail_path(uuid, size))
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+def render_thumbnail(source_path, cache_path, size=DEFAULT_SIZE):
+    """Render a JPEG thumbnail of source_path into cache_path.
+
+    The file is written to a temporary name and renamed into place so that
+    concurrent readers never see a partially written thumbnail.
+    """
+    from PIL import Image, ImageOps
+
+    with open_image(source_path) as img:
+        if img.width * img.height > settings.THUMBNAIL_MAX_PIXELS:
+            raise Image.DecompressionBombError(
+                f'{source_path} is {img.width}x{img.height}, above THUMBNAIL_MAX_PIXELS'
+            )
+        # Let the JPEG decoder downscale while decoding, so a 48 MP photo is
+        # never fully expanded in memory
+        img.draft('RGB', (size, size))
+        img.thumbnail((size, size), Image.Resampling.LANCZOS)
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(cache_path), suffix='.tmp'
+        )
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                img.save(f, 'JPEG', quality=85)
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    return cache_path
+
+
+def default_render_concurrency():
+    """Size the render semaphore to the CPU count and available memory"""
+    try:
+        memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        memory = 0
+    by_memory = memory // 4 // settings.THUMBNAIL_DECODE_MEMORY if memory else 1
+    return max(1, min(os.cpu_count() or 1, by_memory))
+
+
+class RenderScheduler:
+    """Coalesces and bounds thumbnail renders within a process.
+
+    Concurrent requests for the same key wait for the first one's render
+    instead of decoding the image again (single-flight), and a semaphore
+    caps how many images are being decoded at the same time.
+    """
+
+    def __init__(self, max_concurrent):
+        self.max_concurrent = max_concurrent
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def run(self, key, func, *args):
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            return future.result()
+
+        try:
+            with self._slots:
+                result = func(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+
+scheduler = RenderScheduler(
+    settings.THUMBNAIL_RENDER_CONCURRENCY or default_render_concurrency()
+)
+
+
+def _render_if_missing(source_path, cache_path, size):
+    # Another request may have finished this render while we queued
+    if os.path.exists(cache_path):
+        return cache_path
+    return render_thumbnail(source_path, cache_path, size)
+
+
+def cached_thumbnail(uuid, size=DEFAULT_SIZE):
+    """Return the path of a cached thumbnail, or None if it is not rendered"""
+    cache_path = thumbnail_path(uuid, size)
+    return cache_path if os.path.exists(cache_path) else None
+
+
+def get_thumbnail(uuid, source_path, size=DEFAULT_SIZE):
+    """Return the path of a cached thumbnail, rendering it on a cache miss.
+
+    Returns None when the source file is not available on disk.
+    """
+    cache_path = thumbnail_path(uuid, size)
+    if os.path.exists(cache_path):
+        return cache_path
+    if not source_path or not os.path.exists(source_path):
+        return None
+    return scheduler.run((uuid, size), _render_if_missing, source_path, cache_path, size)
@@ -8,6 +8,18 @@ urlpatterns = [
     path('photo/<int:pk>/', views.PhotoDetailView.as_view(), name='photo_detail'),
     path('photo/<int:pk>/thumbnail/', views.photo_thumbnail, name='photo_thumbnail'),
     path('photo/<int:pk>/full/', views.photo_full, name='photo_full'),
+    path('download/', views.photo_archive, name='photo_archive'),
     path('stats/', views.stats_view, name='stats'),
+    path('events/', views.EventListView.as_view(), name='event_list'),
+    path('events/<int:pk>/', views.EventDetailView.as_view(), name='event_detail'),
+    path('duplicates/', views.duplicates_view, name='duplicates'),
+    path('jobs/', views.jobs_view, name='jobs'),
+    path('metrics/', views.metrics_view, name='metrics'),
     path('api/search/', views.search_autocomplete, name='search_autocomplete'),
+    path('api/face-clusters/', views.face_clusters_api, name='face_clusters'),
+    path('api/best/', views.best_photos_api, name='best_photos'),
+    path('api/photos/', views.photo_list_api, name='photo_list_api'),
+    path('api/export/', views.photo_export, name='photo_export'),
+    path('api/sprites/', views.sprite_manifest, name='sprite_manifest'),
+    path('api/sprites/sheet.jpg', views.sprite_sheet, name='sprite_sheet'),
 ]
\ No newline at end of file
@@ -1,12 +1,33 @@
-from django.shortcuts import render, get_object_or_404
+import os
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.contrib.admin.views.decorators import staff_member_required
+from django.shortcuts import redirect, render, get_object_or_404, aget_object_or_404
+from django.urls import reverse
 from django.views.generic import ListView, DetailView
-from django.db.models import Q, Count
+from django.db.models import Count, Max, F, Window
+from django.db.models.functions import RowNumber
 from django.core.paginator import Paginator
-from django.http import JsonResponse, HttpResponse
+from django.core.cache import cache
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.views.decorators.gzip import gzip_page
 from django.views.decorators.http import require_http_methods
-from PIL import Image
-import os
-from .models import Photo, Album, Person, Keyword, Label
+from . import bitmap, embeddings, media, metrics, ranking
+from .archive import ZipArchive
+from .duplicates import MAX_THRESHOLD, cluster_hashes
+from .export import FORMATS, export_chunks, export_stream
+from .filters import cached_photo_ids, filter_key, filter_photos
+from .flags import FLAG_BITS
+from .generation import current_generation
+from .jobs import enqueue, throughput
+from .models import Photo, Album, Person, Keyword, Label, Face, FaceCluster, Event, Job
+from .pagination import InvalidCursor, paginate
+from .snapshot import get_snapshot
+from .sprites import build_sprite
+from .thumbnails import DEFAULT_SIZE, cached_thumbnail, get_thumbnail
 
 
 class PhotoListView(ListView):
@@ -16,115 +37,28 @@ class PhotoListView(ListView):
     paginate_by = 50
     
     def get_queryset(self):
-        queryset = Photo.objects.all()
-        
-        # Search functionality
-        search_query = self.request.GET.get('search')
-        if search_query:
-            queryset = queryset.filter(
-                Q(title__icontains=search_query) |
-                Q(description__icontains=search_query) |
-                Q(filename__icontains=search_query) |
-                Q(keywords__name__icontains=search_query) |
-                Q(labels__name__icontains=search_query) |
-                Q(persons__name__icontains=search_query) |
-                Q(albums__name__icontains=search_query)
-            ).distinct()
-        
-        # Filter by various criteria
-        filters = {}
-        
-        # Photo type filters
-        if self.request.GET.get('favorites'):
-            queryset = queryset.filter(favorite=True)
-        
-        if self.request.GET.get('videos'):
-            queryset = queryset.filter(is_movie=True)
-        elif self.request.GET.get('photos'):
-            queryset = queryset.filter(is_photo=True)
-        
-        if self.request.GET.get('screenshots'):
-            queryset = queryset.filter(is_screenshot=True)
-        
-        if self.request.GET.get('selfies'):
-            queryset = queryset.filter(is_selfie=True)
-        
-        if self.request.GET.get('portraits'):
-            queryset = queryset.filter(is_portrait=True)
-        
-        if self.request.GET.get('panoramas'):
-            queryset = queryset.filter(is_panorama=True)
-        
-        if self.request.GET.get('live_photos'):
-            queryset = queryset.filter(live_photo=True)
-        
-        if self.request.GET.get('bursts'):
-            queryset = queryset.filter(is_burst=True)
-        
-        if self.request.GET.get('hdr'):
-            queryset = queryset.filter(is_hdr=True)
-        
-        # Filter by album
-        album_id = self.request.GET.get('album')
-        if album_id:
-            queryset = queryset.filter(albums__id=album_id)
-        
-        # Filter by person
-        person_id = self.request.GET.get('person')
-        if person_id:
-            queryset = queryset.filter(persons__id=person_id)
-        
-        # Filter by keyword
-        keyword_id = self.request.GET.get('keyword')
-        if keyword_id:
-            queryset = queryset.filter(keywords__id=keyword_id)
-        
-        # Filter by label
-        label_id = self.request.GET.get('label')
-        if label_id:
-            queryset = queryset.filter(labels__id=label_id)
-        
-        # Filter by camera
-        camera_make = self.request.GET.get('camera_make')
-        if camera_make:
-            queryset = queryset.filter(camera_make=camera_make)
-        
-        camera_model = self.request.GET.get('camera_model')
-        if camera_model:
-            queryset = queryset.filter(camera_model=camera_model)
-        
-        # Filter by date range
-        date_from = self.request.GET.get('date_from')
-        date_to = self.request.GET.get('date_to')
-        if date_from:
-            queryset = queryset.filter(date__gte=date_from)
-        if date_to:
-            queryset = queryset.filter(date__lte=date_to)
-        
-        # Filter by location
-        has_location = self.request.GET.get('has_location')
-        if has_location:
-            queryset = queryset.exclude(latitude__isnull=True, longitude__isnull=True)
-        
-        # Sort options
-        sort = self.request.GET.get('sort', '-date')
-        valid_sorts = ['date', '-date', 'title', '-title', 'filename', '-filename', 
-                      '-score__overall', 'created_at', '-created_at']
-        if sort in valid_sorts:
-            if 'score__' in sort:
-                queryset = queryset.select_related('score')
-            queryset = queryset.order_by(sort)
-        
-        return queryset.prefetch_related('albums', 'persons', 'keywords', 'labels')
+        # The grid only links to each photo and its thumbnail
+        queryset = Photo.objects.only('id', 'filename')
+        if bitmap.supports(self.request.GET):
+            return bitmap.select_photos(self.request.GET, queryset)
+        return cached_photo_ids(self.request.GET, queryset)
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
-        # Add filter options to context
-        context['albums'] = Album.objects.annotate(photo_count=Count('photos')).order_by('name')
-        context['persons'] = Person.objects.annotate(photo_count=Count('photos')).order_by('name')
-        context['keywords'] = Keyword.objects.annotate(photo_count=Count('photos')).order_by('name')
-        context['labels'] = Label.objects.annotate(photo_count=Count('photos')).order_by('name')
+        # The sidebar fragment is cached under these, so the filter options
+        # below are only evaluated when it has to be rendered again
+        context['generation'] = current_generation()
+        context['filter_key'] = filter_key(self.request.GET)
+        context['photo_list_cache_timeout'] = settings.PHOTO_LIST_CACHE_TIMEOUT
+        
+        # Add filter options to context. The sidebar only offers albums; the
+        # template calls the snapshot lookup only when it renders the options
+        snapshot = get_snapshot()
+        if snapshot:
+            context['albums'] = partial(snapshot.facet_counts, 'album')
+        else:
+            context['albums'] = Album.objects.annotate(photo_count=Count('photos')).order_by('name')
         
         # Get unique camera makes and models
         context['camera_makes'] = Photo.objects.exclude(
@@ -137,6 +71,9 @@ class PhotoListView(ListView):
         
         # Pass current filters
         context['current_filters'] = self.request.GET.dict()
+        context['semantic_unavailable'] = (
+            bool(self.request.GET.get('semantic')) and not embeddings.available()
+        )
         
         return context
 
@@ -155,53 +92,148 @@ class PhotoDetailView(DetailView):
         )
 
 
+class EventListView(ListView):
+    model = Event
+    template_name = 'photos/event_list.html'
+    context_object_name = 'events'
+    paginate_by = 30
+
+
+class EventDetailView(DetailView):
+    model = Event
+    template_name = 'photos/event_detail.html'
+    context_object_name = 'event'
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        photos = self.object.photos.only('id', 'filename').order_by('date', 'id')
+        context['page_obj'] = Paginator(photos, 100).get_page(self.request.GET.get('page'))
+        return context
+
+
 @require_http_methods(["GET"])
-def photo_thumbnail(request, pk):
+async def photo_thumbnail(request, pk):
     """Serve photo thumbnail"""
-    photo = get_object_or_404(Photo, pk=pk)
-    
-    # Check if photo file exists
-    if not photo.path or not os.path.exists(photo.path):
-        return HttpResponse("Photo not found", status=404)
+    photo = await aget_object_or_404(Photo.objects.only('uuid', 'path'), pk=pk)
     
     # Generate thumbnail
-    size = int(request.GET.get('size', 300))
+    try:
+        size = int(request.GET.get('size', DEFAULT_SIZE))
+    except ValueError:
+        return HttpResponse("Invalid size", status=400)
+    if size not in settings.THUMBNAIL_SIZES:
+        return HttpResponse(f"Size must be one of {settings.THUMBNAIL_SIZES}", status=400)
     
     try:
-        img = Image.open(photo.path)
-        img.thumbnail((size, size), Image.Resampling.LANCZOS)
+        thumb_path = await media.run_blocking(cached_thumbnail, photo.uuid, size)
+        if thumb_path is None:
+            thumb_path = await media.run_render(get_thumbnail, photo.uuid, photo.path, size)
+        if thumb_path is None:
+            return HttpResponse("Photo not found", status=404)
         
-        # Save to response
-        response = HttpResponse(content_type='image/jpeg')
-        img.save(response, 'JPEG', quality=85)
-        return response
+        return HttpResponse(await media.run_blocking(_read_file, thumb_path), content_type='image/jpeg')
     except Exception as e:
         return HttpResponse(f"Error generating thumbnail: {str(e)}", status=500)
 
 
+def _read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
 @require_http_methods(["GET"])
-def photo_full(request, pk):
+async def photo_full(request, pk):
     """Serve full photo"""
-    photo = get_object_or_404(Photo, pk=pk)
+    photo = await aget_object_or_404(
+        Photo.objects.only('filename', 'path', 'path_edited'), pk=pk
+    )
     
     # Use edited version if available and requested
     use_edited = request.GET.get('edited', False)
     photo_path = photo.path_edited if use_edited and photo.path_edited else photo.path
     
-    if not photo_path or not os.path.exists(photo_path):
+    size = await media.run_blocking(media.file_size, photo_path) if photo_path else None
+    if size is None:
         return HttpResponse("Photo not found", status=404)
     
-    try:
-        with open(photo_path, 'rb') as f:
-            response = HttpResponse(f.read(), content_type='image/jpeg')
-            response['Content-Disposition'] = f'inline; filename="{photo.filename}"'
-            return response
-    except Exception as e:
-        return HttpResponse(f"Error serving photo: {str(e)}", status=500)
+    # Stream the original in chunks instead of holding it in memory
+    chunks = media.aiter_file(photo_path) if media.is_asgi(request) else media.iter_file(photo_path)
+    response = StreamingHttpResponse(chunks, content_type='image/jpeg')
+    response['Content-Length'] = size
+    response['Content-Disposition'] = f'inline; filename="{photo.filename}"'
+    return response
+
+
+# Photos looked up at a time while an archive streams
+ARCHIVE_PAGE_SIZE = 500
+
+
+def _archive_page(queryset, after):
+    return list(
+        queryset.filter(id__gt=after).order_by('id')
+        .values_list('id', 'original_filename', 'path', 'path_edited')[:ARCHIVE_PAGE_SIZE]
+    )
+
+
+def _archive_entries(rows, edited):
+    """Yield the (source path, name in the archive) of each archived photo"""
+    for pk, original_filename, path, path_edited in rows:
+        if edited and path_edited:
+            # Edits may be saved in another format than the original
+            stem = os.path.splitext(original_filename or os.path.basename(path_edited))[0]
+            yield path_edited, stem + os.path.splitext(path_edited)[1]
+        elif path:
+            yield path, original_filename or os.path.basename(path)
+
+
+def _iter_archive(queryset, edited):
+    """Yield a ZIP of the photos' files, for responses served by WSGI"""
+    archive = ZipArchive()
+    after = 0
+    while rows := _archive_page(queryset, after):
+        for source, name in _archive_entries(rows, edited):
+            yield from archive.add_file(source, name)
+        after = rows[-1][0]
+    yield archive.close()
+
+
+async def _aiter_archive(queryset, edited):
+    """Yield a ZIP of the photos' files, reading them in chunks on the media
+    thread pool and the photos a page at a time"""
+    archive = ZipArchive()
+    after = 0
+    while rows := await sync_to_async(_archive_page)(queryset, after):
+        for source, name in _archive_entries(rows, edited):
+            blocks = archive.add_file(source, name)
+            while (block := await media.run_blocking(next, blocks, None)) is not None:
+                yield block
+        after = rows[-1][0]
+    yield await media.run_blocking(archive.close)
+
+
+async def photo_archive(request):
+    """Stream a ZIP of the photos matching the PhotoListView filters, as
+    originals or, with version=edited, as edited where there is an edit"""
+    version = request.GET.get('version', 'original')
+    if version not in ('original', 'edited'):
+        return JsonResponse({'error': f'Unknown version: {version}'}, status=400)
+    queryset = await sync_to_async(filter_photos)(request.GET)
+    
+    if media.is_asgi(request):
+        blocks = _aiter_archive(queryset, version == 'edited')
+    else:
+        blocks = _iter_archive(queryset, version == 'edited')
+    response = StreamingHttpResponse(blocks, content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename="photos.zip"'
+    return response
 
 
 def stats_view(request):
     """Display library statistics"""
+    snapshot = get_snapshot()
+    if snapshot:
+        return render(request, 'photos/stats.html', {'stats': snapshot.stats()})
+    
     stats = {
         'total_photos': Photo.objects.filter(is_photo=True).count(),
         'total_videos': Photo.objects.filter(is_movie=True).count(),
@@ -230,7 +262,307 @@ def stats_view(request):
     return render(request, 'photos/stats.html', {'stats': stats})
 
 
-def search_autocomplete(request):
+def duplicates_view(request):
+    """Display clusters of visually similar photos"""
+    try:
+        threshold = int(request.GET.get('threshold', 4))
+    except ValueError:
+        return HttpResponse("Invalid threshold", status=400)
+    # Wider radii make the BK-tree visit most of the library for every photo
+    threshold = max(0, min(threshold, MAX_THRESHOLD))
+    hashed = Photo.objects.filter(phash__isnull=False)
+    
+    # Clustering the whole library is the expensive part, so cache it until
+    # any hashed photo changes. compute_photo_hashes bumps updated_at along
+    # with the hash.
+    fingerprint = hashed.aggregate(count=Count('id'), changed=Max('updated_at'))
+    changed = fingerprint['changed'].timestamp() if fingerprint['changed'] else 0
+    cache_key = f"duplicates:{threshold}:{fingerprint['count']}:{changed}"
+    clusters = cache.get(cache_key)
+    if clusters is None:
+        clusters = cluster_hashes(hashed.values_list('id', 'phash').iterator(), threshold)
+        cache.set(cache_key, clusters, 60 * 60)
+    
+    # Filter by burst
+    burst_uuid = request.GET.get('burst_uuid')
+    if burst_uuid:
+        burst_ids = set(Photo.objects.filter(burst_uuid=burst_uuid).values_list('id', flat=True))
+        clusters = [cluster for cluster in clusters if burst_ids.intersection(cluster)]
+    
+    page_obj = Paginator(clusters, 20).get_page(request.GET.get('page'))
+    
+    photos = Photo.objects.in_bulk([pk for cluster in page_obj for pk in cluster])
+    groups = [
+        sorted((photos[pk] for pk in cluster if pk in photos), key=lambda p: p.date or p.created_at)
+        for cluster in page_obj
+    ]
+    
+    return render(request, 'photos/duplicates.html', {
+        'groups': groups,
+        'page_obj': page_obj,
+        'threshold': threshold,
+        'burst_uuid': burst_uuid or '',
+    })
+
+
+def face_clusters_api(request):
+    """List clusters of unnamed faces, largest first"""
+    try:
+        page_size = max(1, min(int(request.GET.get('page_size', 50)), 200))
+        samples = max(1, min(int(request.GET.get('samples', 6)), 50))
+    except ValueError:
+        return JsonResponse({'error': 'page_size and samples must be integers'}, status=400)
+    
+    clusters = FaceCluster.objects.filter(size__gt=0).order_by('-size', 'id').values('id', 'size')
+    page_obj = Paginator(clusters, page_size).get_page(request.GET.get('page'))
+    cluster_ids = [cluster['id'] for cluster in page_obj]
+    
+    # Fetch the best few faces of every cluster on the page in one query
+    faces = Face.objects.filter(cluster_id__in=cluster_ids, person__isnull=True).annotate(
+        row=Window(
+            RowNumber(),
+            partition_by=F('cluster_id'),
+            order_by=F('quality').desc(nulls_last=True),
+        )
+    ).filter(row__lte=samples).values(
+        'id', 'cluster_id', 'photo_id', 'center_x', 'center_y', 'width', 'height'
+    )
+    faces_by_cluster = {}
+    for face in faces:
+        face['thumbnail'] = reverse('photos:photo_thumbnail', args=[face['photo_id']])
+        faces_by_cluster.setdefault(face.pop('cluster_id'), []).append(face)
+    
+    return JsonResponse({
+        'count': page_obj.paginator.count,
+        'page': page_obj.number,
+        'num_pages': page_obj.paginator.num_pages,
+        'clusters': [
+            {**cluster, 'faces': faces_by_cluster.get(cluster['id'], [])}
+            for cluster in page_obj
+        ],
+    })
+
+
+def best_photos_api(request):
+    """Top photos for a weighted combination of scores, optionally per group"""
+    try:
+        weights = ranking.parse_weights(request.GET.get('weights', 'overall:1'))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    per = request.GET.get('per') or None
+    if per and per not in ranking.GROUPINGS:
+        return JsonResponse({'error': f'Unknown grouping: {per}'}, status=400)
+    try:
+        n = max(1, min(int(request.GET.get('n', 10)), settings.RANKING_MAX_RESULTS))
+        year = int(request.GET['year']) if request.GET.get('year') else None
+    except ValueError:
+        return JsonResponse({'error': 'n and year must be integers'}, status=400)
+    
+    library = ranking.get_library()
+    groups = ranking.rank(library, weights, n=n, per=per, year=year)
+    
+    ids = [int(library.ids[row]) for _, rows, _ in groups for row in rows]
+    photos = Photo.objects.only('id', 'uuid', 'filename', 'date').in_bulk(ids)
+    
+    def serialize(rows, values):
+        results = []
+        for row in rows:
+            photo = photos.get(int(library.ids[row]))
+            if photo:
+                results.append({
+                    'id': photo.id,
+                    'uuid': photo.uuid,
+                    'filename': photo.filename,
+                    'date': photo.date,
+                    'score': round(float(values[row]), 4),
+                    'thumbnail': reverse('photos:photo_thumbnail', args=[photo.id]),
+                })
+        return results
+    
+    if per is None:
+        _, rows, values = groups[0]
+        return JsonResponse({'weights': weights, 'photos': serialize(rows, values)})
+    
+    return JsonResponse({
+        'weights': weights,
+        'per': per,
+        'groups': [
+            {'group': group, 'photos': serialize(rows, values)}
+            for group, rows, values in groups
+        ],
+    })
+
+
+# Photo columns the list API can return, besides the computed thumbnail URL
+API_FIELDS = [
+    'id', 'uuid', 'filename', 'original_filename', 'title', 'date', 'width', 'height',
+    'duration', 'latitude', 'longitude', 'camera_make', 'camera_model', 'flags',
+]
+API_DEFAULT_FIELDS = ['id', 'uuid', 'width', 'height', 'date', 'flags', 'thumbnail']
+
+
+@gzip_page
+def photo_list_api(request):
+    """Photo list as compact JSON rows, with the same filters as PhotoListView"""
+    fields = request.GET.get('fields')
+    fields = fields.split(',') if fields else API_DEFAULT_FIELDS
+    unknown = set(fields) - set(API_FIELDS) - {'thumbnail'}
+    if unknown:
+        return JsonResponse({'error': f'Unknown fields: {", ".join(sorted(unknown))}'}, status=400)
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 100)), settings.PHOTO_API_MAX_ROWS))
+    except ValueError:
+        return JsonResponse({'error': 'limit must be an integer'}, status=400)
+    
+    columns = list(dict.fromkeys([field for field in fields if field != 'thumbnail'] + ['id']))
+    try:
+        rows, next_cursor = paginate(filter_photos(request.GET), request.GET, columns, limit)
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    
+    # Fill the thumbnail URL in from a template instead of reversing per row
+    thumbnail = reverse('photos:photo_thumbnail', args=[0]).replace('/0/', '/{}/')
+    output = []
+    for row in rows:
+        values = dict(zip(columns, row))
+        values['thumbnail'] = thumbnail.format(values['id'])
+        output.append([values[field] for field in fields])
+    
+    response = {'fields': fields, 'rows': output, 'next': next_cursor}
+    if 'flags' in fields:
+        response['flag_bits'] = FLAG_BITS
+    return JsonResponse(response)
+
+
+def _export_stream(params, format):
+    params = params.copy()
+    params.pop('format', None)
+    queryset = filter_photos(params) if params else Photo.objects.order_by('id')
+    return export_stream(format, export_chunks(queryset))
+
+
+async def _aiter_blocks(stream):
+    """Pull each block of a sync generator in the thread sync views use, so
+    its database cursor stays on one connection while the response streams"""
+    next_block = sync_to_async(next)
+    try:
+        while (block := await next_block(stream, None)) is not None:
+            yield block
+    finally:
+        await sync_to_async(stream.close)()
+
+
+async def photo_export(request):
+    """Stream the metadata, scores and tag names of the filtered photos as
+    NDJSON, CSV or Parquet"""
+    format = request.GET.get('format', 'ndjson')
+    if format not in FORMATS:
+        return JsonResponse({'error': f'Unknown format: {format}'}, status=400)
+    try:
+        stream = await sync_to_async(_export_stream)(request.GET, format)
+    except ImproperlyConfigured as e:
+        return JsonResponse({'error': str(e)}, status=501)
+    
+    blocks = _aiter_blocks(stream) if media.is_asgi(request) else stream
+    response = StreamingHttpResponse(blocks, content_type=FORMATS[format])
+    response['Content-Disposition'] = f'attachment; filename="photos.{format}"'
+    return response
+
+
+def _sprite_page(params, generation):
+    """Build, or fetch from the cache, the sprite sheet for one page of results.
+
+    The sheet is cached per library generation. Returns None when generation
+    is no longer current and its sheet has left the cache, as the tiles
+    would not match the manifest built for it.
+    """
+    limit = max(1, min(int(params.get('limit', 50)), settings.SPRITE_MAX_TILES))
+    tile_size = max(16, min(int(params.get('size', 150)), settings.SPRITE_MAX_TILE))
+    columns = int(params.get('columns', 10))
+    
+    # filter_key covers the filters, cursor, limit and tile size
+    key = f'sprite:{generation}:{filter_key(params)}'
+    page = cache.get(key)
+    if page is None:
+        if generation != current_generation():
+            return None
+        rows, next_cursor = paginate(filter_photos(params), params, ['id', 'uuid', 'path'], limit)
+        tiles, image = build_sprite(rows, tile_size, columns)
+        page = {'tiles': tiles, 'tile_size': tile_size, 'next': next_cursor, 'image': image}
+        cache.set(key, page, settings.PHOTO_LIST_CACHE_TIMEOUT)
+    return page
+
+
+@require_http_methods(["GET"])
+def sprite_manifest(request):
+    """Tile offsets of the sprite sheet for a page of photo list results"""
+    generation = current_generation()
+    try:
+        page = _sprite_page(request.GET, generation)
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    except ValueError:
+        return JsonResponse({'error': 'limit, size and columns must be integers'}, status=400)
+    
+    # Pin the sheet to this generation, so a sync finishing in between
+    # cannot pair these tiles with a sheet of other photos
+    params = request.GET.copy()
+    params['generation'] = generation
+    return JsonResponse({
+        'sprite': f"{reverse('photos:sprite_sheet')}?{params.urlencode()}",
+        'tile_size': page['tile_size'],
+        'tiles': page['tiles'],
+        'next': page['next'],
+    })
+
+
+@require_http_methods(["GET"])
+def sprite_sheet(request):
+    """One JPEG holding the thumbnails of a page of photo list results"""
+    params = request.GET.copy()
+    generation = params.pop('generation', None)
+    try:
+        generation = int(generation[-1]) if generation else current_generation()
+        page = _sprite_page(params, generation)
+    except InvalidCursor:
+        return HttpResponse("Invalid cursor", status=400)
+    except ValueError:
+        return HttpResponse("limit, size, columns and generation must be integers", status=400)
+    if page is None:
+        return HttpResponse("Sprite sheet expired, fetch the manifest again", status=410)
+    
+    return HttpResponse(page['image'], content_type='image/jpeg')
+
+
+# Priorities offered when queueing a job from the jobs page
+JOB_PRIORITIES = [(0, 'Normal'), (10, 'High'), (-10, 'Low')]
+
+
+@staff_member_required
+def jobs_view(request):
+    """Queue commands and watch the job queue's throughput"""
+    if request.method == 'POST':
+        command = request.POST.get('command')
+        priority = request.POST.get('priority', '0')
+        if command in settings.JOB_COMMANDS and priority.lstrip('-').isdigit():
+            enqueue(command, priority=int(priority))
+        return redirect('photos:jobs')
+    
+    return render(request, 'photos/jobs.html', {
+        'commands': throughput(),
+        'jobs': Job.objects.all()[:50],
+        'priorities': JOB_PRIORITIES,
+    })
+
+
+def metrics_view(request):
+    """Request and sync metrics in the Prometheus text format"""
+    if not (request.user.is_staff or request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS):
+        return HttpResponse("Forbidden", status=403)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+async def search_autocomplete(request):
     """Provide autocomplete suggestions for search"""
     query = request.GET.get('q', '')
     if len(query) < 2:
@@ -238,28 +570,9 @@ def search_autocomplete(request):
     
     suggestions = []
     
-    # Search in keywords
-    keywords = Keyword.objects.filter(
-        name__icontains=query
-    ).values_list('name', flat=True)[:5]
-    suggestions.extend([{'type': 'keyword', 'value': k} for k in keywords])
-    
-    # Search in persons
-    persons = Person.objects.filter(
-        name__icontains=query
-    ).values_list('name', flat=True)[:5]
-    suggestions.extend([{'type': 'person', 'value': p} for p in persons])
-    
-    # Search in albums
-    albums = Album.objects.filter(
-        name__icontains=query
-    ).values_list('name', flat=True)[:5]
-    suggestions.extend([{'type': 'album', 'value': a} for a in albums])
-    
-    # Search in labels
-    labels = Label.objects.filter(
-        name__icontains=query
-    ).values_list('name', flat=True)[:5]
-    suggestions.extend([{'type': 'label', 'value': l} for l in labels])
-    
-    return JsonResponse({'suggestions': suggestions})
\ No newline at end of file
+    # Search in keywords, persons, albums and labels
+    for kind, model in (('keyword', Keyword), ('person', Person), ('album', Album), ('label', Label)):
+        names = model.objects.filter(name__icontains=query).values_list('name', flat=True)[:5]
+        suggestions.extend([{'type': kind, 'value': name} async for name in names])
+    
+    return JsonResponse({'suggestions': suggestions})